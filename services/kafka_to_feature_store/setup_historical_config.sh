@@ -1,7 +1,7 @@
 export KAFKA_TOPIC=ohlc_historical
 export KAFKA_CONSUMER_GROUP=ohlc_historical_consumer_group_NEW
 export FEATURE_GROUP_NAME=ohlc_feature_group
-export FEATURE_GROUP_VERSION=2
+export FEATURE_GROUP_VERSION=3
 
 # number of elements we save at once to the Hopsworks feature store
 # This value of 10080 corresponds to saving batches of 1 week of data at once
@@ -0,0 +1,15 @@
+# the features of the technical_indicators service on the historical candles, in the
+# same feature group as the live ones
+export KAFKA_TOPIC=technical_indicators_historical
+export KAFKA_CONSUMER_GROUP=technical_indicators_historical_to_feature_store_consumer_group
+export FEATURE_GROUP_NAME=technical_indicators_feature_group
+export FEATURE_GROUP_VERSION=1
+
+export BUFFER_SIZE=150000
+
+# to the offline store, to train the models on the same features
+export LIVE_OR_HISTORICAL=historical
+
+export SAVE_EVERY_N_SEC=30
+
+export CREATE_NEW_CONSUMER_GROUP=true
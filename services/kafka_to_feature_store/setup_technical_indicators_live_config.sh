@@ -0,0 +1,12 @@
+# the features of the technical_indicators service, one row per candle, in their own
+# feature group. With window_seconds in the features (technical_indicators on
+# multi-resolution candles), set FEATURE_GROUP_PRIMARY_KEY too, see the README
+export KAFKA_TOPIC=technical_indicators
+export KAFKA_CONSUMER_GROUP=technical_indicators_to_feature_store_consumer_group
+export FEATURE_GROUP_NAME=technical_indicators_feature_group
+export FEATURE_GROUP_VERSION=1
+
+# we want the features of the latest candle in the online store as soon as possible
+export BUFFER_SIZE=1
+
+export LIVE_OR_HISTORICAL=live
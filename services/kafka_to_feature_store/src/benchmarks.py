@@ -0,0 +1,136 @@
+"""
+Micro-benchmarks for the hot paths of the kafka_to_feature_store service.
+
+They do not need Kafka nor Hopsworks, so you can run them anywhere with
+
+    poetry run python -m src.benchmarks <benchmark_name>
+"""
+
+import json
+import random
+import time
+from typing import Callable, Dict, List
+
+import pandas as pd
+from loguru import logger
+
+BENCHMARKS: Dict[str, Callable[[], None]] = {}
+
+
+def benchmark(func: Callable[[], None]) -> Callable[[], None]:
+    """
+    Registers the given function as a benchmark we can run from the command line.
+    """
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def generate_messages(n_candles: int, product_ids: List[str]) -> List[bytes]:
+    """
+    Generates the values of the messages of the ohlc topic, one candle per minute and
+    per product.
+    """
+    start_ms = 1_717_000_000_000
+    messages = []
+    for i in range(n_candles):
+        price = 60_000 + random.random() * 1_000
+        messages.append(
+            json.dumps(
+                {
+                    'product_id': product_ids[i % len(product_ids)],
+                    'timestamp': start_ms + (i // len(product_ids)) * 60_000,
+                    'open': price,
+                    'high': price + random.random() * 10,
+                    'low': price - random.random() * 10,
+                    'close': price,
+                    'volume': random.random() * 10,
+                }
+            ).encode()
+        )
+    return messages
+
+
+def row_by_row(messages: List[bytes], buffer_size: int) -> List[pd.DataFrame]:
+    """
+    The loop before the ColumnarBuffer: one message at a time, decoded with
+    json.loads into a list of dicts, turned into a DataFrame row by row.
+    """
+    batches = []
+    buffer: List[dict] = []
+    for value in messages:
+        buffer.append(json.loads(value))
+        if len(buffer) >= buffer_size:
+            batches.append(pd.DataFrame(buffer))
+            buffer = []
+    if buffer:
+        batches.append(pd.DataFrame(buffer))
+    return batches
+
+
+def columnar(
+    messages: List[bytes], buffer_size: int, consume_batch_size: int
+) -> List[pd.DataFrame]:
+    """
+    The loop of the service: batches of up to `consume_batch_size` messages, decoded
+    with the loads of quixstreams straight into the columns of a ColumnarBuffer.
+    """
+    from quixstreams.utils.json import loads
+
+    from src.columnar_buffer import ColumnarBuffer
+
+    batches = []
+    buffer = ColumnarBuffer(buffer_size)
+    i = 0
+    while i < len(messages):
+        n_messages = max(min(consume_batch_size, buffer_size - len(buffer)), 1)
+        for value in messages[i : i + n_messages]:
+            buffer.append(loads(value))
+        i += n_messages
+
+        if len(buffer) >= buffer_size:
+            batches.append(buffer.to_frame())
+            buffer.clear()
+    if buffer:
+        batches.append(buffer.to_frame())
+    return batches
+
+
+@benchmark
+def consume(
+    n_candles: int = 300_000,
+    buffer_size: int = 50_000,
+    consume_batch_size: int = 10_000,
+) -> None:
+    """
+    Compares decoding the messages one by one into a list of dicts against the
+    ColumnarBuffer, from the values of the messages to the DataFrames we write to the
+    feature store.
+    """
+    messages = generate_messages(n_candles, product_ids=['BTC/USD', 'ETH/USD'])
+
+    timings = {}
+    batches = {}
+    for name, run in [
+        ('row_by_row', lambda: row_by_row(messages, buffer_size)),
+        ('columnar', lambda: columnar(messages, buffer_size, consume_batch_size)),
+    ]:
+        start = time.perf_counter()
+        batches[name] = run()
+        timings[name] = time.perf_counter() - start
+
+    for expected, actual in zip(batches['row_by_row'], batches['columnar']):
+        pd.testing.assert_frame_equal(expected, actual)
+
+    logger.info(f'{n_candles} candles in {len(batches["columnar"])} batches')
+    for name, seconds in timings.items():
+        logger.info(f'{name}: {n_candles / seconds:,.0f} candles/sec')
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('name', choices=sorted(BENCHMARKS))
+    args = parser.parse_args()
+
+    BENCHMARKS[args.name]()
@@ -0,0 +1,69 @@
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+
+class ColumnarBuffer:
+    """
+    A batch of candles stored as one preallocated list per column, so appending a
+    candle only sets a slot in each column, and the batch is turned into a DataFrame
+    column by column instead of row by row.
+
+    The columns are the keys of the first candle. A candle without one of them gets a
+    missing value, and a candle with new keys adds their columns. The lists have room
+    for `capacity` candles, and double their size when they are full. `clear()` drops
+    the columns, so the next batch has the columns of its own candles only.
+
+    `offsets` keeps the offset of the last message of each partition in the batch,
+    so we can commit them once the batch is written.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(capacity, 1)
+        self.columns: Dict[str, List] = {}
+        self.n_rows = 0
+
+        # (topic, partition) -> offset of the last message of the batch
+        self.offsets: Dict[Tuple[str, int], int] = {}
+
+    def __len__(self) -> int:
+        return self.n_rows
+
+    def append(self, record: dict) -> None:
+        # comparing the key views is a set comparison, so a candle with as many keys
+        # but a different one adds its column
+        if record.keys() != self.columns.keys():
+            self._add_columns(record)
+        if self.n_rows == self.capacity:
+            self._grow()
+
+        i = self.n_rows
+        for key, column in self.columns.items():
+            column[i] = record.get(key)
+        self.n_rows += 1
+
+    def clear(self) -> None:
+        # the columns of this batch would be all missing values in the next one if
+        # its candles do not have them
+        self.columns = {}
+        self.n_rows = 0
+        self.offsets = {}
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Returns the candles as a DataFrame, with the same dtypes `pd.DataFrame` infers
+        from a list of the candles.
+        """
+        return pd.DataFrame(
+            {key: column[: self.n_rows] for key, column in self.columns.items()}
+        )
+
+    def _add_columns(self, record: dict) -> None:
+        for key in record:
+            if key not in self.columns:
+                self.columns[key] = [None] * self.capacity
+
+    def _grow(self) -> None:
+        for column in self.columns.values():
+            column.extend([None] * self.capacity)
+        self.capacity *= 2
@@ -1,6 +1,6 @@
-from typing import Optional
+from typing import List, Optional
 
-from pydantic import field_validator
+from pydantic import field_validator, model_validator
 from pydantic_settings import BaseSettings
 
 
@@ -8,9 +8,21 @@ class Config(BaseSettings):
     kafka_broker_address: Optional[str] = None
     kafka_topic: str
     kafka_consumer_group: str
+
+    # where the batches the feature store keeps rejecting go, one message per candle,
+    # so they do not stall the ingestion. By default, `{kafka_topic}_dead_letter`
+    kafka_dead_letter_topic: Optional[str] = None
+
     feature_group_name: str
     feature_group_version: int
 
+    # the primary key of the feature group. The candles of trade_to_ohlc with several
+    # window sizes (OHLC_WINDOWS_SECONDS) carry a `window_seconds` that must be part of
+    # it, or the candles of different sizes overwrite each other. Hopsworks cannot
+    # change the primary key of a feature group, so this needs a new
+    # `feature_group_version`
+    feature_group_primary_key: List[str] = ['product_id', 'timestamp']
+
     # by default we want our `kafka_to_feature_store` service to run in live mode
     live_or_historical: str = 'live'
 
@@ -22,6 +34,13 @@ class Config(BaseSettings):
 
     # whether to create a new consumer group or not
     create_new_consumer_group: bool = False
+
+    # max number of messages to fetch from Kafka at once
+    consume_batch_size: int = 10_000
+
+    # how many times we try to write a batch to the feature store before we send it
+    # to `kafka_dead_letter_topic`
+    max_write_attempts: int = 10
     
     # required to authenticate with Hopsworks API
     hopsworks_project_name: str
@@ -36,5 +55,11 @@ class Config(BaseSettings):
         }, f'Invalid value for live_or_historical: {value}'
         return value
 
+    @model_validator(mode='after')
+    def default_dead_letter_topic(self):
+        if self.kafka_dead_letter_topic is None:
+            self.kafka_dead_letter_topic = f'{self.kafka_topic}_dead_letter'
+        return self
+
 
 config = Config()
\ No newline at end of file
@@ -0,0 +1,241 @@
+import queue
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import pandas as pd
+from loguru import logger
+
+from src.columnar_buffer import ColumnarBuffer
+
+
+class FeatureStoreWriter:
+    """
+    Writes batches of features to the feature store from a background thread, so we
+    keep consuming from Kafka while the feature store ingests a batch, which takes
+    seconds.
+
+    It has `n_buffers` buffers (2 by default, a double buffer) of `buffer_size`
+    candles: the poll loop fills `buffer` while the writer thread turns the others
+    into DataFrames and writes them. `flush()` hands `buffer` over
+    to the writer thread, through a queue, and swaps it for a free one. If all the
+    other buffers are still being written, there is no free one, and `flush()` returns
+    False: the poll loop must stop consuming (pause the consumer) until
+    `has_free_buffer()`, so the data we hold in memory is bounded.
+
+    A batch that fails to be written is retried, with an exponential backoff of up to
+    `max_retry_backoff_sec`, up to `max_write_attempts` attempts. In the meantime no
+    buffer is freed, so the backpressure stops the consumption instead of growing a
+    buffer forever. A batch that still fails after that, or right away if
+    `is_data_error` says the error is about its data, e.g. a column of the wrong
+    type, would fail forever and stall the ingestion. So it goes to `dead_letter`
+    instead, and we move on to the next one.
+
+    Once a batch is written, or sent to `dead_letter`, the offsets of its messages
+    are handed back to the poll loop with `pop_written_offsets()`, so it only
+    commits the offsets of the candles the feature store has.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[pd.DataFrame], None],
+        buffer_size: int,
+        n_buffers: int = 2,
+        max_write_attempts: int = 10,
+        retry_backoff_sec: float = 1,
+        max_retry_backoff_sec: float = 60,
+        is_data_error: Optional[Callable[[Exception], bool]] = None,
+        dead_letter: Optional[Callable[[pd.DataFrame, Exception], None]] = None,
+    ):
+        """
+        Args:
+            write (Callable[[pd.DataFrame], None]): Writes a batch to the feature
+                store.
+            buffer_size (int): The number of candles the buffers have room for.
+            n_buffers (int): The number of buffers, the one being filled included.
+            max_write_attempts (int): How many times we try to write a batch before
+                we give up on it.
+            retry_backoff_sec (float): How long we wait before the first retry of a
+                failed write. It doubles with each retry.
+            max_retry_backoff_sec (float): The longest we wait before retrying a
+                failed write.
+            is_data_error (Optional[Callable[[Exception], bool]]): Whether a failed
+                write would fail again with the same batch, so we do not retry it.
+                By default, we retry all errors.
+            dead_letter (Optional[Callable[[pd.DataFrame, Exception], None]]): Where
+                the batches we give up on go, with the last error. By default, they
+                are only logged.
+        """
+        assert n_buffers >= 2, 'We need at least 2 buffers, to fill one and write one'
+        assert max_write_attempts >= 1, 'We need to try to write a batch at least once'
+
+        self._write = write
+        self._max_write_attempts = max_write_attempts
+        self._retry_backoff_sec = retry_backoff_sec
+        self._max_retry_backoff_sec = max_retry_backoff_sec
+        self._is_data_error = is_data_error or (lambda error: False)
+        self._dead_letter = dead_letter
+
+        self.buffer = ColumnarBuffer(buffer_size)
+        self._free_buffers: queue.Queue = queue.Queue()
+        for _ in range(n_buffers - 1):
+            self._free_buffers.put(ColumnarBuffer(buffer_size))
+        self._pending_buffers: queue.Queue = queue.Queue(maxsize=n_buffers - 1)
+        # the `offsets` of the batches written since the last `pop_written_offsets()`
+        self._written_offsets: queue.Queue = queue.Queue()
+
+        self._thread = threading.Thread(
+            target=self._run, name='feature_store_writer', daemon=True
+        )
+
+        # updated by the writer thread only
+        self.n_batches = 0
+        self.n_rows = 0
+        self.n_failed_writes = 0
+        self.n_dead_letter_batches = 0
+        self.n_dead_letter_rows = 0
+        self.write_sec = 0.0
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def has_free_buffer(self) -> bool:
+        return not self._free_buffers.empty()
+
+    def flush(self) -> bool:
+        """
+        Hands `buffer` over to the writer thread, if it is not empty, and swaps it for
+        a free one.
+
+        Returns:
+            bool: False if there was no free buffer, so `buffer` is still ours.
+        """
+        if not self.buffer:
+            return True
+
+        try:
+            free_buffer = self._free_buffers.get_nowait()
+        except queue.Empty:
+            return False
+
+        self._pending_buffers.put_nowait(self.buffer)
+        self.buffer = free_buffer
+        return True
+
+    def pop_written_offsets(self) -> Dict[Tuple[str, int], int]:
+        """
+        Returns the offset of the last message of each partition in the batches
+        written, or sent to the dead letter, since the last call.
+        """
+        offsets: Dict[Tuple[str, int], int] = {}
+        while True:
+            try:
+                # the batches are written in order, so the later offsets win
+                offsets.update(self._written_offsets.get_nowait())
+            except queue.Empty:
+                return offsets
+
+    def close(self, timeout_sec: float = 60) -> None:
+        """
+        Writes what is left in `buffer`, waits for all the batches to be written and
+        stops the writer thread.
+
+        If the writer thread is not done within `timeout_sec`, e.g. because the
+        feature store is down, we stop waiting and log how many rows we did not
+        write. The thread is a daemon, so it does not keep the process alive.
+        """
+        deadline = time.monotonic() + timeout_sec
+
+        try:
+            if self.buffer:
+                free_buffer = self._free_buffers.get(timeout=timeout_sec)
+                self._pending_buffers.put_nowait(self.buffer)
+                self.buffer = free_buffer
+
+            self._pending_buffers.put(None, timeout=max(deadline - time.monotonic(), 0))
+        except (queue.Empty, queue.Full):
+            pass
+        self._thread.join(timeout=max(deadline - time.monotonic(), 0))
+
+        if self._thread.is_alive():
+            logger.error(
+                f'Feature store writer did not finish within {timeout_sec} seconds, '
+                f'{self._n_unwritten_rows()} rows were not written. {self.stats()}'
+            )
+            return
+        logger.info(f'Feature store writer closed. {self.stats()}')
+
+    def stats(self) -> dict:
+        return {
+            'n_batches': self.n_batches,
+            'n_rows': self.n_rows,
+            'n_failed_writes': self.n_failed_writes,
+            'n_dead_letter_batches': self.n_dead_letter_batches,
+            'n_dead_letter_rows': self.n_dead_letter_rows,
+            'write_sec': round(self.write_sec, 1),
+        }
+
+    def _run(self) -> None:
+        while True:
+            batch: Optional[ColumnarBuffer] = self._pending_buffers.get()
+            if batch is None:
+                return
+
+            self._write_with_retries(batch.to_frame())
+            self._written_offsets.put(batch.offsets)
+
+            batch.clear()
+            self._free_buffers.put(batch)
+
+    def _n_unwritten_rows(self) -> int:
+        # the buffer being written is not in any queue anymore, so it is not counted
+        return len(self.buffer) + sum(
+            len(batch) for batch in list(self._pending_buffers.queue) if batch
+        )
+
+    def _write_with_retries(self, batch: pd.DataFrame) -> None:
+        backoff_sec = self._retry_backoff_sec
+        for attempt in range(1, self._max_write_attempts + 1):
+            start = time.monotonic()
+            try:
+                self._write(batch)
+            except Exception as e:
+                self.n_failed_writes += 1
+                if self._is_data_error(e) or attempt == self._max_write_attempts:
+                    self._send_to_dead_letter(batch, e, attempt)
+                    return
+
+                logger.error(
+                    f'Failed to push {len(batch)} rows to the feature store: {e}. '
+                    f'Retrying in {backoff_sec:.0f} seconds'
+                )
+                time.sleep(backoff_sec)
+                backoff_sec = min(backoff_sec * 2, self._max_retry_backoff_sec)
+                continue
+
+            seconds = time.monotonic() - start
+            self.n_batches += 1
+            self.n_rows += len(batch)
+            self.write_sec += seconds
+            logger.debug(
+                f'Pushed {len(batch)} rows to the feature store in {seconds:.1f} '
+                f'seconds. {self.stats()}'
+            )
+            return
+
+    def _send_to_dead_letter(
+        self, batch: pd.DataFrame, error: Exception, n_attempts: int
+    ) -> None:
+        self.n_dead_letter_batches += 1
+        self.n_dead_letter_rows += len(batch)
+        logger.error(
+            f'Giving up on {len(batch)} rows after {n_attempts} attempts: {error!r}. '
+            f'{self.stats()}'
+        )
+        if self._dead_letter is None:
+            return
+
+        try:
+            self._dead_letter(batch, error)
+        except Exception as e:
+            logger.error(f'Failed to send {len(batch)} rows to the dead letter: {e!r}')
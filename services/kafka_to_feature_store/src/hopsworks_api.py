@@ -1,63 +1,167 @@
-from typing import List
+from typing import List, Optional
 
 import hopsworks
 import pandas as pd
+from hsfs.feature_group import FeatureGroup
+from loguru import logger
 
 from src.config import config
 
+# status codes of the Hopsworks REST API when the API key or the session is not
+# valid anymore
+AUTH_ERROR_STATUS_CODES = {401, 403}
 
-def push_data_to_feature_store(
-    feature_group_name: str,
-    feature_group_version: int,
-    data: List[dict],
-    online_or_offline: str,
-) -> None:
+# status codes of the Hopsworks REST API for a request that may work if we send it
+# again as is
+RETRYABLE_CLIENT_ERROR_STATUS_CODES = {408, 429}
+
+
+def is_auth_error(error: Exception) -> bool:
     """
-    Pushes the given `data` to the feature store, writing it to the feature group
-    with name `feature_group_name` and version `feature_group_version`.
-
-    Args:
-        feature_group_name (str): The name of the feature group to write to.
-        feature_group_version (int): The version of the feature group to write to.
-        data (List[dict]): The data to write to the feature store.
-        online_or_offline (str): Whether we are saving the `data` to the online or offline
-        feature group
-
-    Returns:
-        None
+    Returns whether the `error` is Hopsworks rejecting our session, after which we
+    need to log in again.
     """
-    # Authenticate with Hopsworks API
-    project = hopsworks.login(
-        project=config.hopsworks_project_name,
-        api_key_value=config.hopsworks_api_key,
-    )
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None) in AUTH_ERROR_STATUS_CODES
+
+
+def is_data_error(error: Exception) -> bool:
+    """
+    Returns whether the `error` is about the data we tried to write, e.g. a column of
+    the wrong type or a schema the feature group does not have, so writing the same
+    data again would fail again.
+    """
+    if isinstance(error, (ValueError, TypeError, KeyError)):
+        return True
 
-    # Get the feature store
-    feature_store = project.get_feature_store()
-
-    # Get or create the feature group we will be saving feature data to
-    # Get or create the 'transactions' feature group
-    ohlc_feature_group = feature_store.get_or_create_feature_group(
-        name=feature_group_name,
-        version=feature_group_version,
-        description='OHLC data coming from Kraken',
-        primary_key=['product_id', 'timestamp'],
-        event_time='timestamp',
-        online_enabled=True,
+    response = getattr(error, 'response', None)
+    status_code = getattr(response, 'status_code', None)
+    return (
+        status_code is not None
+        and 400 <= status_code < 500
+        and status_code not in AUTH_ERROR_STATUS_CODES
+        and status_code not in RETRYABLE_CLIENT_ERROR_STATUS_CODES
     )
 
-    # breakpoint()
 
-    # transform the data (dict) into a pandas dataframe
-    data = pd.DataFrame(data)
+class FeatureStoreClient:
+    """
+    A long-lived client to write to the feature group with name `feature_group_name`
+    and version `feature_group_version`, and primary key `primary_key`.
+
+    Logging in to Hopsworks and getting the feature store and the feature group take
+    several round trips, so we do it on the first push only, and reuse the handles
+    for all the next ones. We only log in again when Hopsworks rejects our session.
+
+    The Hopsworks credentials are read from the config.
+    """
+
+    def __init__(
+        self,
+        feature_group_name: str,
+        feature_group_version: int,
+        primary_key: Optional[List[str]] = None,
+    ):
+        self.feature_group_name = feature_group_name
+        self.feature_group_version = feature_group_version
+        self.primary_key = primary_key or ['product_id', 'timestamp']
+
+        self._feature_group: Optional[FeatureGroup] = None
+
+        # number of times we logged in to Hopsworks
+        self.sessions_created = 0
+
+    def push_data_to_feature_store(
+        self,
+        data: pd.DataFrame,
+        online_or_offline: str,
+    ) -> None:
+        """
+        Pushes the given `data` to the feature group.
+
+        If Hopsworks rejects our session, we log in again and retry once. Any other
+        error is raised.
+
+        Candles with a `window_seconds` need it in the primary key, otherwise the
+        candles of different window sizes would overwrite each other, so we raise
+        instead of writing them.
+
+        Args:
+            data (pd.DataFrame): The data to write to the feature store.
+            online_or_offline (str): Whether we are saving the `data` to the online or
+                offline feature group
+
+        Returns:
+            None
+        """
+        if (
+            'window_seconds' in data.columns
+            and 'window_seconds' not in self.primary_key
+        ):
+            raise ValueError(
+                'The candles have several window sizes, add window_seconds to '
+                'FEATURE_GROUP_PRIMARY_KEY, with a new FEATURE_GROUP_VERSION'
+            )
+
+        try:
+            self._insert(data, online_or_offline)
+        except Exception as e:
+            if not is_auth_error(e):
+                raise
+            logger.warning(f'Hopsworks session is not valid anymore: {e}')
+            self._reset()
+            self._insert(data, online_or_offline)
+
+    def stats(self) -> dict:
+        return {'sessions_created': self.sessions_created}
+
+    def _insert(self, data: pd.DataFrame, online_or_offline: str) -> None:
+        self._get_feature_group().insert(
+            data,
+            write_options={
+                'start_offline_materialization': True
+                if online_or_offline == 'offline'
+                else False
+            },
+        )
+
+    def _get_feature_group(self) -> FeatureGroup:
+        """
+        Returns (and possibly creates) the feature group we will be writing to,
+        logging in to Hopsworks if we have no session yet.
+        """
+        if self._feature_group is not None:
+            return self._feature_group
+
+        # Authenticate with Hopsworks API
+        project = hopsworks.login(
+            project=config.hopsworks_project_name,
+            api_key_value=config.hopsworks_api_key,
+        )
+        self.sessions_created += 1
+        logger.info(f'Logged in to Hopsworks. {self.stats()}')
+
+        # Get the feature store
+        feature_store = project.get_feature_store()
+
+        # Get or create the feature group we will be saving feature data to
+        self._feature_group = feature_store.get_or_create_feature_group(
+            name=self.feature_group_name,
+            version=self.feature_group_version,
+            description='OHLC data coming from Kraken',
+            primary_key=self.primary_key,
+            event_time='timestamp',
+            online_enabled=True,
+        )
 
-    # Write the data to the feature group
+        return self._feature_group
 
-    ohlc_feature_group.insert(
-        data,
-        write_options={
-            'start_offline_materialization': True
-            if online_or_offline == 'offline'
-            else False
-        },
-    )
\ No newline at end of file
+    def _reset(self) -> None:
+        """
+        Drops the session and the handles, so the next push logs in again.
+        """
+        self._feature_group = None
+        try:
+            hopsworks.logout()
+        except Exception as e:
+            logger.debug(f'Could not log out from Hopsworks: {e}')
@@ -1,10 +1,12 @@
-import json
-from typing import Optional
+from typing import List, Optional
 
+import pandas as pd
+from confluent_kafka import Consumer, KafkaException, TopicPartition
 from loguru import logger
 from quixstreams import Application
+from quixstreams.utils.json import dumps, loads
 
-from src.hopsworks_api import push_data_to_feature_store
+from src.feature_store_writer import FeatureStoreWriter
 
 
 def get_current_utc_sec() -> int:
@@ -22,16 +24,160 @@ def get_current_utc_sec() -> int:
     return int(datetime.now(timezone.utc).timestamp())
 
 
+def consume_into_writer(
+    consumer,
+    writer: FeatureStoreWriter,
+    buffer_size: int,
+    save_every_n_sec: int,
+    consume_batch_size: int,
+) -> None:
+    """
+    Fetches the messages of the `consumer` into `writer.buffer`, and hands the buffer
+    over to the `writer` when it is full or every `save_every_n_sec` seconds.
+
+    While the writer is still busy with the previous batches, it has no free buffer
+    to swap ours for, so we pause the consumer until it has one. We keep polling in
+    the meantime, so we stay in the consumer group.
+
+    It runs until the `consumer` raises.
+
+    Args:
+        consumer: The confluent_kafka consumer, subscribed to the input topic.
+        writer (FeatureStoreWriter): The writer we hand the batches over to.
+        buffer_size (int): The number of messages of a batch.
+        save_every_n_sec (int): The max seconds to wait before handing a batch over.
+        consume_batch_size (int): The max number of messages we fetch at once.
+
+    Returns:
+        None
+    """
+    # get current UTC time in seconds
+    last_saved_to_feature_store_ts = get_current_utc_sec()
+
+    # when was the consumer paused because the writer was still busy with the
+    # previous batches, if it is
+    paused_since_sec = None
+
+    while True:
+        store_written_offsets(consumer, writer)
+
+        if paused_since_sec is not None and writer.has_free_buffer():
+            consumer.resume(consumer.assignment())
+            logger.info(
+                'Writer caught up, resuming consumption after '
+                f'{get_current_utc_sec() - paused_since_sec} seconds'
+            )
+            paused_since_sec = None
+
+        # number of seconds since the last time we saved data to the feature store
+        sec_since_last_saved = get_current_utc_sec() - last_saved_to_feature_store_ts
+
+        # if the buffer is full or we have hit the timer limit, we hand it over to the
+        # writer. We do it before fetching, so a full buffer goes right after a resume
+        if (len(writer.buffer) >= buffer_size) or (
+            sec_since_last_saved >= save_every_n_sec
+        ):
+            if writer.flush():
+                last_saved_to_feature_store_ts = get_current_utc_sec()
+
+            elif paused_since_sec is None:
+                # the writer is still busy with the previous batches. We stop
+                # fetching messages until it is done
+                consumer.pause(consumer.assignment())
+                paused_since_sec = get_current_utc_sec()
+                logger.warning(
+                    'Writer is busy, pausing consumption. '
+                    f'Buffer size={len(writer.buffer)}'
+                )
+
+        # we fetch the messages in batches, but no more than the buffer has room for,
+        # so in live mode (buffer_size=1) we do not wait for a batch that never fills.
+        # While paused, it returns no messages
+        messages = consumer.consume(
+            num_messages=max(
+                min(consume_batch_size, buffer_size - len(writer.buffer)), 1
+            ),
+            timeout=1,
+        )
+
+        if not messages:
+            logger.debug('No new messages in the input topic')
+            logger.debug(
+                f'Last saved to feature store {sec_since_last_saved} seconds ago '
+                f'(limit={save_every_n_sec})'
+            )
+            continue
+
+        # we decode the messages straight into the columns of the buffer
+        for msg in messages:
+            if msg.error():
+                # We have a message but it is an error.
+                # We just log the error and continue
+                logger.error(f'Kafka error: {msg.error()}')
+                continue
+
+            writer.buffer.append(loads(msg.value()))
+            writer.buffer.offsets[(msg.topic(), msg.partition())] = msg.offset()
+
+
+def store_written_offsets(consumer, writer: FeatureStoreWriter) -> None:
+    """
+    Stores the offsets of the batches the `writer` wrote, or sent to the dead letter,
+    since the last call, so the consumer commits them. The offsets of the candles
+    still in the buffers are not stored, so after a crash we consume them again.
+    """
+    offsets = writer.pop_written_offsets()
+    if not offsets:
+        return
+
+    try:
+        consumer.store_offsets(
+            offsets=[
+                # the committed offset is the one of the next message to consume
+                TopicPartition(topic, partition, offset + 1)
+                for (topic, partition), offset in offsets.items()
+            ]
+        )
+    except KafkaException as e:
+        # e.g. a partition we lost in a rebalance. Its new owner consumes the
+        # candles again, and the feature store overwrites them by primary key
+        logger.warning(f'Could not store the offsets {offsets}: {e}')
+
+
+def send_to_dead_letter_topic(
+    producer, topic_name: str, batch: pd.DataFrame, error: Exception
+) -> None:
+    """
+    Produces the candles of a `batch` the feature store rejected to the Kafka topic
+    `topic_name`, one message per candle, with the `error` in the headers, so we can
+    look into them and replay them.
+    """
+    for record in batch.to_dict('records'):
+        product_id = record.get('product_id')
+        producer.produce(
+            topic=topic_name,
+            key=product_id.encode() if isinstance(product_id, str) else None,
+            value=dumps(record),
+            headers=[('error', repr(error).encode())],
+        )
+    producer.flush()
+    logger.warning(f'Sent {len(batch)} rows to the dead letter topic {topic_name}')
+
+
 def kafka_to_feature_store(
     kafka_topic: str,
     kafka_broker_address: str,
     kafka_consumer_group: str,
     feature_group_name: str,
     feature_group_version: int,
+    feature_group_primary_key: Optional[List[str]] = None,
     buffer_size: Optional[int] = 1,
     live_or_historical: Optional[str] = 'live',
     save_every_n_sec: Optional[int] = 600,
     create_new_consumer_group: Optional[bool] = False,
+    consume_batch_size: Optional[int] = 10_000,
+    kafka_dead_letter_topic: Optional[str] = None,
+    max_write_attempts: Optional[int] = 10,
 ) -> None:
     """
     Reads `ohlc` data from the Kafka topic and writes it to the feature store.
@@ -44,6 +190,8 @@ def kafka_to_feature_store(
         kafka_consumer_group (str): The Kafka consumer group we use for reading messages.
         feature_group_name (str): The name of the feature group to write to.
         feature_group_version (int): The version of the feature group to write to.
+        feature_group_primary_key (Optional[List[str]]): The primary key of the
+            feature group. By default, ['product_id', 'timestamp'].
         buffer_size (int): The number of messages to read from Kafka before writing to the feature store.
         live_or_historical (str): Whether we are saving live data to the Feature or historical data.
             Live data goes to the online feature store
@@ -51,6 +199,11 @@ def kafka_to_feature_store(
         save_every_n_sec (int): The max seconds to wait before writing the data to the
             feature store.
         create_new_consumer_group (bool): Whether to create a new consumer group or not.
+        consume_batch_size (int): The max number of messages we fetch from Kafka at once.
+        kafka_dead_letter_topic (str): The Kafka topic the batches the feature store
+            keeps rejecting go to. By default, `{kafka_topic}_dead_letter`.
+        max_write_attempts (int): How many times we try to write a batch to the
+            feature store before we send it to `kafka_dead_letter_topic`.
 
     Returns:
         None
@@ -69,101 +222,87 @@ def kafka_to_feature_store(
 
     # breakpoint()
 
+    auto_offset_reset = 'earliest' if live_or_historical == 'historical' else 'latest'
+
     app = Application(
         broker_address=kafka_broker_address,
         consumer_group=kafka_consumer_group,
-        auto_offset_reset="earliest" if live_or_historical == 'historical' else "latest",
+        auto_offset_reset=auto_offset_reset,
         # auto_offset_reset='latest',
     )
 
     # let's connect the app to the input topic
     topic = app.topic(name=kafka_topic, value_serializer='json')
 
-    # get current UTC time in seconds
-    last_saved_to_feature_store_ts = get_current_utc_sec()
-
-    # contains the list of trades to be written to the feature store at once
-    # TODO: handle the case where there the last batch is not full but no more data is
-    # coming. With the current implementation we can have up to (buffer_size - 1) messages
-    # in the buffer that will never be written to the feature store.
-    buffer = []
+    # the candles the feature store rejects go there, instead of stalling the
+    # ingestion
+    dead_letter_topic = app.topic(
+        name=kafka_dead_letter_topic or f'{kafka_topic}_dead_letter',
+        value_serializer='json',
+    )
 
-    # Create a consumer and start a polling loop
-    with app.get_consumer() as consumer:
-        consumer.subscribe(topics=[topic.name])
+    # imported here, as it needs hopsworks and the credentials of the config, which
+    # the tests of the poll loop do not
+    from src.hopsworks_api import FeatureStoreClient, is_data_error
 
-        while True:
-            msg = consumer.poll(1)
+    # one Hopsworks session and feature group handle for all the batches
+    feature_store = FeatureStoreClient(
+        feature_group_name=feature_group_name,
+        feature_group_version=feature_group_version,
+        primary_key=feature_group_primary_key,
+    )
 
-            # number of seconds since the last time we saved data to the feature store
-            sec_since_last_saved = (
-                get_current_utc_sec() - last_saved_to_feature_store_ts
-            )
+    online_or_offline = 'online' if live_or_historical == 'live' else 'offline'
 
-            if (msg is not None) and msg.error():
-                # We have a message but it is an error.
-                # We just log the error and continue
-                logger.error('Kafka error:', msg.error())
-                continue
-
-            elif (msg is None) and (sec_since_last_saved < save_every_n_sec):
-                # There are no new messages in the input topic and we haven't hit the timer
-                # limit yet. We skip and continue polling messages from Kafka.
-                logger.debug('No new messages in the input topic')
-                logger.debug(
-                    f'Last saved to feature store {sec_since_last_saved} seconds ago (limit={save_every_n_sec})'
-                )
-                # logger.debug(f'We have not hit the {save_every_n_sec} second limit.')
-                continue
+    # Create a producer for the dead letter topic. It also creates the topics
+    with app.get_producer() as producer:
+        # The Consumer of quixstreams 2.5.1 does not expose `consume`, which fetches
+        # the messages in batches, so we create a confluent_kafka Consumer with the
+        # settings of the app. It commits every 5 seconds the offsets we stored, which
+        # are the ones of the batches the writer is done with only
+        consumer = Consumer(
+            {
+                'bootstrap.servers': kafka_broker_address,
+                'group.id': kafka_consumer_group,
+                'auto.offset.reset': auto_offset_reset,
+                'enable.auto.commit': True,
+                'enable.auto.offset.store': False,
+            }
+        )
+        consumer.subscribe([topic.name])
 
-            else:
-                # either we have a message or we have hit the timer limit
-                # if we have a message we need to add it to the buffer
-                if msg is not None:
-                    # append the data to the buffer
-                    ohlc = json.loads(msg.value().decode('utf-8'))
-                    buffer.append(ohlc)
-                    logger.debug(
-                        f'Message {ohlc} was pushed to buffer. Buffer size={len(buffer)}'
-                    )
-
-                    # # Store the offset of the processed message on the Consumer
-                    # # for the auto-commit mechanism.
-                    # # It will send it to Kafka in the background.
-                    # # Storing offset only after the message is processed enables at-least-once delivery
-                    # # guarantees.
-                    # consumer.store_offsets(message=msg)
-
-                # if the buffer is full or we have hit the timer limit,
-                # we write the data to the feature store
-                if (len(buffer) >= buffer_size) or (
-                    sec_since_last_saved >= save_every_n_sec
-                ):
-                    # if the buffer is not empty we write the data to the feature store
-                    if len(buffer) > 0:
-                        try:
-                            push_data_to_feature_store(
-                                feature_group_name=feature_group_name,
-                                feature_group_version=feature_group_version,
-                                data=buffer,
-                                online_or_offline='online'
-                                if live_or_historical == 'live'
-                                else 'offline',
-                            )
-                            logger.debug('Data pushed to the feature store')
-
-                        except Exception as e:
-                            logger.error(
-                                f'Failed to push data to the feature store: {e}'
-                            )
-                            continue
-
-                        # reset the buffer
-                       
-                        buffer = []
-
-                        last_saved_to_feature_store_ts = get_current_utc_sec()
+        # the batches are written to the feature store from a background thread, so
+        # we keep consuming while the feature store ingests one. `writer.buffer`
+        # contains the candles of the next batch
+        writer = FeatureStoreWriter(
+            write=lambda data: feature_store.push_data_to_feature_store(
+                data=data, online_or_offline=online_or_offline
+            ),
+            buffer_size=buffer_size,
+            max_write_attempts=max_write_attempts,
+            is_data_error=is_data_error,
+            dead_letter=lambda batch, error: send_to_dead_letter_topic(
+                producer, dead_letter_topic.name, batch, error
+            ),
+        )
+        writer.start()
 
+        try:
+            consume_into_writer(
+                consumer,
+                writer,
+                buffer_size=buffer_size,
+                save_every_n_sec=save_every_n_sec,
+                consume_batch_size=consume_batch_size,
+            )
+        finally:
+            # write what is left in the buffer before we stop, and commit the
+            # offsets of what was written. If the writer gave up, the offsets of the
+            # candles it did not write are not committed
+            writer.close()
+            store_written_offsets(consumer, writer)
+            consumer.close()
+            logger.info(f'Feature store client closed. {feature_store.stats()}')
 
 if __name__ == '__main__':
     from src.config import config
@@ -177,10 +316,14 @@ if __name__ == '__main__':
             kafka_consumer_group=config.kafka_consumer_group,
             feature_group_name=config.feature_group_name,
             feature_group_version=config.feature_group_version,
+            feature_group_primary_key=config.feature_group_primary_key,
             buffer_size=config.buffer_size,
             live_or_historical=config.live_or_historical,
             save_every_n_sec=config.save_every_n_sec,
             create_new_consumer_group=config.create_new_consumer_group,
+            consume_batch_size=config.consume_batch_size,
+            kafka_dead_letter_topic=config.kafka_dead_letter_topic,
+            max_write_attempts=config.max_write_attempts,
         )
     except KeyboardInterrupt:
         logger.info('Exiting neatly!')
\ No newline at end of file
@@ -0,0 +1,36 @@
+import pandas as pd
+
+from src.columnar_buffer import ColumnarBuffer
+
+
+def test_matches_the_dataframe_of_the_candles():
+    candles = [
+        {'product_id': 'BTC/USD', 'timestamp': 1, 'close': 100.0},
+        {'product_id': 'ETH/USD', 'timestamp': 1, 'close': 10.0},
+        {'product_id': 'BTC/USD', 'timestamp': 2, 'close': 101.0},
+    ]
+    # room for 2 candles, so it grows
+    buffer = ColumnarBuffer(capacity=2)
+    for candle in candles:
+        buffer.append(candle)
+
+    pd.testing.assert_frame_equal(buffer.to_frame(), pd.DataFrame(candles))
+
+
+def test_adds_a_new_key_with_the_same_number_of_keys():
+    candles = [{'a': 1, 'b': 2}, {'a': 3, 'c': 4}]
+    buffer = ColumnarBuffer(capacity=2)
+    for candle in candles:
+        buffer.append(candle)
+
+    pd.testing.assert_frame_equal(buffer.to_frame(), pd.DataFrame(candles))
+
+
+def test_clear_drops_the_columns_of_the_previous_batch():
+    buffer = ColumnarBuffer(capacity=2)
+    buffer.append({'a': 1, 'b': 2})
+    buffer.clear()
+    buffer.append({'a': 3})
+
+    assert len(buffer) == 1
+    pd.testing.assert_frame_equal(buffer.to_frame(), pd.DataFrame([{'a': 3}]))
@@ -0,0 +1,166 @@
+import threading
+import time
+
+import pytest
+
+from src.feature_store_writer import FeatureStoreWriter
+
+
+class FakeFeatureStore:
+    """
+    Keeps the batches it is asked to write, and fails with the `errors` first, or
+    waits for `release` to be set if it is given.
+    """
+
+    def __init__(self, errors=(), release=None):
+        self.errors = list(errors)
+        self.release = release
+        self.batches = []
+
+    def write(self, data) -> None:
+        if self.release is not None:
+            assert self.release.wait(timeout=5), 'The test never released the write'
+        if self.errors:
+            raise self.errors.pop(0)
+        self.batches.append(data.to_dict('records'))
+
+
+def candle(i: int) -> dict:
+    return {'product_id': 'BTC/USD', 'timestamp': i, 'close': 100.0 + i}
+
+
+def wait_for(condition) -> None:
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline, 'Timed out waiting for the writer'
+        time.sleep(0.001)
+
+
+@pytest.fixture
+def dead_letter():
+    """The batches the writer gave up on, with the error."""
+    return []
+
+
+def make_writer(feature_store, dead_letter, **kwargs) -> FeatureStoreWriter:
+    writer = FeatureStoreWriter(
+        write=feature_store.write,
+        buffer_size=2,
+        retry_backoff_sec=0.001,
+        is_data_error=lambda error: isinstance(error, ValueError),
+        dead_letter=lambda batch, error: dead_letter.append(
+            (batch.to_dict('records'), error)
+        ),
+        **kwargs,
+    )
+    writer.start()
+    return writer
+
+
+def test_fills_a_buffer_while_the_other_is_written(dead_letter):
+    release = threading.Event()
+    feature_store = FakeFeatureStore(release=release)
+    writer = make_writer(feature_store, dead_letter)
+
+    writer.buffer.append(candle(0))
+    writer.buffer.append(candle(1))
+    assert writer.flush()
+
+    # the writer thread is busy with the first batch, we fill the second buffer
+    writer.buffer.append(candle(2))
+    writer.buffer.append(candle(3))
+    assert not writer.has_free_buffer()
+    assert not writer.flush()
+    assert len(writer.buffer) == 2
+
+    release.set()
+    wait_for(writer.has_free_buffer)
+    assert writer.flush()
+    writer.close(timeout_sec=5)
+
+    assert feature_store.batches == [
+        [candle(0), candle(1)],
+        [candle(2), candle(3)],
+    ]
+    assert writer.stats()['n_rows'] == 4
+
+
+def test_sends_a_batch_with_a_data_error_to_the_dead_letter_right_away(dead_letter):
+    error = ValueError('window_seconds is not in the primary key')
+    feature_store = FakeFeatureStore(errors=[error])
+    writer = make_writer(feature_store, dead_letter)
+
+    writer.buffer.append(candle(0))
+    writer.flush()
+    writer.buffer.append(candle(1))
+    writer.close(timeout_sec=5)
+
+    assert dead_letter == [([candle(0)], error)]
+    # the next batch is written
+    assert feature_store.batches == [[candle(1)]]
+    assert writer.stats()['n_failed_writes'] == 1
+    assert writer.stats()['n_dead_letter_batches'] == 1
+
+
+def test_retries_a_failed_write(dead_letter):
+    feature_store = FakeFeatureStore(errors=[ConnectionError(), ConnectionError()])
+    writer = make_writer(feature_store, dead_letter)
+
+    writer.buffer.append(candle(0))
+    writer.close(timeout_sec=5)
+
+    assert feature_store.batches == [[candle(0)]]
+    assert dead_letter == []
+    assert writer.stats()['n_failed_writes'] == 2
+
+
+def test_gives_up_after_max_write_attempts(dead_letter):
+    feature_store = FakeFeatureStore(errors=[ConnectionError()] * 3)
+    writer = make_writer(feature_store, dead_letter, max_write_attempts=3)
+
+    writer.buffer.append(candle(0))
+    writer.flush()
+    writer.buffer.append(candle(1))
+    writer.close(timeout_sec=5)
+
+    assert [batch for batch, _ in dead_letter] == [[candle(0)]]
+    assert feature_store.batches == [[candle(1)]]
+    assert writer.stats()['n_failed_writes'] == 3
+
+
+def test_keeps_writing_when_the_dead_letter_fails():
+    feature_store = FakeFeatureStore(errors=[ValueError()])
+
+    def dead_letter(batch, error):
+        raise ConnectionError('Kafka is down')
+
+    writer = FeatureStoreWriter(
+        write=feature_store.write,
+        buffer_size=2,
+        is_data_error=lambda error: isinstance(error, ValueError),
+        dead_letter=dead_letter,
+    )
+    writer.start()
+
+    writer.buffer.append(candle(0))
+    writer.flush()
+    writer.buffer.append(candle(1))
+    writer.close(timeout_sec=5)
+
+    assert feature_store.batches == [[candle(1)]]
+
+
+def test_close_gives_up_after_the_timeout(dead_letter):
+    release = threading.Event()
+    writer = make_writer(FakeFeatureStore(release=release), dead_letter)
+
+    writer.buffer.append(candle(0))
+    writer.flush()
+    writer.buffer.append(candle(1))
+
+    start = time.monotonic()
+    writer.close(timeout_sec=0.2)
+
+    assert time.monotonic() - start < 1
+    assert writer._thread.is_alive()
+    release.set()
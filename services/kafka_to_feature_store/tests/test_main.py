@@ -0,0 +1,211 @@
+import json
+import threading
+import time
+
+import pytest
+
+from src import main
+from src.feature_store_writer import FeatureStoreWriter
+from src.main import consume_into_writer, store_written_offsets
+
+
+class StopPolling(Exception):
+    pass
+
+
+class FakeMessage:
+    def __init__(self, value: dict, offset: int):
+        self._value = json.dumps(value).encode()
+        self._offset = offset
+
+    def error(self):
+        return None
+
+    def value(self) -> bytes:
+        return self._value
+
+    def topic(self) -> str:
+        return 'ohlc'
+
+    def partition(self) -> int:
+        return 0
+
+    def offset(self) -> int:
+        return self._offset
+
+
+class FakeConsumer:
+    """
+    Returns the `messages` up to `num_messages` at a time, none while paused, and
+    raises StopPolling once they are all consumed. `on_paused_poll` is called on
+    every poll while paused. `stored` has the offsets stored for the partition, at
+    each poll.
+    """
+
+    def __init__(self, messages, on_paused_poll=lambda: None):
+        self.messages = [
+            FakeMessage(value, offset) for offset, value in enumerate(messages)
+        ]
+        self.on_paused_poll = on_paused_poll
+        self.paused = False
+        self.calls = []
+        self.stored_offset = None
+        self.stored = []
+
+    def store_offsets(self, offsets):
+        ((topic_partition),) = offsets
+        assert (topic_partition.topic, topic_partition.partition) == ('ohlc', 0)
+        self.stored_offset = topic_partition.offset
+
+    def assignment(self):
+        return ['ohlc-0']
+
+    def pause(self, partitions):
+        self.paused = True
+        self.calls.append('pause')
+
+    def resume(self, partitions):
+        self.paused = False
+        self.calls.append('resume')
+
+    def consume(self, num_messages, timeout):
+        self.stored.append(self.stored_offset)
+        if self.paused:
+            self.on_paused_poll()
+            return []
+        if not self.messages:
+            raise StopPolling
+        messages = self.messages[:num_messages]
+        self.messages = self.messages[num_messages:]
+        return messages
+
+
+def candle(i: int) -> dict:
+    return {'product_id': 'BTC/USD', 'timestamp': i}
+
+
+@pytest.fixture
+def written():
+    return []
+
+
+def test_pauses_the_consumer_while_the_writer_is_busy(written):
+    release = threading.Event()
+
+    def write(data):
+        assert release.wait(timeout=5), 'The test never released the write'
+        written.append(data.to_dict('records'))
+
+    writer = FeatureStoreWriter(write=write, buffer_size=2)
+    writer.start()
+
+    buffer_lens_while_paused = []
+
+    def on_paused_poll():
+        if not release.is_set():
+            # nothing is written yet, so nothing is committed
+            assert consumer.stored_offset is None
+        buffer_lens_while_paused.append(len(writer.buffer))
+        # the writer is done with the first batch after a few polls
+        if len(buffer_lens_while_paused) == 3:
+            release.set()
+
+    consumer = FakeConsumer([candle(i) for i in range(6)], on_paused_poll)
+
+    with pytest.raises(StopPolling):
+        consume_into_writer(
+            consumer,
+            writer,
+            buffer_size=2,
+            save_every_n_sec=600,
+            consume_batch_size=10,
+        )
+    writer.close(timeout_sec=5)
+    store_written_offsets(consumer, writer)
+
+    assert consumer.calls[:2] == ['pause', 'resume']
+    # the offset of the next message to consume, once the last batch is written
+    assert consumer.stored_offset == 6
+    # no more than 2 batches in memory: one being written, one full buffer
+    assert len(buffer_lens_while_paused) >= 3
+    assert set(buffer_lens_while_paused) == {2}
+    assert written == [
+        [candle(0), candle(1)],
+        [candle(2), candle(3)],
+        [candle(4), candle(5)],
+    ]
+
+
+def test_hands_over_a_partial_batch_every_save_every_n_sec(written, monkeypatch):
+    now_sec = [1_000]
+    monkeypatch.setattr(main, 'get_current_utc_sec', lambda: now_sec[0])
+
+    writer = FeatureStoreWriter(
+        write=lambda data: written.append(data.to_dict('records')), buffer_size=100
+    )
+    writer.start()
+
+    consumer = FakeConsumer([candle(0)])
+    consume = consumer.consume
+
+    def consume_every_sec(num_messages, timeout):
+        now_sec[0] += 1
+        if now_sec[0] == 1_005:
+            raise StopPolling
+        # nothing new after the first candle
+        return consume(num_messages, timeout) if now_sec[0] == 1_001 else []
+
+    consumer.consume = consume_every_sec
+
+    with pytest.raises(StopPolling):
+        consume_into_writer(
+            consumer,
+            writer,
+            buffer_size=100,
+            save_every_n_sec=3,
+            consume_batch_size=10,
+        )
+
+    # handed over 3 seconds after the start, before the consumer stopped
+    assert len(writer.buffer) == 0
+    writer.close(timeout_sec=5)
+    assert written == [[candle(0)]]
+
+
+def test_stores_the_offsets_of_the_written_batches_only(written):
+    release = threading.Event()
+
+    def write(data):
+        assert release.wait(timeout=5), 'The test never released the write'
+        written.append(data.to_dict('records'))
+
+    writer = FeatureStoreWriter(write=write, buffer_size=2)
+    writer.start()
+
+    consumer = FakeConsumer([candle(i) for i in range(3)])
+
+    with pytest.raises(StopPolling):
+        consume_into_writer(
+            consumer,
+            writer,
+            buffer_size=2,
+            save_every_n_sec=600,
+            consume_batch_size=10,
+        )
+
+    # the first batch is being written and the third candle is in the buffer
+    assert set(consumer.stored) == {None}
+
+    # the feature store is down, so the writer gives up on them
+    writer.close(timeout_sec=0.1)
+    store_written_offsets(consumer, writer)
+    assert consumer.stored_offset is None
+
+    # the feature store is back, and the first batch is written
+    release.set()
+    deadline = time.monotonic() + 5
+    while not writer.has_free_buffer():
+        assert time.monotonic() < deadline, 'Timed out waiting for the writer'
+        time.sleep(0.001)
+    store_written_offsets(consumer, writer)
+    assert consumer.stored_offset == 2
@@ -39,6 +39,13 @@ def interpolate_missing_candles(
     # we have to forward fill the product_id as well
     ohlc_data['product_id'].ffill(inplace=True)
 
+    # candles without trades have no volume, and their VWAP is their close price
+    for column in ['volume', 'trade_count', 'buy_volume', 'sell_volume']:
+        if column in ohlc_data.columns:
+            ohlc_data[column] = ohlc_data[column].fillna(0)
+    if 'vwap' in ohlc_data.columns:
+        ohlc_data['vwap'] = ohlc_data['vwap'].fillna(ohlc_data['close'])
+
     # reset the index
     ohlc_data.reset_index(inplace=True)
 
@@ -1,5 +1,6 @@
 from typing import Optional
 
+import numpy as np
 import pandas as pd
 import talib
 
@@ -10,6 +11,7 @@ def add_features(
         rsi_timeperiod: Optional[int] = 14,
         momentum_timeperiod: Optional[int] = 14, 
         volatility_timeperiod: Optional[int] = 5,
+        volume_timeperiod: Optional[int] = 20,
         fillna: Optional[bool] = True,
 )-> pd.DataFrame:
     """
@@ -19,6 +21,9 @@ def add_features(
      - Momentum indicator -> `momentum` column
      - Standard deviation -> `std` column
  
+     - Volume features, if the candles have volumes -> `vwap_deviation`,
+       `order_flow_imbalance`, `relative_volume` columns
+
      - Last observed target -> `last_observed_target` column
      - Temporal features -> `day_of_week`, `hour_of_day`, `minute_of_hour` columns
  
@@ -29,6 +34,8 @@ def add_features(
          - rsi_timeperiod: int: the time period for the RSI indicator
          - momentum_timeperiod: int: the time period for the momentum indicator
          - volatility_timeperiod: int: the time period for the standard deviation    
+         - volume_timeperiod: int: the time period of the average volume we compare
+           the volume of each candle to
  
      Returns:
          - pd.DataFrame: the input DataFrame with the new columns
@@ -38,6 +45,10 @@ def add_features(
     X_ = add_momentum_indicators(X, rsi_timeperiod, momentum_timeperiod)
     X_ = add_volatility_indicators(X_, timeperiod=volatility_timeperiod)
     X_ = add_macd_indicator(X_, fillna=fillna)
+    if 'volume' in X_.columns:
+        # candles from the feature group versions before we aggregated volumes
+        # do not have them
+        X_ = add_volume_features(X_, timeperiod=volume_timeperiod, fillna=fillna)
     X_ = add_last_observed_target(
                 X_,
                 n_candles_into_future = n_candles_into_future,
@@ -146,6 +157,35 @@ def add_volatility_indicators(
 
 
 
+def add_volume_features(
+        X: pd.DataFrame,
+        timeperiod: Optional[int] = 20,
+        fillna: Optional[bool] = True,
+)-> pd.DataFrame:
+    """
+    Adds features from the volume aggregates of the candles, that `trade_to_ohlc`
+    computes in the same pass as the prices:
+
+     - `vwap_deviation`: how far the close price is from the VWAP of the candle
+     - `order_flow_imbalance`: between -1 (only sells) and 1 (only buys)
+     - `relative_volume`: the volume of the candle over the average volume of the
+       last `timeperiod` candles
+    """
+    X_ = X.copy()
+    X_['vwap_deviation'] = X_['close'] / X_['vwap'] - 1
+    X_['order_flow_imbalance'] = (
+        (X_['buy_volume'] - X_['sell_volume']) / X_['volume']
+    )
+    X_['relative_volume'] = X_['volume'] / talib.SMA(X_['volume'], timeperiod=timeperiod)
+
+    if fillna:
+        # candles without volume divide by 0
+        for column in ['vwap_deviation', 'order_flow_imbalance', 'relative_volume']:
+            X_[column] = X_[column].replace([np.inf, -np.inf], np.nan).fillna(0)
+
+    return X_
+
+
 def add_last_observed_target(
     X: pd.DataFrame,
     n_candles_into_future: int,
@@ -166,7 +206,7 @@ def add_last_observed_target(
  
     X_['last_observed_target'] = X_['close'] \
              .pct_change(n_candles_into_future)
-    X_['last_observed_target'].fillna(0, inplace=True)
+    X_['last_observed_target'] = X_['last_observed_target'].fillna(0)
     return X_
 
 
@@ -184,6 +184,12 @@ def train(
          'hour_of_day',
          'minute_of_hour',
     ]
+    if 'volume' in X_train.columns:
+        features_to_use += [
+            'vwap_deviation',
+            'order_flow_imbalance',
+            'relative_volume',
+        ]
     X_train = X_train[features_to_use]
     X_test = X_test[features_to_use]
     # log the shapes of X_train, y_train, X_test, y_test
@@ -389,6 +395,13 @@ def interpolate_missing_candles(
  
      # we have to forward fill the product_id as well
     ohlc_data['product_id'].ffill(inplace=True)
+
+    # candles without trades have no volume, and their VWAP is their close price
+    for column in ['volume', 'trade_count', 'buy_volume', 'sell_volume']:
+        if column in ohlc_data.columns:
+            ohlc_data[column] = ohlc_data[column].fillna(0)
+    if 'vwap' in ohlc_data.columns:
+        ohlc_data['vwap'] = ohlc_data['vwap'].fillna(ohlc_data['close'])
  
      # reset the index
     ohlc_data.reset_index(inplace=True)
@@ -402,7 +415,7 @@ if __name__ == '__main__':
  
     train(
         feature_view_name='ohlc_feature_view',
-        feature_view_version=1,
+        feature_view_version=2,
         ohlc_window_sec=60,
         product_id='BTC/USD',
         last_n_days_to_fetch_from_store=90,
@@ -59,6 +59,13 @@ class OhlcDataReader:
                 'timestamp': timestamp,
             } for timestamp in timestamp_keys
         ]
+
+        # the feature groups with the candles of several window sizes (see
+        # OHLC_WINDOWS_SECONDS in trade_to_ohlc) have the window size in their
+        # primary key, so the candles of different sizes do not overwrite each other
+        if 'window_seconds' in self._get_feature_view().primary_keys:
+            for primary_key in primary_keys:
+                primary_key['window_seconds'] = self.ohlc_window_sec
         
         return primary_keys
     
@@ -188,8 +195,10 @@ class OhlcDataReader:
         feature_view = self._get_feature_view()
         features = feature_view.get_batch_data()
 
-        # filter the features for the given product_id and time range
+        # filter the features for the given product_id, window size and time range
         features = features[features['product_id'] == product_id]
+        if 'window_seconds' in features.columns:
+            features = features[features['window_seconds'] == self.ohlc_window_sec]
         features = features[features['timestamp'] >= from_timestamp_ms]
         features = features[features['timestamp'] <= to_timestamp_ms]
         # sort the features by timestamp (ascending)
@@ -216,9 +225,9 @@ if __name__ == '__main__':
 
     ohlc_data_reader = OhlcDataReader(
         feature_view_name='ohlc_feature_view',
-        feature_view_version=1,
+        feature_view_version=2,
         feature_group_name='ohlc_feature_group',
-        feature_group_version=2,
+        feature_group_version=3,
         ohlc_window_sec=60
     )
 
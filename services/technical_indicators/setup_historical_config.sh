@@ -0,0 +1,6 @@
+# these are the environment variables that are used in the
+# technical_indicators service when running with historical data
+export KAFKA_INPUT_TOPIC=ohlc_historical
+export KAFKA_OUTPUT_TOPIC=technical_indicators_historical
+export KAFKA_CONSUMER_GROUP=technical_indicators_historical_consumer_group
+export OHLC_WINDOW_SECONDS=60
@@ -0,0 +1,6 @@
+# these are the environment variables that are used in the
+# technical_indicators service when running with live data
+export KAFKA_INPUT_TOPIC=ohlc
+export KAFKA_OUTPUT_TOPIC=technical_indicators
+export KAFKA_CONSUMER_GROUP=technical_indicators_consumer_group
+export OHLC_WINDOW_SECONDS=60
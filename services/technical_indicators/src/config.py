@@ -0,0 +1,65 @@
+from typing import List, Optional, Tuple
+
+from pydantic import model_validator
+from pydantic_settings import BaseSettings
+
+
+class Config(BaseSettings):
+    """
+    Configuration settings for the technical_indicators service
+
+    Attributes:
+        kafka_broker_address (str): The address of the Kafka broker.
+        kafka_input_topic (str): The name of the Kafka topic where the OHLC data is read from.
+        kafka_output_topic (str): The name of the Kafka topic where the features are written to.
+        kafka_consumer_group (str): The Kafka consumer group.
+        ohlc_window_seconds (int): The window size in seconds of the candles.
+        n_candles_into_future (int): The number of candles of the
+            `last_observed_target`, the `prediction_window_sec` of the model over its
+            `ohlc_window_sec`.
+        rsi_timeperiod (int): The time period of the RSI.
+        momentum_timeperiod (int): The time period of the momentum.
+        volatility_timeperiod (int): The time period of the standard deviation.
+        volume_timeperiod (int): The time period of the average volume.
+        cross_asset_pairs (Optional[List[Tuple[str, str]]]): If given, the pairs of
+            (product_id, benchmark_product_id) we compute the rolling correlation,
+            beta and log spread of, e.g. '[["ETH/USD", "BTC/USD"]]'.
+        kafka_cross_asset_output_topic (Optional[str]): The name of the Kafka topic
+            where the cross-asset features are written to.
+        cross_asset_window (int): The number of pairs of candles of the rolling
+            statistics.
+        cross_asset_max_lag_windows (int): How many windows the candles of a product
+            wait for the candles of the same window of the other products of its
+            pairs, e.g. when a replay gets further in one product than in another.
+
+    The time periods default to the ones of `add_features` of the price_predictor.
+
+    Values are read from environment variables.
+    If they are not found there, default values are used.
+    """
+
+    kafka_broker_address: Optional[str] = None
+    kafka_input_topic: str
+    kafka_output_topic: str
+    kafka_consumer_group: str
+    ohlc_window_seconds: int
+    n_candles_into_future: int = 5
+    rsi_timeperiod: int = 14
+    momentum_timeperiod: int = 14
+    volatility_timeperiod: int = 5
+    volume_timeperiod: int = 20
+    cross_asset_pairs: Optional[List[Tuple[str, str]]] = None
+    kafka_cross_asset_output_topic: Optional[str] = None
+    cross_asset_window: int = 60
+    cross_asset_max_lag_windows: int = 1440
+
+    @model_validator(mode='after')
+    def validate_cross_asset(self):
+        if self.cross_asset_pairs:
+            assert (
+                self.kafka_cross_asset_output_topic
+            ), 'Cross-asset features need KAFKA_CROSS_ASSET_OUTPUT_TOPIC'
+        return self
+
+
+config = Config()
@@ -0,0 +1,250 @@
+"""
+Rolling statistics between the candles of pairs of products, e.g. ETH/USD against
+BTC/USD, updated in O(1) with each pair of candles of the same window.
+"""
+
+import math
+from typing import Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+from quixstreams import State
+
+from src.indicators import RingBuffer, Stateful
+
+
+class RollingPairStats(Stateful):
+    """
+    Correlation and beta of the log returns of a product against the ones of a
+    benchmark product, and z-score of the log spread between their prices, over the
+    last `window` pairs of candles.
+
+    We keep running totals of the returns, the spreads, their squares and the product
+    of the returns, so each update is O(1). The totals are recomputed from the ring
+    buffers every `window` updates, so the rounding errors of adding and removing
+    values do not build up. The spreads are far from 0 compared to how much they move,
+    so their totals are taken around `spread_shift`, the mean spread of the last
+    recompute, to not lose precision in their variance.
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self.returns = RingBuffer(window)
+        self.benchmark_returns = RingBuffer(window)
+        self.spreads = RingBuffer(window)
+        self.totals = [0.0] * 7
+        self.spread_shift: Optional[float] = None
+        self.n_updates = 0
+        self.last_close: Optional[float] = None
+        self.last_benchmark_close: Optional[float] = None
+
+    def update(self, close: float, benchmark_close: float) -> Dict[str, float]:
+        """
+        Updates the statistics with the closes of a pair of candles of the same
+        window, and returns the features of the pair. Until the window is full, all
+        but the `log_spread` are 0.
+        """
+        spread = math.log(close) - math.log(benchmark_close)
+        features = {
+            'log_spread': spread,
+            'correlation': 0.0,
+            'beta': 0.0,
+            'log_spread_zscore': 0.0,
+        }
+
+        if self.last_close is None:
+            self.last_close = close
+            self.last_benchmark_close = benchmark_close
+            self.spread_shift = spread
+            return features
+
+        x = math.log(close / self.last_close)
+        y = math.log(benchmark_close / self.last_benchmark_close)
+        self.last_close = close
+        self.last_benchmark_close = benchmark_close
+
+        evicted_x = self.returns.push(x)
+        evicted_y = self.benchmark_returns.push(y)
+        evicted_spread = self.spreads.push(spread)
+        self._add(x, y, spread, sign=1)
+        if evicted_x is not None:
+            self._add(evicted_x, evicted_y, evicted_spread, sign=-1)
+
+        self.n_updates += 1
+        if self.n_updates % self.window == 0:
+            self._recompute_totals()
+
+        if not self.returns.is_full():
+            return features
+
+        n = self.window
+        sum_x, sum_y, sum_xx, sum_yy, sum_xy, sum_s, sum_ss = self.totals
+        covariance = sum_xy / n - (sum_x / n) * (sum_y / n)
+        variance_x = sum_xx / n - (sum_x / n) ** 2
+        variance_y = sum_yy / n - (sum_y / n) ** 2
+        variance_spread = sum_ss / n - (sum_s / n) ** 2
+
+        if variance_x > 0 and variance_y > 0:
+            features['correlation'] = covariance / math.sqrt(variance_x * variance_y)
+        if variance_y > 0:
+            features['beta'] = covariance / variance_y
+        if variance_spread > 0:
+            mean_spread = self.spread_shift + sum_s / n
+            features['log_spread_zscore'] = (spread - mean_spread) / math.sqrt(
+                variance_spread
+            )
+
+        return features
+
+    def _add(self, x: float, y: float, spread: float, sign: int) -> None:
+        s = spread - self.spread_shift
+        for i, value in enumerate([x, y, x * x, y * y, x * y, s, s * s]):
+            self.totals[i] += sign * value
+
+    def _recompute_totals(self) -> None:
+        self.spread_shift = sum(self.spreads.values) / self.window
+        self.totals = [0.0] * 7
+        for x, y, spread in zip(
+            self.returns.values, self.benchmark_returns.values, self.spreads.values
+        ):
+            self._add(x, y, spread, sign=1)
+
+
+def compute_pair_features(
+    pairs: List[Tuple[str, str]],
+    window: int,
+    ohlc_window_seconds: int,
+    max_lag_windows: int = 1440,
+) -> Callable[[dict, State], List[dict]]:
+    """
+    Returns the function we `apply` on the candles of all the products of the `pairs`,
+    under a single key, to compute the features of each pair.
+
+    The candles of a product wait in the state, each under its own key, until the
+    other product of each of its pairs has its candle of the same window. When it
+    comes in, the pair of candles updates the statistics of the pair. So a product
+    can run ahead of the other, e.g. on a replay of historical candles, by up to
+    `max_lag_windows` windows. Its candles older than that are dropped, and so are
+    the ones the other products of its pairs went past without a candle of their
+    own: a window without a candle for one of the products is skipped, so the next
+    returns span several windows.
+
+    Args:
+        pairs (List[Tuple[str, str]]): The pairs of product_ids, each as
+            (product_id, benchmark_product_id).
+        window (int): The number of pairs of candles of the rolling statistics.
+        ohlc_window_seconds (int): The window size of the candles without a
+            `window_seconds`.
+        max_lag_windows (int): How many windows the candles of a product wait for
+            the candles of the same window of the other products of its pairs.
+
+    Returns:
+        Callable[[dict, State], List[dict]]: The function to pass to
+        `sdf.apply(..., stateful=True, expand=True)`.
+    """
+    # the other products of the pairs of each product
+    counterparts: Dict[str, List[str]] = {}
+    for pair in pairs:
+        for product_id, other_product_id in [pair, pair[::-1]]:
+            counterparts.setdefault(product_id, []).append(other_product_id)
+
+    def compute(candle: dict, state: State) -> List[dict]:
+        window_seconds = candle.get('window_seconds', ohlc_window_seconds)
+        window_ms = window_seconds * 1000
+        product_id = candle['product_id']
+        timestamp = candle['timestamp']
+
+        # the latest and the oldest timestamps of the candles of the product we
+        # keep in the state
+        span_key = f'candle_span_{product_id}_{window_seconds}s'
+        span = state.get(span_key)
+        if span is not None and timestamp <= span['latest']:
+            # e.g. the candles trade_to_ohlc emits again after a restart
+            return []
+
+        outputs = []
+        for pair_product_id, benchmark_product_id in pairs:
+            if product_id == pair_product_id:
+                other_product_id = benchmark_product_id
+            elif product_id == benchmark_product_id:
+                other_product_id = pair_product_id
+            else:
+                continue
+
+            other_close = state.get(
+                _candle_key(other_product_id, window_seconds, timestamp)
+            )
+            if other_close is None:
+                continue
+
+            closes = {product_id: candle['close'], other_product_id: other_close}
+
+            stats = RollingPairStats(window)
+            state_key = (
+                f'pair_{pair_product_id}_{benchmark_product_id}_{window_seconds}s'
+            )
+            saved = state.get(state_key)
+            if saved is not None:
+                stats.load_state(saved)
+            features = stats.update(
+                closes[pair_product_id], closes[benchmark_product_id]
+            )
+            state.set(state_key, stats.to_state())
+
+            output = {
+                'product_id': pair_product_id,
+                'benchmark_product_id': benchmark_product_id,
+                'timestamp': timestamp,
+                **features,
+            }
+            if 'window_seconds' in candle:
+                output['window_seconds'] = window_seconds
+            outputs.append(output)
+
+        # the candles of the product up to `expired_ms` can no longer be paired: the
+        # other products of its pairs went past them, or they waited long enough
+        passed_ms = min(
+            _latest_timestamp(state, other_product_id, window_seconds)
+            for other_product_id in counterparts[product_id]
+        )
+        expired_ms = max(passed_ms, timestamp - max_lag_windows * window_ms)
+
+        oldest_ms = timestamp
+        is_dropping = False
+        if span is not None:
+            oldest_ms = span['oldest']
+            is_dropping = passed_ms < expired_ms >= oldest_ms
+            if is_dropping and not span['is_dropping']:
+                logger.warning(
+                    f'{product_id} is more than {max_lag_windows} windows ahead of '
+                    f'{counterparts[product_id]}, so its candles stop waiting for theirs'
+                )
+            for expired_timestamp in range(
+                oldest_ms, min(expired_ms, span['latest']) + 1, window_ms
+            ):
+                state.delete(_candle_key(product_id, window_seconds, expired_timestamp))
+            oldest_ms = max(oldest_ms, expired_ms + window_ms)
+
+        if timestamp > expired_ms:
+            state.set(
+                _candle_key(product_id, window_seconds, timestamp), candle['close']
+            )
+        state.set(
+            span_key,
+            {'oldest': oldest_ms, 'latest': timestamp, 'is_dropping': is_dropping},
+        )
+
+        return outputs
+
+    return compute
+
+
+def _candle_key(product_id: str, window_seconds: int, timestamp: int) -> str:
+    return f'candle_{product_id}_{window_seconds}s_{timestamp}'
+
+
+def _latest_timestamp(state: State, product_id: str, window_seconds: int) -> float:
+    """
+    The timestamp of the last candle of the product, or -inf if it has none yet.
+    """
+    span = state.get(f'candle_span_{product_id}_{window_seconds}s')
+    return span['latest'] if span is not None else float('-inf')
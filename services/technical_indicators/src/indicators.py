@@ -0,0 +1,329 @@
+"""
+Incremental versions of the indicators `add_features` of the price_predictor computes
+with talib over the whole series of candles.
+
+Each indicator takes one close price (or volume) at a time and updates its state in
+O(1). They replicate how talib seeds and smooths each indicator, so fed with the same
+series they give the same values as talib, up to rounding.
+
+All the state is made of floats, ints and lists, so it can be saved to the state
+store of Quix Streams as it is, with `to_state()`, and restored with `load_state()`.
+"""
+
+import math
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+# talib considers these values to be zero, see TA_IS_ZERO and TA_IS_ZERO_OR_NEG
+TALIB_EPSILON = 1e-8
+
+
+class Stateful:
+    """
+    Saves and restores the attributes of the object, recursively.
+    """
+
+    def to_state(self) -> dict:
+        return {
+            name: value.to_state() if isinstance(value, Stateful) else value
+            for name, value in vars(self).items()
+        }
+
+    def load_state(self, state: dict) -> None:
+        for name, value in state.items():
+            current = getattr(self, name)
+            if isinstance(current, Stateful):
+                current.load_state(value)
+            else:
+                setattr(self, name, value)
+
+
+class RingBuffer(Stateful):
+    """
+    The last `size` values pushed.
+    """
+
+    def __init__(self, size: int):
+        self.values: List[float] = [0.0] * size
+        self.position = 0
+        self.n_values = 0
+
+    def push(self, value: float) -> Optional[float]:
+        """
+        Pushes the value, and returns the one pushed `size` values ago, if any.
+        """
+        evicted = self.values[self.position] if self.is_full() else None
+        self.values[self.position] = value
+        self.position = (self.position + 1) % len(self.values)
+        self.n_values = min(self.n_values + 1, len(self.values))
+        return evicted
+
+    def is_full(self) -> bool:
+        return self.n_values == len(self.values)
+
+
+class SMA(Stateful):
+    """
+    Simple moving average, with a running total like talib's SMA.
+    """
+
+    def __init__(self, timeperiod: int):
+        self.timeperiod = timeperiod
+        self.window = RingBuffer(timeperiod)
+        self.total = 0.0
+
+    def update(self, value: float) -> Optional[float]:
+        evicted = self.window.push(value)
+        if evicted is not None:
+            self.total -= evicted
+        self.total += value
+
+        if not self.window.is_full():
+            return None
+        return self.total / self.timeperiod
+
+
+class StdDev(Stateful):
+    """
+    Population standard deviation of the last `timeperiod` values, like talib's
+    STDDEV.
+
+    We compute the variance from the values in the window every time, instead of
+    keeping running totals of the values and their squares: it is still O(1) for a
+    fixed `timeperiod`, and the totals of squared prices lose precision with every
+    update.
+    """
+
+    def __init__(self, timeperiod: int, nbdev: float = 1):
+        self.timeperiod = timeperiod
+        self.nbdev = nbdev
+        self.window = RingBuffer(timeperiod)
+
+    def update(self, value: float) -> Optional[float]:
+        self.window.push(value)
+        if not self.window.is_full():
+            return None
+
+        values = self.window.values
+        mean = sum(values) / self.timeperiod
+        variance = sum((v - mean) * (v - mean) for v in values) / self.timeperiod
+        if variance < TALIB_EPSILON:
+            return 0.0
+        return math.sqrt(variance) * self.nbdev
+
+
+class Momentum(Stateful):
+    """
+    The change of the value over the last `timeperiod` updates, like talib's MOM.
+    """
+
+    def __init__(self, timeperiod: int):
+        self.window = RingBuffer(timeperiod)
+
+    def update(self, value: float) -> Optional[float]:
+        evicted = self.window.push(value)
+        if evicted is None:
+            return None
+        return value - evicted
+
+
+class PctChange(Stateful):
+    """
+    The relative change of the value over the last `periods` updates, like
+    `pd.Series.pct_change(periods)`.
+    """
+
+    def __init__(self, periods: int):
+        self.window = RingBuffer(periods)
+
+    def update(self, value: float) -> Optional[float]:
+        evicted = self.window.push(value)
+        if evicted is None:
+            return None
+        return value / evicted - 1
+
+
+class EMA(Stateful):
+    """
+    Exponential moving average seeded like talib's: the first value is the mean of the
+    first `timeperiod` values.
+    """
+
+    def __init__(self, timeperiod: int):
+        self.timeperiod = timeperiod
+        self.k = 2.0 / (timeperiod + 1)
+        self.seed_values: List[float] = []
+        self.value: Optional[float] = None
+
+    def seed(self, values: List[float]) -> float:
+        self.value = sum(values) / self.timeperiod
+        self.seed_values = []
+        return self.value
+
+    def update(self, value: float) -> Optional[float]:
+        if self.value is None:
+            self.seed_values.append(value)
+            if len(self.seed_values) < self.timeperiod:
+                return None
+            return self.seed(self.seed_values)
+
+        self.value = (value - self.value) * self.k + self.value
+        return self.value
+
+
+class RSI(Stateful):
+    """
+    Wilder's relative strength index, like talib's RSI: the first average gain and
+    loss are the means of the first `timeperiod` changes, and then they are smoothed
+    with a factor of 1 / `timeperiod`.
+    """
+
+    def __init__(self, timeperiod: int):
+        self.timeperiod = timeperiod
+        self.previous_value: Optional[float] = None
+        self.n_changes = 0
+        self.gain = 0.0
+        self.loss = 0.0
+
+    def update(self, value: float) -> Optional[float]:
+        if self.previous_value is None:
+            self.previous_value = value
+            return None
+
+        change = value - self.previous_value
+        self.previous_value = value
+        self.n_changes += 1
+
+        if self.n_changes > self.timeperiod:
+            self.gain *= self.timeperiod - 1
+            self.loss *= self.timeperiod - 1
+        if change < 0:
+            self.loss -= change
+        else:
+            self.gain += change
+
+        if self.n_changes < self.timeperiod:
+            return None
+
+        self.gain /= self.timeperiod
+        self.loss /= self.timeperiod
+        total = self.gain + self.loss
+        if -TALIB_EPSILON < total < TALIB_EPSILON:
+            return 0.0
+        return 100 * (self.gain / total)
+
+
+class MACD(Stateful):
+    """
+    MACD and its signal line, like talib's MACD.
+
+    talib starts both EMAs of the MACD on the same candle, the `slowperiod`-th one:
+    the slow one from the mean of the first `slowperiod` prices and the fast one from
+    the mean of the last `fastperiod` of them. The signal line then starts from the
+    mean of the first `signalperiod` MACD values, and talib only outputs the MACD from
+    there on.
+    """
+
+    def __init__(self, fastperiod: int, slowperiod: int, signalperiod: int):
+        self.fast_ema = EMA(fastperiod)
+        self.slow_ema = EMA(slowperiod)
+        self.signal_ema = EMA(signalperiod)
+        self.seed_values: List[float] = []
+
+    def update(self, value: float) -> Optional[tuple]:
+        if self.slow_ema.value is None:
+            self.seed_values.append(value)
+            if len(self.seed_values) < self.slow_ema.timeperiod:
+                return None
+            slow = self.slow_ema.seed(self.seed_values)
+            fast = self.fast_ema.seed(self.seed_values[-self.fast_ema.timeperiod :])
+            self.seed_values = []
+        else:
+            slow = self.slow_ema.update(value)
+            fast = self.fast_ema.update(value)
+
+        macd = fast - slow
+        signal = self.signal_ema.update(macd)
+        if signal is None:
+            return None
+        return macd, signal
+
+
+def _ratio(numerator: float, denominator: float) -> float:
+    """
+    The ratio, or 0 where the division by 0 gives NaN or inf in pandas, as
+    `add_volume_features` fills them with 0.
+    """
+    if denominator == 0:
+        return 0.0
+    return numerator / denominator
+
+
+class TechnicalIndicators(Stateful):
+    """
+    All the features of `add_features` of the price_predictor for one product, updated
+    one candle at a time. The periods default to the ones of `add_features`.
+
+    Missing values (before an indicator has enough candles) are 0, as with
+    `fillna=True`.
+    """
+
+    def __init__(
+        self,
+        n_candles_into_future: int,
+        rsi_timeperiod: int = 14,
+        momentum_timeperiod: int = 14,
+        volatility_timeperiod: int = 5,
+        volume_timeperiod: int = 20,
+        macd_fastperiod: int = 12,
+        macd_slowperiod: int = 26,
+        macd_signalperiod: int = 9,
+    ):
+        self.rsi = RSI(rsi_timeperiod)
+        self.momentum = Momentum(momentum_timeperiod)
+        self.std = StdDev(volatility_timeperiod)
+        self.macd = MACD(macd_fastperiod, macd_slowperiod, macd_signalperiod)
+        self.volume_sma = SMA(volume_timeperiod)
+        self.last_observed_target = PctChange(n_candles_into_future)
+
+    def update(self, candle: dict) -> Dict[str, float]:
+        """
+        Updates the indicators with the candle, and returns its features.
+        """
+        close = candle['close']
+        macd = self.macd.update(close)
+
+        features = {
+            'rsi': self.rsi.update(close) or 0.0,
+            'momentum': self.momentum.update(close) or 0.0,
+            'std': self.std.update(close) or 0.0,
+            'MACD': macd[0] if macd else 0.0,
+            'MACD_Signal': macd[1] if macd else 0.0,
+        }
+
+        if 'volume' in candle:
+            # candles from before we aggregated volumes do not have them
+            relative_volume = self.volume_sma.update(candle['volume'])
+            features['vwap_deviation'] = (
+                close / candle['vwap'] - 1 if candle['vwap'] != 0 else 0.0
+            )
+            features['order_flow_imbalance'] = _ratio(
+                candle['buy_volume'] - candle['sell_volume'], candle['volume']
+            )
+            features['relative_volume'] = (
+                _ratio(candle['volume'], relative_volume)
+                if relative_volume is not None
+                else 0.0
+            )
+
+        features['last_observed_target'] = (
+            self.last_observed_target.update(close) or 0.0
+        )
+
+        # `add_temporal_features` takes them from the timestamp in UTC
+        dt = datetime.fromtimestamp(candle['timestamp'] / 1000, tz=timezone.utc)
+        features['days_of_week'] = dt.weekday()
+        features['hour_of_day'] = dt.hour
+        features['minute_of_hour'] = dt.minute
+
+        return features
@@ -0,0 +1,254 @@
+# standard library packages
+from typing import Callable, List, Optional, Tuple
+
+# third-party packages
+from loguru import logger
+from quixstreams import Application, State
+
+# your own local packages
+from src.cross_asset import compute_pair_features
+from src.indicators import TechnicalIndicators
+
+
+def fill_missing_candles(
+    last_candle: dict, timestamp: int, window_ms: int
+) -> List[dict]:
+    """
+    Returns the candles between `last_candle` and the candle of `timestamp`, which had
+    no trades, the way `interpolate_missing_candles` of the price_predictor fills them:
+    all prices are the last close, with no volume and the close as VWAP.
+    """
+    close = last_candle['close']
+    filled_candle = {'open': close, 'high': close, 'low': close, 'close': close}
+    if 'volume' in last_candle:
+        filled_candle.update(
+            volume=0.0, vwap=close, trade_count=0, buy_volume=0.0, sell_volume=0.0
+        )
+
+    return [
+        {**filled_candle, 'timestamp': missing_timestamp}
+        for missing_timestamp in range(
+            last_candle['timestamp'] + window_ms, timestamp, window_ms
+        )
+    ]
+
+
+def compute_indicators(
+    ohlc_window_seconds: int,
+    n_candles_into_future: int,
+    rsi_timeperiod: int = 14,
+    momentum_timeperiod: int = 14,
+    volatility_timeperiod: int = 5,
+    volume_timeperiod: int = 20,
+) -> Callable[[dict, State], List[dict]]:
+    """
+    Returns the function we `apply` on the stream of candles to compute their features,
+    updating the indicators of the product in the state with each candle instead of
+    recomputing them over the last candles.
+
+    The features are the same as the ones `add_features` of the price_predictor
+    computes over the whole series of candles after `interpolate_missing_candles`, so
+    we update the indicators with the missing candles too, and skip the candles that
+    are not after the last one, e.g. the ones trade_to_ohlc emits again after a
+    restart.
+
+    Candles with a `window_seconds`, from trade_to_ohlc with several window sizes, get
+    indicators of their own window size.
+
+    Args:
+        ohlc_window_seconds (int): The window size of the candles without a
+            `window_seconds`.
+        n_candles_into_future (int): The number of candles of the
+            `last_observed_target`, as in `add_features`.
+        rsi_timeperiod (int): The time period of the RSI.
+        momentum_timeperiod (int): The time period of the momentum.
+        volatility_timeperiod (int): The time period of the standard deviation.
+        volume_timeperiod (int): The time period of the average volume of the
+            `relative_volume`.
+
+    Returns:
+        Callable[[dict, State], List[dict]]: The function to pass to
+        `sdf.apply(..., stateful=True, expand=True)`.
+    """
+
+    def compute(candle: dict, state: State) -> List[dict]:
+        window_seconds = candle.get('window_seconds', ohlc_window_seconds)
+        window_ms = window_seconds * 1000
+
+        indicators = TechnicalIndicators(
+            n_candles_into_future=n_candles_into_future,
+            rsi_timeperiod=rsi_timeperiod,
+            momentum_timeperiod=momentum_timeperiod,
+            volatility_timeperiod=volatility_timeperiod,
+            volume_timeperiod=volume_timeperiod,
+        )
+        state_key = f'indicators_{window_seconds}s'
+        saved = state.get(state_key)
+        if saved is not None:
+            last_candle = saved['last_candle']
+            if candle['timestamp'] <= last_candle['timestamp']:
+                logger.debug(f'Skipping candle we already have: {candle}')
+                return []
+
+            indicators.load_state(saved['indicators'])
+            for missing_candle in fill_missing_candles(
+                last_candle, candle['timestamp'], window_ms
+            ):
+                indicators.update(missing_candle)
+
+        features = indicators.update(candle)
+        state.set(
+            state_key,
+            {
+                'indicators': indicators.to_state(),
+                'last_candle': {
+                    key: candle[key]
+                    for key in ['timestamp', 'close', 'volume']
+                    if key in candle
+                },
+            },
+        )
+
+        output = {
+            'product_id': candle['product_id'],
+            'timestamp': candle['timestamp'],
+            'close': candle['close'],
+            **features,
+        }
+        if 'window_seconds' in candle:
+            output['window_seconds'] = window_seconds
+        return [output]
+
+    return compute
+
+
+def technical_indicators(
+    kafka_input_topic: str,
+    kafka_output_topic: str,
+    kafka_broker_address: str,
+    kafka_consumer_group: str,
+    ohlc_window_seconds: int,
+    n_candles_into_future: int,
+    rsi_timeperiod: int = 14,
+    momentum_timeperiod: int = 14,
+    volatility_timeperiod: int = 5,
+    volume_timeperiod: int = 20,
+    cross_asset_pairs: Optional[List[Tuple[str, str]]] = None,
+    kafka_cross_asset_output_topic: Optional[str] = None,
+    cross_asset_window: int = 60,
+    cross_asset_max_lag_windows: int = 1440,
+) -> None:
+    """
+    Reads candles from the kafka input topic
+    Computes their technical indicators, incrementally for each product
+    Saves the features into another kafka topic
+    Optionally, computes the rolling statistics of pairs of products and saves them
+    into their own kafka topic
+
+    Args:
+        kafka_input_topic : str : Kafka topic to read the candles from
+        kafka_output_topic : str : Kafka topic to write the features to
+        kafka_broker_address : str : Kafka broker address
+        kafka_consumer_group : str : Kafka consumer group
+        ohlc_window_seconds : int : Window size in seconds of the candles
+        n_candles_into_future : int : Number of candles of the `last_observed_target`
+        rsi_timeperiod : int : Time period of the RSI
+        momentum_timeperiod : int : Time period of the momentum
+        volatility_timeperiod : int : Time period of the standard deviation
+        volume_timeperiod : int : Time period of the average volume
+        cross_asset_pairs : Optional[List[Tuple[str, str]]] : If given, the pairs of
+            (product_id, benchmark_product_id) we compute the cross-asset features of
+        kafka_cross_asset_output_topic : Optional[str] : Kafka topic to write the
+            cross-asset features to
+        cross_asset_window : int : Number of pairs of candles of the rolling
+            statistics
+        cross_asset_max_lag_windows : int : Number of windows the candles of a
+            product wait for the ones of the other products of its pairs
+
+    Returns:
+        None
+    """
+    app = Application(
+        broker_address=kafka_broker_address,
+        consumer_group=kafka_consumer_group,
+        # a new consumer group replays the candles in the topic, which warms up the
+        # indicators
+        auto_offset_reset='earliest',
+    )
+
+    input_topic = app.topic(name=kafka_input_topic, value_serializer='json')
+    output_topic = app.topic(name=kafka_output_topic, value_serializer='json')
+
+    sdf = app.dataframe(input_topic)
+
+    # trade_to_ohlc keys the candles by product_id, so the state of the indicators of
+    # each product lives under its key
+    sdf = sdf.apply(
+        compute_indicators(
+            ohlc_window_seconds=ohlc_window_seconds,
+            n_candles_into_future=n_candles_into_future,
+            rsi_timeperiod=rsi_timeperiod,
+            momentum_timeperiod=momentum_timeperiod,
+            volatility_timeperiod=volatility_timeperiod,
+            volume_timeperiod=volume_timeperiod,
+        ),
+        stateful=True,
+        expand=True,
+    )
+
+    # a function, not the bound `logger.info`, as `group_by` deep-copies the steps
+    # before it and the logger cannot be copied
+    sdf = sdf.update(lambda features: logger.info(features))
+
+    sdf = sdf.to_topic(
+        output_topic, key=lambda features: features['product_id'].encode()
+    )
+
+    if cross_asset_pairs:
+        cross_asset_topic = app.topic(
+            name=kafka_cross_asset_output_topic, value_serializer='json'
+        )
+        product_ids = {product_id for pair in cross_asset_pairs for product_id in pair}
+
+        # the features of a pair need the candles of both products, which have
+        # different keys (and maybe partitions), so we re-key the candles of all the
+        # products of the pairs to a single key, through a repartition topic
+        sdf = sdf.filter(lambda features: features['product_id'] in product_ids)
+        sdf = sdf.group_by(lambda features: 'cross_asset', name='cross_asset')
+        sdf = sdf.apply(
+            compute_pair_features(
+                pairs=cross_asset_pairs,
+                window=cross_asset_window,
+                ohlc_window_seconds=ohlc_window_seconds,
+                max_lag_windows=cross_asset_max_lag_windows,
+            ),
+            stateful=True,
+            expand=True,
+        )
+        sdf = sdf.to_topic(
+            cross_asset_topic,
+            key=lambda features: features['product_id'].encode(),
+        )
+
+    app.run(sdf)
+
+
+if __name__ == '__main__':
+    from src.config import config
+
+    technical_indicators(
+        kafka_input_topic=config.kafka_input_topic,
+        kafka_output_topic=config.kafka_output_topic,
+        kafka_broker_address=config.kafka_broker_address,
+        kafka_consumer_group=config.kafka_consumer_group,
+        ohlc_window_seconds=config.ohlc_window_seconds,
+        n_candles_into_future=config.n_candles_into_future,
+        rsi_timeperiod=config.rsi_timeperiod,
+        momentum_timeperiod=config.momentum_timeperiod,
+        volatility_timeperiod=config.volatility_timeperiod,
+        volume_timeperiod=config.volume_timeperiod,
+        cross_asset_pairs=config.cross_asset_pairs,
+        kafka_cross_asset_output_topic=config.kafka_cross_asset_output_topic,
+        cross_asset_window=config.cross_asset_window,
+        cross_asset_max_lag_windows=config.cross_asset_max_lag_windows,
+    )
@@ -0,0 +1,30 @@
+import json
+from typing import Any, Dict
+
+import pytest
+
+
+class JsonState:
+    """
+    A stand-in for the State of Quix Streams, that goes through JSON like the state
+    store does, so we also check the indicators survive it.
+    """
+
+    def __init__(self):
+        self.values: Dict[str, str] = {}
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key not in self.values:
+            return default
+        return json.loads(self.values[key])
+
+    def set(self, key: str, value: Any) -> None:
+        self.values[key] = json.dumps(value)
+
+    def delete(self, key: str) -> None:
+        self.values.pop(key, None)
+
+
+@pytest.fixture
+def state() -> JsonState:
+    return JsonState()
@@ -0,0 +1,127 @@
+import math
+import random
+from typing import Dict, List
+
+from src.cross_asset import compute_pair_features
+
+START_MS = 1_717_000_000_000
+
+
+def generate_candles(n_windows: int, seed: int = 0) -> List[List[dict]]:
+    """
+    The candles of two correlated random walks, window by window, each with missing
+    candles.
+    """
+    rng = random.Random(seed)
+    closes = {'ETH/USD': 3_000.0, 'BTC/USD': 60_000.0}
+    windows = []
+    for i in range(n_windows):
+        market_move = rng.gauss(0, 0.001)
+        window_candles = []
+        for product_id in closes:
+            closes[product_id] *= 1 + market_move + rng.gauss(0, 0.0005)
+            if rng.random() < 0.05:
+                continue
+            window_candles.append(
+                {
+                    'product_id': product_id,
+                    'timestamp': START_MS + i * 60_000,
+                    'close': closes[product_id],
+                }
+            )
+        windows.append(window_candles)
+    return windows
+
+
+def lagging(windows: List[List[dict]], lag: int) -> List[dict]:
+    """
+    The candles with the ones of ETH/USD `lag` windows behind the ones of BTC/USD, as
+    when a replay of historical candles gets further in one product than in another.
+    """
+    eth = [c for candles in windows for c in candles if c['product_id'] == 'ETH/USD']
+    btc = [c for candles in windows for c in candles if c['product_id'] == 'BTC/USD']
+    candles = btc[:lag]
+    for i in range(max(len(btc) - lag, len(eth))):
+        candles += btc[lag + i : lag + i + 1] + eth[i : i + 1]
+    return candles
+
+
+def compute_all(candles: List[dict], state, **kwargs) -> List[dict]:
+    compute = compute_pair_features(
+        pairs=[('ETH/USD', 'BTC/USD')], window=60, ohlc_window_seconds=60, **kwargs
+    )
+    return [output for candle in candles for output in compute(candle, state)]
+
+
+def test_matches_numpy_over_each_window_of_aligned_candles(state):
+    """
+    Runs the candles in random order within a window, and checks the features of the
+    pair against numpy over each window of aligned candles.
+    """
+    import numpy as np
+
+    window = 60
+    rng = random.Random(1)
+    candles = []
+    for window_candles in generate_candles(n_windows=2_000):
+        rng.shuffle(window_candles)
+        candles += window_candles
+
+    outputs = compute_all(candles, state)
+
+    # the reference, from the windows where both products have a candle
+    by_timestamp: Dict[int, Dict[str, float]] = {}
+    for candle in candles:
+        by_timestamp.setdefault(candle['timestamp'], {})[candle['product_id']] = candle[
+            'close'
+        ]
+    aligned = [closes for closes in by_timestamp.values() if len(closes) == 2]
+    eth = np.log([closes['ETH/USD'] for closes in aligned])
+    btc = np.log([closes['BTC/USD'] for closes in aligned])
+    spreads = eth - btc
+    eth_returns = np.diff(eth)
+    btc_returns = np.diff(btc)
+
+    assert len(outputs) == len(aligned), f'{len(outputs)} vs {len(aligned)} pairs'
+    for k in range(window, len(aligned)):
+        x = eth_returns[k - window : k]
+        y = btc_returns[k - window : k]
+        window_spreads = spreads[k - window + 1 : k + 1]
+        expected = {
+            'log_spread': spreads[k],
+            'correlation': np.corrcoef(x, y)[0, 1],
+            'beta': np.cov(x, y, bias=True)[0, 1] / np.var(y),
+            'log_spread_zscore': (spreads[k] - window_spreads.mean())
+            / window_spreads.std(),
+        }
+        for name, value in expected.items():
+            assert math.isclose(outputs[k][name], value, rel_tol=1e-9, abs_tol=1e-9), (
+                f'{name} of pair {k}: {outputs[k][name]} vs {value} with numpy'
+            )
+
+
+def test_pairs_the_candles_of_a_product_that_lags_many_windows(state):
+    windows = generate_candles(n_windows=1_000)
+    in_sync = compute_all(
+        [candle for window_candles in windows for candle in window_candles],
+        type(state)(),
+    )
+
+    outputs = compute_all(lagging(windows, lag=300), state, max_lag_windows=400)
+
+    assert outputs == in_sync
+    # the candles of BTC/USD that ETH/USD went past are not kept
+    n_candles_kept = sum(key.startswith('candle_BTC/USD') for key in state.values)
+    assert n_candles_kept <= 300 + 1
+
+
+def test_drops_the_candles_that_waited_longer_than_the_lag_limit(state):
+    windows = generate_candles(n_windows=1_000)
+
+    outputs = compute_all(lagging(windows, lag=300), state, max_lag_windows=100)
+
+    # ETH/USD only finds the candles of BTC/USD of its last 100 windows
+    first_paired_ms = outputs[0]['timestamp']
+    assert first_paired_ms >= START_MS + (1_000 - 100 - 1) * 60_000
+    n_candles_kept = sum(key.startswith('candle_') for key in state.values)
+    assert n_candles_kept <= 2 * (100 + 1)
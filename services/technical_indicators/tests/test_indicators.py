@@ -0,0 +1,146 @@
+import importlib.util
+import math
+import random
+from pathlib import Path
+from typing import List, Optional
+
+import pytest
+
+from src.main import compute_indicators
+
+FEATURE_ENGINEERING_PATH = (
+    Path(__file__).parents[2] / 'price_predictor' / 'src' / 'feature_engineering.py'
+)
+
+
+@pytest.fixture(scope='module')
+def add_features():
+    """
+    The `add_features` of the price_predictor, which needs TA-Lib. The service does
+    not, so it is a dev dependency, and its C library must be installed to run these
+    tests (see the Dockerfile of the price_predictor). We fail instead of skipping
+    the parity tests without it.
+    """
+    try:
+        import pandas  # noqa: F401
+        import talib  # noqa: F401
+    except ImportError as e:
+        pytest.fail(
+            f'The talib parity tests need pandas and TA-Lib: {e}. Install the C '
+            'library of TA-Lib, then `poetry install`'
+        )
+
+    # both services have a `src` package, so we load the module from its path
+    spec = importlib.util.spec_from_file_location(
+        'price_predictor_feature_engineering', FEATURE_ENGINEERING_PATH
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.add_features
+
+
+def generate_candles(
+    n_candles: int, window_seconds: int, missing_ratio: float = 0.05, seed: int = 0
+) -> List[Optional[dict]]:
+    """
+    Generates consecutive candles of a random walk, some without trades (so without
+    volume) and some missing, as None, as when trade_to_ohlc gets no trades in a
+    window.
+    """
+    rng = random.Random(seed)
+    start_ms = 1_717_000_000_000
+    close = 60_000.0
+    candles = []
+    for i in range(n_candles):
+        if i > 0 and rng.random() < missing_ratio:
+            candles.append(None)
+            continue
+
+        close *= 1 + rng.gauss(0, 0.001)
+        volume = 0.0 if rng.random() < 0.02 else rng.random() * 10
+        buy_volume = volume * rng.random()
+        candles.append(
+            {
+                'timestamp': start_ms + (i + 1) * window_seconds * 1000,
+                'open': close,
+                'high': close,
+                'low': close,
+                'close': close,
+                'volume': volume,
+                'vwap': close * (1 + rng.gauss(0, 0.0001)) if volume else close,
+                'trade_count': 1 if volume else 0,
+                'buy_volume': buy_volume,
+                'sell_volume': volume - buy_volume,
+                'product_id': 'BTC/USD',
+            }
+        )
+    return candles
+
+
+def interpolate(candles: List[Optional[dict]], window_seconds: int) -> List[dict]:
+    """
+    The series `add_features` sees after `interpolate_missing_candles`: the missing
+    candles are the last close, without volume and with the close as VWAP.
+    """
+    interpolated = []
+    for candle in candles:
+        if candle is None:
+            last_candle = interpolated[-1]
+            close = last_candle['close']
+            candle = {
+                **last_candle,
+                'timestamp': last_candle['timestamp'] + window_seconds * 1000,
+                'open': close,
+                'high': close,
+                'low': close,
+                'volume': 0.0,
+                'vwap': close,
+                'trade_count': 0,
+                'buy_volume': 0.0,
+                'sell_volume': 0.0,
+            }
+        interpolated.append(candle)
+    return interpolated
+
+
+def test_matches_add_features_of_the_price_predictor(add_features, state):
+    import pandas as pd
+
+    window_seconds = 60
+    n_candles_into_future = 5
+    candles = generate_candles(n_candles=2_000, window_seconds=window_seconds)
+
+    ohlc_data = pd.DataFrame(interpolate(candles, window_seconds))
+    ohlc_data['datetime'] = pd.to_datetime(ohlc_data['timestamp'], unit='ms')
+    expected = add_features(ohlc_data, n_candles_into_future=n_candles_into_future)
+
+    compute = compute_indicators(
+        ohlc_window_seconds=window_seconds,
+        n_candles_into_future=n_candles_into_future,
+    )
+    outputs = [
+        (i, compute(candle, state)[0])
+        for i, candle in enumerate(candles)
+        if candle is not None
+    ]
+
+    feature_names = [
+        name for name in outputs[0][1] if name not in {'product_id', 'timestamp'}
+    ]
+    assert set(feature_names) <= set(expected.columns)
+    for i, output in outputs:
+        for name in feature_names:
+            assert math.isclose(
+                output[name], expected[name].iloc[i], rel_tol=1e-9, abs_tol=1e-9
+            ), f'{name} of candle {i}: {output[name]} vs {expected[name].iloc[i]}'
+
+
+def test_skips_the_candles_it_already_has(state):
+    compute = compute_indicators(ohlc_window_seconds=60, n_candles_into_future=5)
+    candles = [candle for candle in generate_candles(50, 60) if candle is not None]
+    for candle in candles:
+        compute(candle, state)
+
+    # e.g. the candles trade_to_ohlc emits again after a restart
+    assert compute(candles[-1], state) == []
+    assert compute(candles[-10], state) == []
@@ -0,0 +1,9 @@
+# These are the environment variables we will need to set to run
+# the trade_producer on the order book channel
+export KAFKA_BOOK_TOPIC=order_book
+export KAFKA_TOPIC=trade
+export PRODUCT_IDS='["BTC/USD"]'
+export LIVE_OR_HISTORICAL=live
+export CHANNEL=book
+export BOOK_DEPTH=10
+export BOOK_PUBLISH_INTERVAL_MS=1000
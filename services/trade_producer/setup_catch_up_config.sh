@@ -0,0 +1,7 @@
+# These are the environment variables we will need to set to run the trade_producer
+# in catch_up mode: backfill until now with the REST API, then switch to the websocket
+export KAFKA_TOPIC=trade
+export PRODUCT_IDS='["BTC/USD"]'
+export LIVE_OR_HISTORICAL=catch_up
+export LAST_N_DAYS=90
+export CACHE_DIR_HISTORICAL_DATA=/tmp/historical_trade_data
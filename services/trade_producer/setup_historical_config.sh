@@ -5,3 +5,7 @@ export PRODUCT_IDS='["BTC/USD"]'
 export LIVE_OR_HISTORICAL=historical
 export LAST_N_DAYS=90
 export CACHE_DIR_HISTORICAL_DATA=/tmp/historical_trade_data
+# time shards only go faster with one egress IP per shard, e.g.
+# export N_TIME_SHARDS=4
+# export KRAKEN_REST_EGRESS_IPS='["10.0.0.5", "10.0.0.6", "10.0.0.7", "10.0.0.8"]'
+export N_TIME_SHARDS=1
@@ -0,0 +1,8 @@
+# These are the environment variables we will need to set to run
+# the trade_producer in replay mode, streaming the trades we already have in the
+# trade store into Kafka
+export KAFKA_TOPIC=trade_historical
+export PRODUCT_IDS='["BTC/USD"]'
+export LIVE_OR_HISTORICAL=replay
+export LAST_N_DAYS=90
+export CACHE_DIR_HISTORICAL_DATA=/tmp/historical_trade_data
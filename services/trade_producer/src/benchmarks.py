@@ -0,0 +1,416 @@
+"""
+Micro-benchmarks for the hot paths of the trade_producer.
+
+They do not need Kraken nor Kafka, so you can run them anywhere with
+
+    poetry run python -m src.benchmarks <benchmark_name>
+"""
+
+import json
+import time
+from typing import Callable, Dict, List, Optional
+
+from loguru import logger
+
+from src.local_servers import (
+    generate_raw_rest_trades,
+    start_local_trades_server,
+    start_local_websocket_server,
+)
+
+BENCHMARKS: Dict[str, Callable[[], None]] = {}
+
+
+def benchmark(func: Callable[[], None]) -> Callable[[], None]:
+    """
+    Registers the given function as a benchmark we can run from the command line.
+    """
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def best_of(func: Callable[[], object], n_repeats: int = 5) -> float:
+    """
+    Runs `func` `n_repeats` times and returns the fastest run, in seconds.
+    """
+    timings = []
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+@benchmark
+def trade_batch(n_trades: int = 100_000) -> None:
+    """
+    Compares the per-trade pydantic path we used to have in `produce_trades` against
+    the TradeBatch path, from the raw REST trades to the Kafka value bytes.
+    """
+    from quixstreams.utils.json import dumps
+
+    from src.kraken_api.trade import Trade, TradeBatch
+
+    raw_trades = generate_raw_rest_trades(n_trades)
+    product_id = 'BTC/USD'
+
+    def pydantic_path():
+        trades = [
+            Trade(
+                price=float(trade[0]),
+                volume=float(trade[1]),
+                timestamp_ms=int(trade[2] * 1000),
+                product_id=product_id,
+                side='buy' if trade[3] == 'b' else 'sell',
+            )
+            for trade in raw_trades
+        ]
+        # this is what `topic.serialize(key=..., value=trade.model_dump())` does
+        return [
+            (trade.product_id.encode(), dumps(trade.model_dump())) for trade in trades
+        ]
+
+    def trade_batch_path():
+        trades = TradeBatch(
+            product_ids=[product_id] * len(raw_trades),
+            prices=[float(trade[0]) for trade in raw_trades],
+            volumes=[float(trade[1]) for trade in raw_trades],
+            timestamps_ms=[int(trade[2] * 1000) for trade in raw_trades],
+            sides=['buy' if trade[3] == 'b' else 'sell' for trade in raw_trades],
+        )
+        return list(trades.serialize())
+
+    pydantic_sec = best_of(pydantic_path)
+    trade_batch_sec = best_of(trade_batch_path)
+
+    logger.info(f'pydantic Trade: {n_trades / pydantic_sec:,.0f} trades/sec')
+    logger.info(f'TradeBatch:     {n_trades / trade_batch_sec:,.0f} trades/sec')
+    logger.info(f'Speed-up: x{pydantic_sec / trade_batch_sec:.1f}')
+
+
+@benchmark
+def http_client(n_requests: int = 200) -> None:
+    """
+    Compares one `requests.request` per page (a new connection every time) against the
+    pooled, keep-alive KrakenHttpClient, using a local stand-in for the Trades endpoint.
+    """
+    import requests
+
+    from src.kraken_api.http_client import KrakenHttpClient
+
+    url = start_local_trades_server().format(product_id='BTC/USD', since_sec=0)
+
+    def one_connection_per_request():
+        for _ in range(n_requests):
+            requests.request('GET', url, headers={'Accept': 'application/json'}).json()
+
+    client = KrakenHttpClient(log_stats_every_n_requests=n_requests)
+
+    def pooled_client():
+        for _ in range(n_requests):
+            client.get_json(url)
+
+    new_connection_sec = best_of(one_connection_per_request, n_repeats=1)
+    pooled_sec = best_of(pooled_client, n_repeats=1)
+
+    logger.info(
+        f'requests.request: {n_requests / new_connection_sec:,.0f} requests/sec'
+    )
+    logger.info(f'KrakenHttpClient: {n_requests / pooled_sec:,.0f} requests/sec')
+    logger.info(f'KrakenHttpClient stats: {client.stats()}')
+
+
+@benchmark
+def websocket_async(
+    n_products: int = 60, n_connections: int = 4, n_trades: int = 500_000
+) -> None:
+    """
+    Measures the trades/sec the KrakenAsyncWebsocketTradeAPI decodes and
+    `get_trades()` drains, with `n_products` sharded across `n_connections`, against
+    a local websocket server running in the same process.
+    """
+    from src.kraken_api.websocket_async import KrakenAsyncWebsocketTradeAPI
+
+    kraken_api = KrakenAsyncWebsocketTradeAPI(
+        product_ids=[f'PAIR{i}/USD' for i in range(n_products)],
+        n_connections=n_connections,
+        # a small queue, so we measure how fast the trades are decoded, not how fast
+        # we drain the trades that piled up before we started
+        queue_size=100,
+        log_stats_every_sec=3_600,
+        url=start_local_websocket_server(),
+    )
+    kraken_api.subscribed.wait()
+
+    def drain(n_trades: int):
+        n_drained = 0
+        while n_drained < n_trades:
+            n_drained += len(kraken_api.get_trades())
+
+    drain(n_trades // 10)
+    seconds = best_of(lambda: drain(n_trades), n_repeats=1)
+    logger.info(
+        f'{n_products} products over {n_connections} connections: '
+        f'{n_trades / seconds:,.0f} trades/sec'
+    )
+
+
+@benchmark
+def prefetch(
+    n_batches: int = 20, fetch_sec: float = 0.05, produce_sec: float = 0.05
+) -> None:
+    """
+    Compares the fetch -> produce -> fetch loop against the PrefetchingTradeAPI, with
+    a fake historical API that takes `fetch_sec` to return each page of 1000 trades,
+    and a fake producer that takes `produce_sec` to produce it.
+    """
+    from src.kraken_api.prefetch import PrefetchingTradeAPI
+    from src.kraken_api.trade import TradeBatch
+
+    class FakeHistoricalAPI:
+        def __init__(self):
+            self.n_batches_left = n_batches
+
+        def get_trades(self) -> TradeBatch:
+            time.sleep(fetch_sec)
+            self.n_batches_left -= 1
+            return TradeBatch(
+                product_ids=['BTC/USD'] * 1_000,
+                prices=[1.0] * 1_000,
+                volumes=[1.0] * 1_000,
+                timestamps_ms=range(1_000),
+            )
+
+        def is_done(self) -> bool:
+            return self.n_batches_left == 0
+
+    def backfill(kraken_api) -> None:
+        while not kraken_api.is_done():
+            kraken_api.get_trades()
+            time.sleep(produce_sec)
+
+    sequential_sec = best_of(lambda: backfill(FakeHistoricalAPI()), n_repeats=1)
+    prefetch_sec = best_of(
+        lambda: backfill(PrefetchingTradeAPI(FakeHistoricalAPI())), n_repeats=1
+    )
+
+    n_trades = n_batches * 1_000
+    logger.info(f'Sequential: {n_trades / sequential_sec:,.0f} trades/sec')
+    logger.info(f'Prefetch:   {n_trades / prefetch_sec:,.0f} trades/sec')
+
+
+@benchmark
+def time_sharded(
+    n_pages: int = 80, n_shards: int = 4, requests_per_sec: float = 4.0
+) -> None:
+    """
+    Backfills `n_pages` pages of 1000 trades from the Kraken stand-in, which rate
+    limits each client IP to `requests_per_sec`, with:
+    - one cursor,
+    - `n_shards` time shards sending from one IP,
+    - `n_shards` time shards sending from `n_shards` IPs (127.0.0.1, 127.0.0.2...).
+    """
+    import socket
+    import tempfile
+
+    from src.kraken_api.http_client import KrakenHttpClient
+    from src.kraken_api.rate_limiter import AdaptiveRateLimiter
+    from src.kraken_api.rest import (
+        EgressRoute,
+        KrakenRestAPI,
+        KrakenRestAPITimeSharded,
+    )
+    from src.kraken_stand_in import RestRateLimit, SyntheticTrades, start_rest_server
+
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        port = s.getsockname()[1]
+    start_rest_server(
+        SyntheticTrades(trades_per_sec=10),
+        RestRateLimit(requests_per_sec=requests_per_sec, burst=2),
+        port,
+    )
+    base_url = f'http://localhost:{port}'
+
+    to_ms = 1_717_000_000_000
+    from_ms = to_ms - n_pages * 1_000 * 100 + 1
+
+    def routes(n_ips: int) -> List[EgressRoute]:
+        return [
+            EgressRoute(
+                rate_limiter=AdaptiveRateLimiter(
+                    initial_rate=requests_per_sec, max_rate=requests_per_sec
+                ),
+                http_client=KrakenHttpClient(source_address=f'127.0.0.{i + 1}'),
+            )
+            for i in range(n_ips)
+        ]
+
+    def backfill(n_ips: Optional[int]) -> None:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            if n_ips is None:
+                route = routes(1)[0]
+                kraken_api = KrakenRestAPI(
+                    product_id='BTC/USD',
+                    last_n_days=1,
+                    cache_dir=cache_dir,
+                    rate_limiter=route.rate_limiter,
+                    http_client=route.http_client,
+                    from_ms=from_ms,
+                    to_ms=to_ms,
+                    base_url=base_url,
+                )
+            else:
+                kraken_api = KrakenRestAPITimeSharded(
+                    product_id='BTC/USD',
+                    last_n_days=1,
+                    n_shards=n_shards,
+                    cache_dir=cache_dir,
+                    max_buffered_pages=2,
+                    from_ms=from_ms,
+                    to_ms=to_ms,
+                    base_url=base_url,
+                    egress_routes=routes(n_ips),
+                )
+
+            n_trades = 0
+            while not kraken_api.is_done():
+                n_trades += len(kraken_api.get_trades())
+            assert n_trades == n_pages * 1_000, n_trades
+
+    one_cursor_sec = best_of(lambda: backfill(None), n_repeats=1)
+    one_ip_sec = best_of(lambda: backfill(1), n_repeats=1)
+    n_ips_sec = best_of(lambda: backfill(n_shards), n_repeats=1)
+
+    logger.info(f'1 cursor:                   {n_pages / one_cursor_sec:.2f} pages/sec')
+    logger.info(
+        f'{n_shards} shards, 1 IP:           {n_pages / one_ip_sec:.2f} pages/sec '
+        f'(x{one_cursor_sec / one_ip_sec:.2f})'
+    )
+    logger.info(
+        f'{n_shards} shards, {n_shards} IPs:          {n_pages / n_ips_sec:.2f} '
+        f'pages/sec (x{one_cursor_sec / n_ips_sec:.2f})'
+    )
+
+
+@benchmark
+def kafka_producer(n_trades: int = 200_000, broker_address: str = None) -> None:
+    """
+    Compares producing the trades with the default producer config against different
+    `linger.ms` and compression settings.
+
+    Without a `broker_address` (e.g. 'localhost:19092' for the local Redpanda) it uses
+    the in-process mock Kafka cluster of librdkafka, so it runs anywhere. Numbers
+    against a real broker also include the network.
+    """
+    from quixstreams.kafka import Producer
+
+    from src.kraken_api.trade import TradeBatch
+
+    raw_trades = generate_raw_rest_trades(n_trades)
+    trades = TradeBatch(
+        product_ids=['BTC/USD'] * n_trades,
+        prices=[float(trade[0]) for trade in raw_trades],
+        volumes=[float(trade[1]) for trade in raw_trades],
+        timestamps_ms=[int(trade[2] * 1000) for trade in raw_trades],
+        sides=['buy' if trade[3] == 'b' else 'sell' for trade in raw_trades],
+    )
+    # the same trades in batches of 1,000, as the Kraken APIs return them
+    batches = [
+        TradeBatch(
+            product_ids=trades.product_ids[i : i + 1_000],
+            prices=trades.prices[i : i + 1_000],
+            volumes=trades.volumes[i : i + 1_000],
+            timestamps_ms=trades.timestamps_ms[i : i + 1_000],
+            sides=trades.sides[i : i + 1_000],
+        )
+        for i in range(0, n_trades, 1_000)
+    ]
+    topic_name = 'trade_benchmark'
+
+    # the number of produce requests and bytes sent to the brokers by the last
+    # producer, from the librdkafka statistics
+    network_stats = {}
+
+    def on_stats(stats_json: str) -> None:
+        brokers = json.loads(stats_json)['brokers'].values()
+        network_stats['requests'] = sum(broker['tx'] for broker in brokers)
+        network_stats['bytes'] = sum(broker['txbytes'] for broker in brokers)
+
+    def new_producer(extra_config: dict) -> Producer:
+        extra_config = {
+            'statistics.interval.ms': 100,
+            'stats_cb': on_stats,
+            **extra_config,
+        }
+        if broker_address is None:
+            extra_config['test.mock.num.brokers'] = 1
+        return Producer(
+            broker_address=broker_address or 'localhost:9092',
+            extra_config=extra_config,
+        )
+
+    def run(func) -> str:
+        seconds = best_of(func, n_repeats=1)
+        # wait for the last statistics of the producer
+        time.sleep(0.2)
+        return (
+            f'{n_trades / seconds:,.0f} trades/sec, '
+            f'{network_stats["requests"]:,} requests, '
+            f'{network_stats["bytes"] / 1e6:.1f} MB sent'
+        )
+
+    def produce(extra_config: dict):
+        with new_producer(extra_config) as producer:
+            for key, value in trades.serialize():
+                producer.produce(topic=topic_name, value=value, key=key)
+
+    def produce_tracked(extra_config: dict):
+        # as the service does, with one delivery callback object per batch that
+        # counts the delivery reports
+        from src.delivery import DeliveryTracker
+
+        with new_producer(extra_config) as producer:
+            delivery = DeliveryTracker(producer)
+            for batch in batches:
+                delivery.wait_for_capacity(len(batch))
+                on_delivery = delivery.track(batch)
+                for key, value in batch.serialize():
+                    producer.produce(
+                        topic=topic_name, value=value, key=key, on_delivery=on_delivery
+                    )
+        assert delivery.n_delivered == n_trades, delivery.stats()
+
+    results = {'default config': run(lambda: produce({}))}
+    for compression_type in ['none', 'lz4', 'zstd']:
+        extra_config = {
+            'linger.ms': 100,
+            'batch.size': 1_000_000,
+            'compression.type': compression_type,
+        }
+        results[f'linger.ms=100, {compression_type}'] = run(
+            lambda: produce(extra_config)
+        )
+    results['linger.ms=100, lz4, DeliveryTracker'] = run(
+        lambda: produce_tracked(
+            {'linger.ms': 100, 'batch.size': 1_000_000, 'compression.type': 'lz4'}
+        )
+    )
+
+    for name, result in results.items():
+        logger.info(f'{name}: {result}')
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('name', choices=sorted(BENCHMARKS))
+    parser.add_argument('--broker-address', type=str, required=False, default=None)
+    args = parser.parse_args()
+
+    if args.broker_address is not None:
+        # only the benchmarks that talk to Kafka take a broker address
+        BENCHMARKS[args.name](broker_address=args.broker_address)
+    else:
+        BENCHMARKS[args.name]()
@@ -0,0 +1,130 @@
+import json
+import os
+from collections import deque
+from functools import partial
+from pathlib import Path
+from typing import Callable, Deque, Dict, Optional
+
+from loguru import logger
+
+from src.kraken_api.trade import TradeBatch
+
+
+class _PendingBatch:
+    """
+    A batch of trades produced to Kafka, waiting for its delivery reports.
+    """
+
+    __slots__ = ('n_pending', 'failed', 'last_trade_ms', 'last_offset')
+
+    def __init__(self, trades: TradeBatch) -> None:
+        self.n_pending = len(trades)
+        self.failed = False
+
+        # product_id -> timestamp of the last trade of that product in the batch
+        self.last_trade_ms: Dict[str, int] = {}
+        for product_id, timestamp_ms in zip(trades.product_ids, trades.timestamps_ms):
+            self.last_trade_ms[product_id] = max(
+                timestamp_ms, self.last_trade_ms.get(product_id, timestamp_ms)
+            )
+
+        # product_id -> offset of the last delivered message of that product
+        self.last_offset: Dict[str, int] = {}
+
+
+class BackfillCheckpoints:
+    """
+    Per-product cursors of a historical backfill, saved as a JSON file like this
+
+        {
+            "BTC/USD": {"last_trade_ms": 1717667940123, "offset": 81234},
+            ...
+        }
+
+    where `last_trade_ms` is the timestamp of the last trade of the product that Kafka
+    confirmed, and `offset` the offset of its message.
+
+    Every batch we produce is registered with `track()`, that returns the delivery
+    callback for its messages. A cursor only moves forward once all the messages of
+    its batch, and of all the batches produced before it, have been delivered. If a
+    delivery fails the cursors stop moving, so a restart re-produces that batch.
+    """
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = Path(file_path)
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.cursors: Dict[str, dict] = {}
+        if self.file_path.exists():
+            self.cursors = json.loads(self.file_path.read_text())
+            logger.info(f'Loaded backfill checkpoints {self.cursors} from {file_path}')
+
+        # batches produced and not confirmed yet, in the order we produced them
+        self._pending: Deque[_PendingBatch] = deque()
+
+    def last_trade_ms(self, product_id: str) -> Optional[int]:
+        """
+        Returns the timestamp of the last trade of `product_id` confirmed by Kafka,
+        or None if we have no checkpoint for it.
+        """
+        cursor = self.cursors.get(product_id)
+        return cursor['last_trade_ms'] if cursor else None
+
+    def track(self, trades: TradeBatch) -> Callable:
+        """
+        Registers a batch of trades that we are about to produce, and returns the
+        `on_delivery` callback to pass to `producer.produce(...)` for its messages.
+        """
+        batch = _PendingBatch(trades)
+        self._pending.append(batch)
+        return partial(self._on_delivery, batch)
+
+    def _on_delivery(self, batch: _PendingBatch, err, msg) -> None:
+        """
+        Delivery report of one message of `batch`.
+        """
+        if err is not None:
+            if not batch.failed:
+                logger.error(f'Failed to deliver a trade to Kafka: {err}')
+            batch.failed = True
+        else:
+            product_id = msg.key().decode()
+            batch.last_offset[product_id] = max(
+                msg.offset(), batch.last_offset.get(product_id, -1)
+            )
+
+        batch.n_pending -= 1
+        if batch.n_pending == 0:
+            self._commit_delivered_batches()
+
+    def _commit_delivered_batches(self) -> None:
+        """
+        Moves the cursors past all the fully delivered batches at the front of the
+        queue, and saves them to disk.
+        """
+        updated = False
+        while self._pending and self._pending[0].n_pending == 0:
+            if self._pending[0].failed:
+                # never skip a failed batch. We stop here, and a restart will
+                # re-produce it
+                return
+
+            batch = self._pending.popleft()
+            for product_id, last_trade_ms in batch.last_trade_ms.items():
+                self.cursors[product_id] = {
+                    'last_trade_ms': last_trade_ms,
+                    'offset': batch.last_offset[product_id],
+                }
+            updated = True
+
+        if updated:
+            self._save()
+
+    def _save(self) -> None:
+        """
+        Writes the cursors to disk. We write to a temporary file first and then rename
+        it, so a crash never leaves a half-written checkpoint.
+        """
+        tmp_path = self.file_path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(self.cursors))
+        os.replace(tmp_path, self.file_path)
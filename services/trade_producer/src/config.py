@@ -1,6 +1,6 @@
 from typing import List, Optional
 
-from pydantic import field_validator
+from pydantic import field_validator, model_validator
 from pydantic_settings import BaseSettings
 
 
@@ -11,17 +11,130 @@ class Config(BaseSettings):
 
     live_or_historical: str
 
+    # where the Kraken APIs live. By default, Kraken's. Point them at the local stand-in
+    # (`python -m src.kraken_stand_in`) for load and regression tests, e.g.
+    # ws://localhost:8765 and http://localhost:8080
+    kraken_ws_url: Optional[str] = None
+    kraken_rest_url: Optional[str] = None
+
+    # the Kraken websocket channel we ingest. With 'book' we keep an order book per
+    # product with `book_depth` levels per side, and publish its features (spread,
+    # depth imbalance, microprice...) to `kafka_book_topic` every
+    # `book_publish_interval_ms`, instead of the trades
+    channel: Optional[str] = 'trade'
+    kafka_book_topic: Optional[str] = 'order_book'
+    book_depth: Optional[int] = 10
+    book_publish_interval_ms: Optional[int] = 1_000
+
+    # batching and compression of the Kafka producer. librdkafka waits up to
+    # `kafka_linger_ms` to fill batches of up to `kafka_batch_size` bytes, and
+    # compresses them with `kafka_compression_type`
+    kafka_linger_ms: Optional[int] = 100
+    kafka_batch_size: Optional[int] = 1_000_000
+    kafka_compression_type: Optional[str] = 'lz4'
+
+    # the maximum number of messages waiting for their delivery report. Once we reach
+    # it we stop pulling trades from Kraken until Kafka catches up
+    kafka_max_in_flight: Optional[int] = 100_000
+
     last_n_days: Optional[int] = 1
+
+    # in historical mode, the most requests per second we make to the Kraken REST
+    # API. We start at 1 request/sec and speed up to this rate while Kraken does not
+    # answer with `EGeneral:Too many requests`
+    kraken_rest_max_requests_per_sec: Optional[float] = 2.0
+
+    # in historical mode, the local IP addresses of the host we send the REST requests
+    # from. Kraken rate limits each IP, so each of them gets a rate budget of its own,
+    # and the products (or time shards) are spread across them. By default, we use the
+    # default route, with a single rate budget.
+    kraken_rest_egress_ips: Optional[List[str]] = None
     cache_dir_historical_data: Optional[str] = None
 
+    # in historical mode, the number of segments we split the time range of each
+    # product into, so they can be fetched concurrently. They only go faster than one
+    # segment with `kraken_rest_egress_ips`, and they need
+    # `cache_dir_historical_data` to keep fetching while they wait for their turn.
+    n_time_shards: Optional[int] = 1
+
+    # in historical mode, the JSON file where we persist the per-product cursors of the
+    # backfill, so a restart resumes where we left off. By default it lives in
+    # `cache_dir_historical_data`.
+    checkpoint_file: Optional[str] = None
+
+    # in historical mode, how many batches we keep downloading in the background while
+    # the previous ones are produced to Kafka. 0 disables the prefetching.
+    prefetch_lookahead: Optional[int] = 4
+
+    # in live mode, whether we use the asyncio ingestion engine, that shards the
+    # product_ids across `websocket_n_connections` connections and decouples the
+    # socket reads from the Kafka producer with a queue of `websocket_queue_size` frames
+    websocket_async: Optional[bool] = False
+    websocket_n_connections: Optional[int] = 4
+    websocket_queue_size: Optional[int] = 10_000
+
+    # we drop the trades we already produced, comparing each trade against the last
+    # `dedup_window_size` trades of its product, and older ones with a Bloom filter of
+    # `dedup_bloom_capacity` trades per product. 0 disables them.
+    dedup_window_size: Optional[int] = 10_000
+    dedup_bloom_capacity: Optional[int] = 1_000_000
+
+    # in replay mode, we stream the trades of `cache_dir_historical_data` into Kafka,
+    # in batches of up to `replay_batch_size` trades. With `replay_speed` set we pace
+    # them at that many times real time, otherwise we go as fast as we can.
+    replay_batch_size: Optional[int] = 100_000
+    replay_speed: Optional[float] = None
+
     @field_validator('live_or_historical')
     @classmethod
     def validate_live_or_historical(cls, value):
         assert value in {
             'live',
             'historical',
+            'replay',
+            'catch_up',
         }, f'Invalid value for live_or_historical: {value}'
         return value
 
+    @field_validator('channel')
+    @classmethod
+    def validate_channel(cls, value):
+        assert value in {
+            'trade',
+            'book',
+        }, f'Invalid value for channel: {value}'
+        return value
+
+    @field_validator('book_depth')
+    @classmethod
+    def validate_book_depth(cls, value):
+        assert value in {
+            10,
+            25,
+            100,
+            500,
+            1000,
+        }, f'Invalid value for book_depth: {value}'
+        return value
+
+    @field_validator('kafka_compression_type')
+    @classmethod
+    def validate_kafka_compression_type(cls, value):
+        assert value in {
+            'none',
+            'gzip',
+            'snappy',
+            'lz4',
+            'zstd',
+        }, f'Invalid value for kafka_compression_type: {value}'
+        return value
+
+    @model_validator(mode='after')
+    def validate_n_time_shards(self):
+        assert self.n_time_shards == 1 or self.cache_dir_historical_data is not None, (
+            'n_time_shards > 1 requires cache_dir_historical_data'
+        )
+        return self
+
 
 config = Config()
\ No newline at end of file
@@ -0,0 +1,149 @@
+import time
+from typing import Callable, Dict, Optional
+
+from loguru import logger
+
+from src.kraken_api.trade import TradeBatch
+
+
+class _BatchDelivery:
+    """
+    The `on_delivery` callback of the messages of one batch of trades. It counts the
+    delivery reports on the tracker, and passes them on to the `on_delivery` of the
+    batch, if any.
+    """
+
+    __slots__ = ('tracker', 'on_delivery')
+
+    def __init__(
+        self, tracker: 'DeliveryTracker', on_delivery: Optional[Callable]
+    ) -> None:
+        self.tracker = tracker
+        self.on_delivery = on_delivery
+
+    def __call__(self, err, msg) -> None:
+        if err is None:
+            self.tracker.n_delivered += 1
+        else:
+            if self.tracker.n_failed == 0:
+                logger.error(f'Failed to deliver a trade to Kafka: {err}')
+            self.tracker.n_failed += 1
+
+        if self.on_delivery is not None:
+            self.on_delivery(err, msg)
+
+
+class DeliveryTracker:
+    """
+    Counts the trades we produced to Kafka, the ones Kafka confirmed and the ones that
+    failed, so we know how many are still in flight and whether any were dropped.
+
+    Every batch we produce is registered with `track()`, that returns the delivery
+    callback for its messages, one object per batch, as `BackfillCheckpoints.track()`
+    does. The counting per message is an increment in that callback.
+
+    Before we produce a batch, `wait_for_capacity()` blocks, serving delivery
+    reports, while the batch would take us above `max_in_flight` messages in flight.
+    The main loop stops pulling trades from the Kraken API in the meantime, so the
+    websocket queue fills up or the prefetching thread stops fetching, instead of the
+    trades piling up in memory.
+    """
+
+    def __init__(
+        self,
+        producer,
+        max_in_flight: int = 100_000,
+        log_stats_every_sec: float = 60,
+    ) -> None:
+        """
+        Args:
+            producer: The Kafka producer, whose `poll` serves the delivery reports.
+            max_in_flight (int): The maximum number of messages waiting for their
+                delivery report.
+            log_stats_every_sec (float): How often we log the delivery stats.
+        """
+        self.producer = producer
+        self.max_in_flight = max_in_flight
+        self.log_stats_every_sec = log_stats_every_sec
+
+        self.n_produced = 0
+        self.n_delivered = 0
+        self.n_failed = 0
+        self.n_backpressure_waits = 0
+
+        self._n_produced_at_last_log = 0
+        self._last_logged_at = time.monotonic()
+
+    @property
+    def n_in_flight(self) -> int:
+        """
+        The number of messages produced that did not get their delivery report yet.
+        """
+        return self.n_produced - self.n_delivered - self.n_failed
+
+    def track(
+        self, trades: TradeBatch, on_delivery: Optional[Callable] = None
+    ) -> Callable:
+        """
+        Registers a batch of trades that we are about to produce, and returns the
+        `on_delivery` callback to pass to `producer.produce(...)` for its messages.
+
+        Args:
+            trades (TradeBatch): The trades we are about to produce.
+            on_delivery (Optional[Callable]): An extra delivery callback for the
+                messages of this batch, called after we count them.
+
+        Returns:
+            Callable: The delivery callback of the messages of the batch.
+        """
+        self.n_produced += len(trades)
+        return _BatchDelivery(self, on_delivery)
+
+    def wait_for_capacity(self, n_messages: int) -> None:
+        """
+        Blocks, serving delivery reports, until we can produce `n_messages` more
+        without going above `max_in_flight`. A batch larger than `max_in_flight`
+        waits for all the others to be delivered.
+        """
+        if self.n_in_flight + n_messages <= self.max_in_flight:
+            return
+
+        self.n_backpressure_waits += 1
+        logger.debug(
+            f'{self.n_in_flight} messages in flight, waiting for delivery reports'
+        )
+        while self.n_in_flight > 0 and (
+            self.n_in_flight + n_messages > self.max_in_flight
+        ):
+            self.producer.poll(0.1)
+
+    def maybe_log_stats(self) -> None:
+        """
+        Logs the stats if we did not log them for `log_stats_every_sec`.
+        """
+        if time.monotonic() - self._last_logged_at >= self.log_stats_every_sec:
+            self.log_stats()
+
+    def log_stats(self) -> None:
+        """
+        Logs the produce rate since the last time we logged and the delivery counters.
+        """
+        elapsed_sec = max(time.monotonic() - self._last_logged_at, 1e-9)
+        n_produced = self.n_produced - self._n_produced_at_last_log
+        logger.info(
+            f'Produced {n_produced / elapsed_sec:.1f} trades/sec. {self.stats()}'
+        )
+        self._n_produced_at_last_log = self.n_produced
+        self._last_logged_at = time.monotonic()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the delivery counters.
+        """
+        return {
+            'n_produced': self.n_produced,
+            'n_delivered': self.n_delivered,
+            'n_failed': self.n_failed,
+            'n_in_flight': self.n_in_flight,
+            'n_backpressure_waits': self.n_backpressure_waits,
+        }
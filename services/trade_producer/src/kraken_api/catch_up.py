@@ -0,0 +1,135 @@
+import queue
+import threading
+from typing import Callable, Dict
+
+from loguru import logger
+
+from src.kraken_api.rest import KrakenRestAPIMultipleProducts
+from src.kraken_api.trade import TradeBatch
+from src.kraken_api.websocket_async import KrakenAsyncWebsocketTradeAPI
+
+
+class CatchUpThenLiveTradeAPI:
+    """
+    Backfills the trades up to now from the REST API, and then switches to the
+    websocket, without a gap or an overlap between the two.
+
+    1. We open the websocket connections first, with a snapshot of the latest trades,
+    and keep buffering the live trades in the background.
+    2. Once the websocket sent the first trade of every product (the snapshot), we
+    pick the boundary: the latest of their timestamps.
+    3. We return the historical trades up to the boundary, inclusive.
+    4. Then we return the buffered live trades after the boundary, and from there on
+    the live ones.
+
+    A trade at or before the boundary always comes from the REST API, since it only
+    stops after it has seen a trade past the boundary. The websocket sends every trade
+    of a product from its first one on, and the boundary is not before the first trade
+    of any product, so a trade after the boundary always comes from the websocket.
+    The boundary is a Kraken timestamp, so this does not depend on our clock.
+
+    It assumes the connections do not drop before the boundary. Trades missed while a
+    connection reconnects are lost, as in live mode.
+    """
+
+    def __init__(
+        self,
+        live_api: KrakenAsyncWebsocketTradeAPI,
+        historical_api_factory: Callable[[int], KrakenRestAPIMultipleProducts],
+        first_trades_timeout_sec: float = 30,
+    ) -> None:
+        """
+        Starts buffering the live trades, picks the boundary and creates the
+        historical API.
+
+        Args:
+            live_api (KrakenAsyncWebsocketTradeAPI): The websocket API, created with
+                `snapshot=True`.
+            historical_api_factory (Callable[[int], KrakenRestAPIMultipleProducts]):
+                Creates the historical API that fetches the trades up to the given
+                boundary_ms, inclusive. It can also wrap it in a PrefetchingTradeAPI.
+            first_trades_timeout_sec (float): How long we wait for the first trade of
+                every product from the websocket.
+
+        Returns:
+            None
+        """
+        self.live_api = live_api
+
+        # live trades received while we catch up, and from then on
+        self._live_trades: queue.Queue = queue.Queue()
+
+        # timestamp of the first trade the websocket sent for each product, and set
+        # once we have it for all of them
+        self._first_trade_ms: Dict[str, int] = {}
+        self._has_first_trades = threading.Event()
+        self._thread = threading.Thread(
+            target=self._buffer_live_trades, name='kraken-live-buffer', daemon=True
+        )
+        self._thread.start()
+
+        if not self._has_first_trades.wait(timeout=first_trades_timeout_sec):
+            missing = set(live_api.product_ids) - set(self._first_trade_ms)
+            raise TimeoutError(
+                f'No trade from the websocket for {sorted(missing)} after '
+                f'{first_trades_timeout_sec} seconds'
+            )
+
+        self.boundary_ms = max(self._first_trade_ms.values())
+        logger.info(f'Catching up with the REST API until {self.boundary_ms}')
+
+        self.historical_api = historical_api_factory(self.boundary_ms)
+        self._is_live = False
+
+    def get_trades(self) -> TradeBatch:
+        """
+        Returns the next historical trades until we caught up, and the live trades
+        after the boundary from then on.
+        """
+        if not self._is_live:
+            if not self.historical_api.is_done():
+                return self.historical_api.get_trades().filter_by_timestamp(
+                    max_ms=self.boundary_ms
+                )
+
+            self._is_live = True
+            logger.info(
+                f'Caught up. Switching to the websocket with '
+                f'{self._live_trades.qsize()} buffered batches'
+            )
+
+        try:
+            trades = self._live_trades.get(timeout=1)
+        except queue.Empty:
+            return TradeBatch()
+
+        return trades.filter_by_timestamp(min_ms=self.boundary_ms + 1)
+
+    def is_done(self) -> bool:
+        """The websocket never stops, so we never stop fetching trades."""
+        return False
+
+    def _buffer_live_trades(self) -> None:
+        """
+        Keeps draining the websocket API, so its connections never stop reading while
+        we catch up.
+        """
+        while True:
+            trades = self.live_api.get_trades()
+            if not trades:
+                continue
+
+            if not self._has_first_trades.is_set():
+                self._record_first_trades(trades)
+            self._live_trades.put(trades)
+
+    def _record_first_trades(self, trades: TradeBatch) -> None:
+        """
+        Records the timestamp of the first trade of each product we see for the first
+        time in `trades`.
+        """
+        for product_id, timestamp_ms in zip(trades.product_ids, trades.timestamps_ms):
+            self._first_trade_ms.setdefault(product_id, timestamp_ms)
+
+        if len(self._first_trade_ms) == len(self.live_api.product_ids):
+            self._has_first_trades.set()
@@ -0,0 +1,197 @@
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from loguru import logger
+
+from src.kraken_api.trade import TradeBatch
+
+# what identifies a trade of a given product
+Fingerprint = Tuple[int, float, float]
+
+
+class BloomFilter:
+    """
+    A fixed-size Bloom filter of trade fingerprints.
+
+    We keep two generations of bits. Once `capacity` fingerprints were added to the
+    current one, it becomes the previous one and we start a new one, so the memory
+    stays bounded and so does the false positive rate (about 1% at `capacity`).
+    """
+
+    def __init__(self, capacity: int, n_bits_per_item: int = 10, n_hashes: int = 7):
+        self.capacity = capacity
+        self.n_bits = capacity * n_bits_per_item
+        self.n_hashes = n_hashes
+
+        self._current = bytearray(self.n_bits // 8 + 1)
+        self._previous = bytearray(self.n_bits // 8 + 1)
+        self._n_added = 0
+
+    def add(self, fingerprint: Fingerprint) -> None:
+        if self._n_added >= self.capacity:
+            self._previous = self._current
+            self._current = bytearray(self.n_bits // 8 + 1)
+            self._n_added = 0
+
+        for bit in self._bits(fingerprint):
+            self._current[bit >> 3] |= 1 << (bit & 7)
+        self._n_added += 1
+
+    def __contains__(self, fingerprint: Fingerprint) -> bool:
+        bits = self._bits(fingerprint)
+        return all(self._current[bit >> 3] & (1 << (bit & 7)) for bit in bits) or all(
+            self._previous[bit >> 3] & (1 << (bit & 7)) for bit in bits
+        )
+
+    def _bits(self, fingerprint: Fingerprint) -> list:
+        # double hashing: k positions out of 2 hashes
+        h1 = hash(fingerprint)
+        h2 = hash((h1, fingerprint)) | 1
+        return [(h1 + i * h2) % self.n_bits for i in range(self.n_hashes)]
+
+
+class _ProductTrades:
+    """
+    The fingerprints of the recent trades of one product.
+    """
+
+    __slots__ = ('ring', 'counts', 'bloom', 'max_evicted_ms', 'n_duplicates')
+
+    def __init__(self, bloom_capacity: int) -> None:
+        # the last `window_size` fingerprints, in arrival order, and how many times
+        # each of them is in the ring, for O(1) lookups
+        self.ring: Deque[Fingerprint] = deque()
+        self.counts: Dict[Fingerprint, int] = {}
+
+        # the fingerprints that fell out of the ring, and the latest timestamp among
+        # them. Only trades up to that timestamp can be in the Bloom filter.
+        self.bloom = BloomFilter(bloom_capacity) if bloom_capacity > 0 else None
+        self.max_evicted_ms = -1
+
+        self.n_duplicates = 0
+
+
+class TradeDeduplicator:
+    """
+    Drops trades we already produced, with bounded memory per product.
+
+    Kraken re-sends trades when a REST page starts where the previous one ended, and
+    when a websocket reconnects and replays its snapshot. Each trade is identified by
+    its (timestamp_ms, price, volume) fingerprint:
+
+    - the fingerprints of the last `window_size` trades of each product live in a ring
+    buffer with a dict next to it, so recent duplicates are always caught.
+    - the fingerprints that fall out of the ring go into a Bloom filter of
+    `bloom_capacity` items, that catches older replays. A Bloom filter can have false
+    positives, so we only ask it about trades that are not newer than the newest
+    trade it holds. New trades never pay for its false positives.
+
+    Two trades with the same fingerprint in the same batch are two real trades (e.g.
+    one order filled against two resting orders in the same millisecond), so we only
+    drop trades whose fingerprint was seen in a previous batch.
+    """
+
+    def __init__(
+        self,
+        window_size: Optional[int] = 10_000,
+        bloom_capacity: Optional[int] = 1_000_000,
+        log_stats_every_sec: Optional[int] = 60,
+    ) -> None:
+        """
+        Args:
+            window_size (Optional[int]): The number of recent trades per product we
+                compare against exactly.
+            bloom_capacity (Optional[int]): The number of older trades per product
+                the Bloom filter holds. 0 disables it.
+            log_stats_every_sec (Optional[int]): How often we log the counters.
+
+        Returns:
+            None
+        """
+        self.window_size = window_size
+        self.bloom_capacity = bloom_capacity
+        self.log_stats_every_sec = log_stats_every_sec
+
+        self._products: Dict[str, _ProductTrades] = {}
+        self._last_logged_at = time.monotonic()
+
+    def filter(self, trades: TradeBatch) -> TradeBatch:
+        """
+        Returns the trades of the batch we did not see before, in the same order.
+        """
+        # first we look up every trade, then we add the new ones, so the duplicates
+        # inside the batch are kept
+        keep = []
+        new_fingerprints = []
+        for i, (product_id, price, volume, timestamp_ms) in enumerate(
+            zip(trades.product_ids, trades.prices, trades.volumes, trades.timestamps_ms)
+        ):
+            product = self._products.get(product_id)
+            if product is None:
+                product = self._products[product_id] = _ProductTrades(
+                    self.bloom_capacity
+                )
+
+            fingerprint = (timestamp_ms, price, volume)
+            if self._is_duplicate(product, fingerprint):
+                product.n_duplicates += 1
+                continue
+
+            keep.append(i)
+            new_fingerprints.append((product, fingerprint))
+
+        for product, fingerprint in new_fingerprints:
+            self._add(product, fingerprint)
+
+        self.maybe_log_stats()
+
+        if len(keep) == len(trades):
+            return trades
+        return trades.take(keep)
+
+    def maybe_log_stats(self) -> None:
+        """
+        Logs the stats if we did not log them for `log_stats_every_sec`.
+        """
+        if time.monotonic() - self._last_logged_at >= self.log_stats_every_sec:
+            self.log_stats()
+
+    def log_stats(self) -> None:
+        """
+        Logs the number of duplicates dropped so far, per product.
+        """
+        logger.info(f'Dropped duplicate trades per product: {self.stats()}')
+        self._last_logged_at = time.monotonic()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the number of duplicates dropped so far, per product.
+        """
+        return {
+            product_id: product.n_duplicates
+            for product_id, product in self._products.items()
+        }
+
+    def _is_duplicate(self, product: _ProductTrades, fingerprint: Fingerprint) -> bool:
+        if fingerprint in product.counts:
+            return True
+        return (
+            product.bloom is not None
+            and fingerprint[0] <= product.max_evicted_ms
+            and fingerprint in product.bloom
+        )
+
+    def _add(self, product: _ProductTrades, fingerprint: Fingerprint) -> None:
+        product.ring.append(fingerprint)
+        product.counts[fingerprint] = product.counts.get(fingerprint, 0) + 1
+
+        if len(product.ring) > self.window_size:
+            evicted = product.ring.popleft()
+            product.counts[evicted] -= 1
+            if product.counts[evicted] == 0:
+                del product.counts[evicted]
+
+            if product.bloom is not None:
+                product.bloom.add(evicted)
+                product.max_evicted_ms = max(product.max_evicted_ms, evicted[0])
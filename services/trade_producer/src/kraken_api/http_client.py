@@ -0,0 +1,217 @@
+import random
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# seconds spent opening new connections by the request in flight in each thread
+_connect_time = threading.local()
+
+
+def _timed_connection_pool(pool_cls: type) -> type:
+    """
+    Returns a subclass of the given urllib3 connection pool whose connections record
+    in `_connect_time` how long it takes them to connect (TCP + TLS handshake).
+    """
+
+    class TimedConnection(pool_cls.ConnectionCls):
+        def connect(self):
+            start = time.perf_counter()
+            super().connect()
+            _connect_time.seconds = getattr(_connect_time, 'seconds', 0.0) + (
+                time.perf_counter() - start
+            )
+
+    return type(
+        f'Timed{pool_cls.__name__}', (pool_cls,), {'ConnectionCls': TimedConnection}
+    )
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    """
+    An HTTPAdapter whose connections report how long they took to connect, and
+    connect from the local `source_address`, if given.
+    """
+
+    def __init__(self, source_address: Optional[str] = None, **kwargs):
+        # set before `super().__init__`, which creates the pool manager
+        self.source_address = source_address
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.source_address is not None:
+            kwargs['source_address'] = (self.source_address, 0)
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _timed_connection_pool(HTTPConnectionPool),
+            'https': _timed_connection_pool(HTTPSConnectionPool),
+        }
+
+
+class KrakenHttpClient:
+    """
+    A thread-safe HTTP client for the Kraken REST API.
+
+    - One `requests.Session` with a pool of keep-alive connections, so we pay the
+    TCP + TLS handshake once per connection instead of once per request.
+    - gzip compressed responses.
+    - A timeout on every request.
+    - Retries with exponential backoff and full jitter on connection errors, timeouts
+    and 5xx/429 responses.
+    - Latency stats, split between connection setup and the rest of the request.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 32,
+        timeout_sec: Tuple[float, float] = (3.05, 10),
+        max_retries: int = 5,
+        backoff_sec: float = 0.5,
+        max_backoff_sec: float = 30,
+        log_stats_every_n_requests: int = 100,
+        source_address: Optional[str] = None,
+    ) -> None:
+        """
+        Args:
+            pool_size (int): The maximum number of keep-alive connections per host.
+            timeout_sec (Tuple[float, float]): The connect and read timeouts.
+            max_retries (int): How many times we retry a failed request.
+            backoff_sec (float): The base of the exponential backoff between retries.
+            max_backoff_sec (float): The maximum backoff between retries.
+            log_stats_every_n_requests (int): How often we log the latency stats.
+            source_address (Optional[str]): The local IP address we send the requests
+                from, on a host with several egress IPs. By default, the one the OS
+                picks.
+
+        Returns:
+            None
+        """
+        self.timeout_sec = timeout_sec
+        self.max_retries = max_retries
+        self.backoff_sec = backoff_sec
+        self.max_backoff_sec = max_backoff_sec
+        self.log_stats_every_n_requests = log_stats_every_n_requests
+
+        adapter = _TimedHTTPAdapter(
+            source_address=source_address, pool_connections=1, pool_maxsize=pool_size
+        )
+        self._session = requests.Session()
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._session.headers.update(
+            {'Accept': 'application/json', 'Accept-Encoding': 'gzip'}
+        )
+
+        self._lock = threading.Lock()
+        self._n_requests = 0
+        self._n_retries = 0
+        self._n_new_connections = 0
+        self._total_connect_sec = 0.0
+        self._total_request_sec = 0.0
+        self._latencies_sec: Deque[float] = deque(maxlen=1_000)
+
+    def get_json(self, url: str) -> dict:
+        """
+        Makes a GET request to `url`, retrying on transient errors, and returns the
+        parsed JSON response.
+
+        Args:
+            url (str): The URL to request.
+
+        Returns:
+            dict: The parsed JSON response.
+        """
+        for attempt in range(self.max_retries + 1):
+            _connect_time.seconds = 0.0
+            start = time.perf_counter()
+            try:
+                response = self._session.get(url, timeout=self.timeout_sec)
+                if response.status_code == 429 or response.status_code >= 500:
+                    raise requests.HTTPError(
+                        f'{response.status_code} response', response=response
+                    )
+                response.raise_for_status()
+                data = response.json()
+
+            except (
+                requests.ConnectionError,
+                requests.Timeout,
+                requests.HTTPError,
+            ) as e:
+                is_retryable = not isinstance(e, requests.HTTPError) or (
+                    e.response.status_code == 429 or e.response.status_code >= 500
+                )
+                if not is_retryable or attempt == self.max_retries:
+                    raise
+
+                # exponential backoff with full jitter, so concurrent workers that
+                # failed at the same time do not retry at the same time
+                backoff_sec = random.uniform(
+                    0, min(self.max_backoff_sec, self.backoff_sec * 2**attempt)
+                )
+                logger.warning(
+                    f'Request to {url} failed: {e}. Retrying in {backoff_sec:.1f}s'
+                )
+                with self._lock:
+                    self._n_retries += 1
+                time.sleep(backoff_sec)
+                continue
+
+            self._record(time.perf_counter() - start, _connect_time.seconds)
+            return data
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the latency stats of the requests made so far.
+        The percentiles are computed over the last 1000 requests.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies_sec)
+            n_requests = self._n_requests
+
+            def percentile(p: float) -> float:
+                return latencies[int(p * (len(latencies) - 1))] if latencies else 0.0
+
+            return {
+                'n_requests': n_requests,
+                'n_retries': self._n_retries,
+                'n_new_connections': self._n_new_connections,
+                'connect_sec_total': self._total_connect_sec,
+                'request_sec_total': self._total_request_sec,
+                'latency_sec_p50': percentile(0.5),
+                'latency_sec_p95': percentile(0.95),
+            }
+
+    def _record(self, request_sec: float, connect_sec: float) -> None:
+        """
+        Records the latency of one successful request, and logs the stats every
+        `self.log_stats_every_n_requests` requests.
+        """
+        with self._lock:
+            self._n_requests += 1
+            self._n_new_connections += connect_sec > 0
+            self._total_connect_sec += connect_sec
+            self._total_request_sec += request_sec
+            self._latencies_sec.append(request_sec)
+            should_log = self._n_requests % self.log_stats_every_n_requests == 0
+
+        if should_log:
+            stats = self.stats()
+            logger.info(
+                f'Kraken REST API: {stats["n_requests"]} requests, '
+                f'{stats["n_new_connections"]} new connections, '
+                f'{stats["connect_sec_total"]:.1f}s connecting and '
+                f'{stats["request_sec_total"] - stats["connect_sec_total"]:.1f}s waiting '
+                f'for Kraken, p50={stats["latency_sec_p50"] * 1000:.0f}ms '
+                f'p95={stats["latency_sec_p95"] * 1000:.0f}ms'
+            )
+
+
+# one client, and so one pool of keep-alive connections, shared by all the
+# KrakenRestAPI instances of the process
+kraken_http_client = KrakenHttpClient()
@@ -0,0 +1,169 @@
+import bisect
+import zlib
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+class _BookSide:
+    """
+    One side of an order book: the price levels sorted from best to worst, in two
+    parallel arrays.
+
+    We keep the levels sorted by a key that grows from the best level to the worst:
+    the price for asks and minus the price for bids. Finding a level is a binary search,
+    O(log n), and inserting or deleting one is a memmove inside the array, which for
+    the 10-1000 levels Kraken sends is cheaper than any tree of Python objects.
+    """
+
+    __slots__ = ('sign', 'keys', 'qtys')
+
+    def __init__(self, is_bids: bool) -> None:
+        self.sign = -1.0 if is_bids else 1.0
+        self.keys = array('d')
+        self.qtys = array('d')
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def set(self, price: float, qty: float) -> None:
+        """
+        Sets the quantity of a price level. A quantity of 0 removes the level.
+        """
+        key = self.sign * price
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            if qty == 0:
+                del self.keys[i]
+                del self.qtys[i]
+            else:
+                self.qtys[i] = qty
+        elif qty != 0:
+            self.keys.insert(i, key)
+            self.qtys.insert(i, qty)
+
+    def truncate(self, depth: int) -> None:
+        """
+        Drops the levels past the `depth` best ones.
+        """
+        del self.keys[depth:]
+        del self.qtys[depth:]
+
+    def clear(self) -> None:
+        self.truncate(0)
+
+    def top(self, n_levels: int) -> Iterator[Tuple[float, float]]:
+        """
+        Yields the (price, qty) of the `n_levels` best levels, from best to worst.
+        """
+        for key, qty in zip(self.keys[:n_levels], self.qtys[:n_levels]):
+            yield self.sign * key, qty
+
+
+class OrderBook:
+    """
+    The order book of one product, kept up to date with the snapshot and the updates
+    of the Kraken websocket `book` channel.
+    """
+
+    def __init__(
+        self,
+        product_id: str,
+        depth: int,
+        price_precision: int,
+        qty_precision: int,
+    ) -> None:
+        """
+        Args:
+            product_id (str): The product of the book.
+            depth (int): The number of levels per side we subscribed to.
+            price_precision (int): The number of decimals of the prices.
+            qty_precision (int): The number of decimals of the quantities.
+
+        Returns:
+            None
+        """
+        self.product_id = product_id
+        self.depth = depth
+        self.price_precision = price_precision
+        self.qty_precision = qty_precision
+
+        self.bids = _BookSide(is_bids=True)
+        self.asks = _BookSide(is_bids=False)
+
+        # False until we get a snapshot, and again after a checksum mismatch
+        self.is_synced = False
+
+    def apply_snapshot(self, bids: List[dict], asks: List[dict]) -> None:
+        """
+        Replaces the whole book with a snapshot from Kraken.
+        """
+        self.bids.clear()
+        self.asks.clear()
+        self.apply_update(bids, asks)
+        self.is_synced = True
+
+    def apply_update(self, bids: List[dict], asks: List[dict]) -> None:
+        """
+        Applies the changed levels of an update. Levels pushed past the subscribed
+        depth are dropped, as Kraken does on its side.
+        """
+        for level in bids:
+            self.bids.set(level['price'], level['qty'])
+        for level in asks:
+            self.asks.set(level['price'], level['qty'])
+        self.bids.truncate(self.depth)
+        self.asks.truncate(self.depth)
+
+    def checksum(self) -> int:
+        """
+        Returns the CRC32 checksum of the top 10 levels of the book, computed the way
+        Kraken computes the `checksum` field of its book messages: for each level,
+        asks from best to worst and then bids from best to worst, the price and the
+        quantity with their native precision, without the decimal point and without
+        leading zeros.
+        """
+        parts = []
+        for side in (self.asks, self.bids):
+            for price, qty in side.top(10):
+                parts.append(self._format(price, self.price_precision))
+                parts.append(self._format(qty, self.qty_precision))
+        return zlib.crc32(''.join(parts).encode())
+
+    def features(self, n_levels: int = 10) -> Optional[Dict[str, float]]:
+        """
+        Returns the features of the book we publish to Kafka, or None if one side of
+        the book is empty.
+
+        Args:
+            n_levels (int): The number of levels per side we compute the depth
+                imbalance over.
+
+        Returns:
+            Optional[Dict[str, float]]: The best bid and ask, the spread, the mid
+            price, the microprice and the depth imbalance.
+        """
+        if not self.bids or not self.asks:
+            return None
+
+        best_bid, best_bid_qty = next(self.bids.top(1))
+        best_ask, best_ask_qty = next(self.asks.top(1))
+        bid_depth = sum(qty for _, qty in self.bids.top(n_levels))
+        ask_depth = sum(qty for _, qty in self.asks.top(n_levels))
+
+        return {
+            'product_id': self.product_id,
+            'best_bid': best_bid,
+            'best_ask': best_ask,
+            'spread': best_ask - best_bid,
+            'mid_price': (best_bid + best_ask) / 2,
+            # the mid price weighted by the quantity on the other side, that leans
+            # towards the side more likely to move
+            'microprice': (best_bid * best_ask_qty + best_ask * best_bid_qty)
+            / (best_bid_qty + best_ask_qty),
+            # between -1 (only asks) and 1 (only bids)
+            'depth_imbalance': (bid_depth - ask_depth) / (bid_depth + ask_depth),
+        }
+
+    @staticmethod
+    def _format(value: float, precision: int) -> str:
+        return f'{value:.{precision}f}'.replace('.', '').lstrip('0')
@@ -0,0 +1,85 @@
+import queue
+import threading
+from typing import Union
+
+from loguru import logger
+
+from src.kraken_api.rest import KrakenRestAPIMultipleProducts
+from src.kraken_api.trade import TradeBatch
+
+# marks the end of the historical data in the queue
+_DONE = object()
+
+
+class PrefetchingTradeAPI:
+    """
+    Wraps a historical trade API and keeps fetching its next batches in a background
+    thread, while the main thread produces the previous ones to Kafka.
+
+    At most `lookahead` batches wait in memory. With KrakenRestAPIMultipleProducts
+    each batch holds one page per product, so that is up to `lookahead` pages per
+    product.
+    """
+
+    def __init__(
+        self,
+        kraken_api: KrakenRestAPIMultipleProducts,
+        lookahead: int = 4,
+    ) -> None:
+        """
+        Starts the background thread that fetches the batches.
+
+        Args:
+            kraken_api (KrakenRestAPIMultipleProducts): The API we fetch the batches from.
+            lookahead (int): The maximum number of batches fetched ahead of the one
+                we are producing.
+
+        Returns:
+            None
+        """
+        self.kraken_api = kraken_api
+        self._queue: queue.Queue = queue.Queue(maxsize=lookahead)
+        self._is_done = False
+
+        self._thread = threading.Thread(
+            target=self._prefetch, name='kraken-prefetch', daemon=True
+        )
+        self._thread.start()
+
+    def get_trades(self) -> TradeBatch:
+        """
+        Returns the next batch of trades, waiting for it if it is still being fetched.
+        """
+        item: Union[TradeBatch, Exception, object] = self._queue.get()
+
+        if item is _DONE:
+            self._is_done = True
+            return TradeBatch()
+
+        if isinstance(item, Exception):
+            # the fetching thread failed, so we fail the same way the API would have
+            raise item
+
+        return item
+
+    def is_done(self) -> bool:
+        """
+        Returns True once we returned all the batches of the wrapped API.
+        """
+        return self._is_done
+
+    def _prefetch(self) -> None:
+        """
+        Fetches batches until the wrapped API is done. Blocks while the queue is full.
+        """
+        try:
+            while not self.kraken_api.is_done():
+                trades = self.kraken_api.get_trades()
+                if trades:
+                    self._queue.put(trades)
+        except Exception as e:
+            logger.error(f'Failed to prefetch trades: {e}')
+            self._queue.put(e)
+            return
+
+        self._queue.put(_DONE)
@@ -0,0 +1,146 @@
+import threading
+import time
+from typing import Optional
+
+from loguru import logger
+
+
+class AdaptiveRateLimiter:
+    """
+    A thread-safe token bucket that adapts its refill rate to the errors we get.
+
+    Every request takes one token with `acquire()`, blocking until one is available.
+    Tokens are refilled at `rate` tokens per second, up to `capacity`.
+
+    - When Kraken answers with `EGeneral:Too many requests`, or an `EService:` error
+    when it is overloaded, we call `on_rate_limited()`, which halves the rate and
+    pauses everyone for one refill period.
+    - Every successful request calls `on_success()`, which increases the rate by
+    `increase_step`, up to `max_rate`.
+
+    We start at `initial_rate`, and `max_rate` is above it, so while Kraken does not
+    complain we go faster than the rate we start with, and find the actual limit.
+    """
+
+    def __init__(
+        self,
+        initial_rate: float = 1.0,
+        max_rate: float = 2.0,
+        min_rate: float = 0.1,
+        capacity: float = 1.0,
+        increase_step: float = 0.05,
+        backoff_factor: float = 0.5,
+    ) -> None:
+        """
+        Args:
+            initial_rate (float): The number of requests per second we start at.
+            max_rate (float): The maximum number of requests per second.
+            min_rate (float): The minimum number of requests per second we back off to.
+            capacity (float): The maximum number of tokens in the bucket, i.e. the
+                maximum burst of requests.
+            increase_step (float): How much we increase the rate after each success.
+            backoff_factor (float): By how much we multiply the rate after an error.
+
+        Returns:
+            None
+        """
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.capacity = capacity
+        self.increase_step = increase_step
+        self.backoff_factor = backoff_factor
+
+        self.rate = min(initial_rate, max_rate)
+        self.n_rate_limited = 0
+
+        self._tokens = capacity
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        Blocks until we are allowed to make one more request.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+
+            # we take the token now, even if it is not there yet, so concurrent callers
+            # queue up behind us instead of all waking up at the same time
+            self._tokens -= 1
+            wait_sec = max(-self._tokens / self.rate, self._paused_until - now, 0.0)
+
+        if wait_sec > 0:
+            time.sleep(wait_sec)
+
+    def on_success(self) -> None:
+        """
+        Speeds up, up to `self.max_rate`, after a successful request.
+        """
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_rate_limited(self, reason: str = 'Too many requests') -> None:
+        """
+        Slows down, down to `self.min_rate`, after Kraken told us we are making too
+        many requests (or it is overloaded), and pauses all callers for one refill
+        period.
+        """
+        with self._lock:
+            self.n_rate_limited += 1
+            self.rate = max(self.min_rate, self.rate * self.backoff_factor)
+
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens = min(self._tokens, 0.0)
+            self._paused_until = now + 1 / self.rate
+
+        logger.info(f'{reason}. Slowing down to {self.rate:.2f} requests/sec')
+
+    def _refill(self, now: float) -> None:
+        """
+        Adds the tokens accumulated since the last refill. Must be called with the
+        lock held.
+        """
+        elapsed = now - self._last_refill
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._last_refill = now
+
+
+# Kraken counts the calls to its public REST endpoints per IP address, so all the
+# KrakenRestAPI instances in this process share the same limiter by default.
+_kraken_public_rate_limiter: Optional[AdaptiveRateLimiter] = None
+_kraken_public_rate_limiter_lock = threading.Lock()
+
+
+def get_kraken_public_rate_limiter(
+    max_rate: Optional[float] = None,
+) -> AdaptiveRateLimiter:
+    """
+    Returns the rate limiter of the public REST endpoints shared by the process,
+    creating it the first time.
+
+    Args:
+        max_rate (Optional[float]): The maximum number of requests per second of the
+            limiter. By default, the one of `AdaptiveRateLimiter`. It is only used to
+            create the limiter, so asking for another rate afterwards is an error.
+
+    Returns:
+        AdaptiveRateLimiter: The shared rate limiter.
+    """
+    global _kraken_public_rate_limiter
+
+    with _kraken_public_rate_limiter_lock:
+        if _kraken_public_rate_limiter is None:
+            _kraken_public_rate_limiter = (
+                AdaptiveRateLimiter()
+                if max_rate is None
+                else AdaptiveRateLimiter(max_rate=max_rate)
+            )
+        elif max_rate is not None and max_rate != _kraken_public_rate_limiter.max_rate:
+            raise ValueError(
+                f'The shared rate limiter already has a max rate of '
+                f'{_kraken_public_rate_limiter.max_rate} requests/sec, not {max_rate}'
+            )
+        return _kraken_public_rate_limiter
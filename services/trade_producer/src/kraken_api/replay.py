@@ -0,0 +1,151 @@
+import bisect
+import time
+from typing import List, Optional
+
+from loguru import logger
+
+from src.kraken_api.trade import TradeBatch
+from src.kraken_api.trade_store import DAY_MS, day_start_ms, get_trade_store
+
+
+class TradeStoreReplay:
+    """
+    Replays the trades of a TradeStore, without calling Kraken.
+
+    We load one day at a time, for all the products at once, straight from the parquet
+    files (memory-mapped) into a TradeBatch sorted by timestamp, and return it in
+    slices of up to `batch_size` trades. Trades of the same product always come in
+    timestamp order.
+
+    By default we replay as fast as the producer can go. With a `speed` multiplier we
+    pace the trades by their timestamps instead, e.g. speed=10 replays one hour of
+    trades in 6 minutes, which is handy for realistic load tests of the downstream
+    services.
+    """
+
+    def __init__(
+        self,
+        product_ids: List[str],
+        cache_dir: str,
+        last_n_days: int,
+        batch_size: Optional[int] = 100_000,
+        speed: Optional[float] = None,
+    ) -> None:
+        """
+        Args:
+            product_ids (List[str]): The product IDs for which we want to replay trades.
+            cache_dir (str): The directory of the TradeStore.
+            last_n_days (int): The number of days of trades we want to replay.
+            batch_size (Optional[int]): The maximum number of trades per batch.
+            speed (Optional[float]): How many times faster than real time we replay
+                the trades. None replays them as fast as possible.
+
+        Returns:
+            None
+        """
+        from src.kraken_api.rest import KrakenRestAPI, ts_to_date
+
+        assert speed is None or speed > 0, f'Invalid replay speed: {speed}'
+
+        self.product_ids = product_ids
+        self.batch_size = batch_size
+        self.speed = speed
+        self.store = get_trade_store(cache_dir)
+
+        self.from_ms, self.to_ms = KrakenRestAPI._init_from_to_ms(last_n_days)
+
+        # we only replay what the store has. Missing ranges are not an error, but you
+        # probably want to run a historical backfill first
+        for product_id in product_ids:
+            for gap_from_ms, gap_to_ms in self.store.gaps(
+                product_id, self.from_ms, self.to_ms
+            ):
+                logger.warning(
+                    f'No cached trades for {product_id} between '
+                    f'{ts_to_date(gap_from_ms)} and {ts_to_date(gap_to_ms)}'
+                )
+
+        # the day we load next
+        self._next_day_ms = day_start_ms(self.from_ms)
+
+        # the trades of the current day, and the position of the next one to return
+        self._trades = TradeBatch()
+        self._position = 0
+
+        # wall clock and trade clock when the replay started, to pace it
+        self._started_at: Optional[float] = None
+        self._first_trade_ms: Optional[int] = None
+
+    def get_trades(self) -> TradeBatch:
+        """
+        Returns the next batch of trades, or an empty one if none is due yet.
+        """
+        if self._position >= len(self._trades):
+            self._load_next_day()
+            if self._position >= len(self._trades):
+                return TradeBatch()
+
+        end = min(self._position + self.batch_size, len(self._trades))
+
+        if self.speed is not None:
+            end = self._pace(end)
+
+        trades = self._trades.slice(self._position, end)
+        self._position = end
+        return trades
+
+    def is_done(self) -> bool:
+        """
+        Returns True once we replayed all the days in the range.
+        """
+        return self._next_day_ms > self.to_ms and self._position >= len(self._trades)
+
+    def _load_next_day(self) -> None:
+        """
+        Loads the trades of all the products for the next day in the range, merged
+        and sorted by timestamp.
+        """
+        import pyarrow as pa
+
+        day_from_ms = max(self.from_ms, self._next_day_ms)
+        day_to_ms = min(self.to_ms, self._next_day_ms + DAY_MS - 1)
+        self._next_day_ms += DAY_MS
+
+        table = pa.concat_tables(
+            [
+                self.store.read_table(product_id, day_from_ms, day_to_ms)
+                for product_id in self.product_ids
+            ]
+        )
+        # the sort is stable, so trades of the same product keep their order
+        if len(self.product_ids) > 1:
+            table = table.sort_by('timestamp_ms')
+
+        self._trades = TradeBatch.from_arrow(table)
+        self._position = 0
+
+        logger.debug(f'Loaded {len(self._trades)} cached trades to replay')
+
+    def _pace(self, end: int) -> int:
+        """
+        Returns the end of the next batch so it only holds trades that are due at
+        `self.speed` times real time. Sleeps until the next trade is due if none is.
+        """
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+            self._first_trade_ms = self._trades.timestamps_ms[self._position]
+
+        due_ms = self._first_trade_ms + int(
+            (time.monotonic() - self._started_at) * 1000 * self.speed
+        )
+        end = bisect.bisect_right(
+            self._trades.timestamps_ms, due_ms, lo=self._position, hi=end
+        )
+
+        if end == self._position:
+            # nothing is due yet. We wait for the next trade, but never longer than
+            # 100ms so the main loop keeps serving the producer delivery reports
+            next_trade_ms = self._trades.timestamps_ms[self._position]
+            time.sleep(min(0.1, (next_trade_ms - due_ms) / 1000 / self.speed))
+
+        return end
@@ -1,12 +1,66 @@
-import json
-from pathlib import Path
-from time import sleep
-from typing import Dict, List, Optional, Tuple
+from collections import deque
+from itertools import cycle
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple, Union
 
-import requests
 from loguru import logger
 
-from src.kraken_api.trade import Trade
+from src.kraken_api.http_client import KrakenHttpClient, kraken_http_client
+from src.kraken_api.rate_limiter import (
+    AdaptiveRateLimiter,
+    get_kraken_public_rate_limiter,
+)
+from src.kraken_api.trade import TradeBatch
+
+# the errors Kraken answers with when we make too many requests, or when it is
+# overloaded or down for a moment (EService:Unavailable, EService:Busy...). We back
+# off and retry them
+RETRIABLE_ERROR_PREFIXES = ('EGeneral:Too many requests', 'EService:')
+
+
+class EgressRoute(NamedTuple):
+    """
+    The rate limiter and the HTTP client of one egress IP. Kraken counts the calls to
+    its public endpoints per IP, so each egress IP has a rate budget of its own.
+    """
+
+    rate_limiter: AdaptiveRateLimiter
+    http_client: KrakenHttpClient
+
+
+def get_egress_routes(
+    egress_ips: Optional[List[str]], max_requests_per_sec: Optional[float] = None
+) -> List[EgressRoute]:
+    """
+    Returns one route per local IP address in `egress_ips`, each with its own rate
+    limiter of up to `max_requests_per_sec`. Without `egress_ips`, the single route of
+    the process: the shared rate limiter and HTTP client.
+
+    Args:
+        egress_ips (Optional[List[str]]): The local IP addresses of the host we can
+            send the requests from.
+        max_requests_per_sec (Optional[float]): The rate budget of each egress IP. By
+            default, the one of `AdaptiveRateLimiter`.
+
+    Returns:
+        List[EgressRoute]: The routes.
+    """
+    if not egress_ips:
+        return [
+            EgressRoute(
+                get_kraken_public_rate_limiter(max_requests_per_sec), kraken_http_client
+            )
+        ]
+
+    limiter_kwargs = {}
+    if max_requests_per_sec is not None:
+        limiter_kwargs['max_rate'] = max_requests_per_sec
+    return [
+        EgressRoute(
+            rate_limiter=AdaptiveRateLimiter(**limiter_kwargs),
+            http_client=KrakenHttpClient(source_address=egress_ip),
+        )
+        for egress_ip in egress_ips
+    ]
 
 
 class KrakenRestAPIMultipleProducts:
@@ -16,67 +70,134 @@ class KrakenRestAPIMultipleProducts:
         last_n_days: int,
         n_threads: Optional[int] = 1,
         cache_dir: Optional[str] = None,
+        n_time_shards: Optional[int] = 1,
+        resume_from_ms: Optional[Dict[str, int]] = None,
+        to_ms: Optional[int] = None,
+        base_url: Optional[str] = None,
+        egress_routes: Optional[List[EgressRoute]] = None,
     ) -> None:
-        self.product_ids = product_ids
+        """
+        Args:
+            product_ids (List[str]): The product IDs for which we want to get the trades.
+            last_n_days (int): The number of days from which we want to get historical data.
+            n_threads (Optional[int]): The number of products we fetch concurrently.
+            cache_dir (Optional[str]): The directory where we store the historical data.
+            n_time_shards (Optional[int]): The number of segments we split the time
+                range of each product into, to fetch them concurrently.
+            resume_from_ms (Optional[Dict[str, int]]): For each product, the timestamp
+                of the last trade we already produced in a previous run. We resume
+                right after it.
+            to_ms (Optional[int]): The timestamp of the last trade we want. By default,
+                midnight today.
+            base_url (Optional[str]): The base URL of the REST API, e.g. to point at
+                the local Kraken stand-in. By default, Kraken's.
+            egress_routes (Optional[List[EgressRoute]]): The egress IPs we spread the
+                cursors (products, or segments with time shards) across, round-robin.
+                By default, the single route of the process.
 
-        self.kraken_apis = [
-            KrakenRestAPI(
-                product_id=product_id, last_n_days=last_n_days, cache_dir=cache_dir
-            )
-            for product_id in product_ids
-        ]
+        Returns:
+            None
+        """
+        self.product_ids = product_ids
+        routes = cycle(egress_routes or get_egress_routes(None))
+
+        from_ms, default_to_ms = KrakenRestAPI._init_from_to_ms(last_n_days)
+        to_ms = to_ms if to_ms is not None else default_to_ms
+        resume_from_ms = resume_from_ms or {}
+
+        # with more than 1 time shard, each product splits its time range into
+        # `n_time_shards` segments that are fetched concurrently
+        self.kraken_apis: List[Union[KrakenRestAPI, KrakenRestAPITimeSharded]] = []
+        for product_id in product_ids:
+            product_from_ms = from_ms
+            if product_id in resume_from_ms:
+                product_from_ms = max(from_ms, resume_from_ms[product_id] + 1)
+                logger.info(f'Resuming {product_id} from {ts_to_date(product_from_ms)}')
+
+            if n_time_shards == 1:
+                route = next(routes)
+                kraken_api = KrakenRestAPI(
+                    product_id=product_id,
+                    last_n_days=last_n_days,
+                    cache_dir=cache_dir,
+                    rate_limiter=route.rate_limiter,
+                    http_client=route.http_client,
+                    from_ms=product_from_ms,
+                    to_ms=to_ms,
+                    base_url=base_url,
+                )
+            else:
+                kraken_api = KrakenRestAPITimeSharded(
+                    product_id=product_id,
+                    last_n_days=last_n_days,
+                    n_shards=n_time_shards,
+                    cache_dir=cache_dir,
+                    from_ms=product_from_ms,
+                    to_ms=to_ms,
+                    base_url=base_url,
+                    egress_routes=[next(routes) for _ in range(n_time_shards)],
+                )
+            self.kraken_apis.append(kraken_api)
 
         self.n_threads = n_threads
 
-    def get_trades(self) -> List[Dict]:
+        # we keep one pool of worker threads alive for the whole backfill, instead of
+        # creating a new one on every call to get_trades(). All the workers share the
+        # same rate limiter, so together they make requests at Kraken's rate limit.
+        self._executor = None
+        if n_threads > 1:
+            from concurrent.futures import ThreadPoolExecutor
+
+            self._executor = ThreadPoolExecutor(
+                max_workers=n_threads, thread_name_prefix='kraken-rest'
+            )
+
+    def get_trades(self) -> TradeBatch:
         """
-        Gets trade data from each kraken_api in self.kraken_apis and retuns a list
+        Gets trade data from each kraken_api in self.kraken_apis and retuns a batch
         with all trades from all kraken_apis.
 
         Args:
             None
 
         Returns:
-            List[Dict]: A list of dictionaries, where each dictionary contains the trade
-            data, for all product_ids in self.product_ids
+            TradeBatch: The trades for all product_ids in self.product_ids
         """
+        trades = TradeBatch()
+
         if self.n_threads == 1:
             # this is the sequential version
-            trades: List[Dict] = []
-
             for kraken_api in self.kraken_apis:
                 if kraken_api.is_done():
                     # if we are done fetching historical data for this product_id, skip it
                     continue
                 else:
-                    trades += kraken_api.get_trades()
+                    trades.extend(kraken_api.get_trades())
         else:
             # this is the parallel version
-            from concurrent.futures import ThreadPoolExecutor
-
-            with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
-                trades = list(
-                    executor.map(self.get_trades_for_one_product, self.kraken_apis)
-                )
-                # trades is a list of lists, so we need to flatten it
-                trades = [trade for sublist in trades for trade in sublist]
+            for batch in self._executor.map(
+                self.get_trades_for_one_product, self.kraken_apis
+            ):
+                trades.extend(batch)
 
         return trades
 
-    def get_trades_for_one_product(self, kraken_api: 'KrakenRestAPI') -> List[Trade]:
+    def get_trades_for_one_product(
+        self, kraken_api: Union['KrakenRestAPI', 'KrakenRestAPITimeSharded']
+    ) -> TradeBatch:
         """
         Returns next batch of trades for a given kraken_api.
 
         Args:
-            kraken_api (KrakenRestAPI): An instance of KrakenRestAPI from which we want to
-            fetch trades.
+            kraken_api (KrakenRestAPI | KrakenRestAPITimeSharded): The API from which
+            we want to fetch trades.
 
         Returns:
-            List[Trade]: A list of trades for the given kraken_api
+            TradeBatch: The trades for the given kraken_api
         """
         if not kraken_api.is_done():
             return kraken_api.get_trades()
-        return []
+        return TradeBatch()
 
     def is_done(self) -> bool:
         """
@@ -87,17 +208,28 @@ class KrakenRestAPIMultipleProducts:
             if not kraken_api.is_done():
                 return False
 
+        # we are done, so we can release the worker threads
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
         return True
 
 
 class KrakenRestAPI:
-    URL = 'https://api.kraken.com/0/public/Trades?pair={product_id}&since={since_sec}'
+    BASE_URL = 'https://api.kraken.com'
+    URL = '{base_url}/0/public/Trades?pair={product_id}&since={since_sec}'
 
     def __init__(
         self,
         product_id: str,
         last_n_days: int,
         cache_dir: Optional[str] = None,
+        rate_limiter: Optional[AdaptiveRateLimiter] = None,
+        http_client: Optional[KrakenHttpClient] = None,
+        from_ms: Optional[int] = None,
+        to_ms: Optional[int] = None,
+        base_url: Optional[str] = None,
     ) -> None:
         """
         Basic initialization of the Kraken Rest API.
@@ -106,19 +238,37 @@ class KrakenRestAPI:
             product_id (str): One product ID for which we want to get the trades.
             last_n_days (int): The number of days from which we want to get historical data.
             cache_dir (Optional[str]): The directory where we will store the historical data to
+            rate_limiter (Optional[AdaptiveRateLimiter]): The rate limiter we acquire a
+                token from before each request. By default, the one shared by the whole
+                process.
+            http_client (Optional[KrakenHttpClient]): The HTTP client we make the
+                requests with. By default, the one shared by the whole process, so all
+                requests reuse the same pool of keep-alive connections.
+            from_ms (Optional[int]): If given, together with `to_ms`, the time range
+                we fetch instead of the one computed from `last_n_days`.
+            to_ms (Optional[int]): The end of the time range, inclusive.
+            base_url (Optional[str]): The base URL of the REST API, e.g. to point at
+                the local Kraken stand-in. By default, Kraken's.
 
         Returns:
             None
         """
         self.product_id = product_id
-        self.from_ms, self.to_ms = self._init_from_to_ms(last_n_days)
+        self.base_url = base_url or self.BASE_URL
+        self.rate_limiter = rate_limiter or get_kraken_public_rate_limiter()
+        self.http_client = http_client or kraken_http_client
+        if from_ms is not None and to_ms is not None:
+            self.from_ms, self.to_ms = from_ms, to_ms
+        else:
+            self.from_ms, self.to_ms = self._init_from_to_ms(last_n_days)
 
         logger.debug(
             f'Initializing KrakenRestAPI: from_ms={ts_to_date(self.from_ms)}, to_ms={ts_to_date(self.to_ms)}'
         )
 
         # the timestamp from which we want to fetch historical data
-        # this will be updated after each batch of trades is fetched from the API
+        # this will be updated after each batch of trades is fetched from the API, and
+        # it is always the timestamp of the next trade we have not returned yet
         # self.since_ms = from_ms
         self.last_trade_ms = self.from_ms
 
@@ -130,9 +280,20 @@ class KrakenRestAPI:
         # service restarts
         self.use_cache = False
         if cache_dir is not None:
-            self.cache = CachedTradeData(cache_dir)
+            from src.kraken_api.trade_store import get_trade_store
+
+            self.store = get_trade_store(cache_dir)
             self.use_cache = True
 
+            gaps = self.store.gaps(product_id, self.from_ms, self.to_ms)
+            missing_ms = sum(
+                gap_to_ms - gap_from_ms + 1 for gap_from_ms, gap_to_ms in gaps
+            )
+            logger.info(
+                f'Trade store covers {1 - missing_ms / (self.to_ms - self.from_ms + 1):.0%} '
+                f'of the time range of {product_id}. Fetching {len(gaps)} gaps from Kraken'
+            )
+
     @staticmethod
     def _init_from_to_ms(last_n_days: int) -> Tuple[int, int]:
         """
@@ -160,180 +321,360 @@ class KrakenRestAPI:
 
         return from_ms, to_ms
 
-    def get_trades(self) -> List[Trade]:
+    def get_trades(self) -> TradeBatch:
         """
-        Fetches a batch of trades from the Kraken Rest API and returns them as a list
-        of dictionaries.
+        Fetches a batch of trades from the Kraken Rest API and returns them as a
+        TradeBatch.
+
+        If the trade store already covers `self.last_trade_ms`, we read the trades
+        from disk instead, up to the end of the covered range (or the end of the day,
+        whatever comes first).
 
         Args:
             None
 
         Returns:
-            List[Trade]: A list of dictionaries, where each dictionary contains the trade data.
+            TradeBatch: The trades, column by column.
         """
+        if self.use_cache:
+            covered_to_ms = self.store.covered_until(
+                self.product_id, self.last_trade_ms
+            )
+            if covered_to_ms is not None:
+                return self._read_from_store(covered_to_ms)
+
         # Replace the placeholders in the URL with the actual values for
         # - product_id
         # - since_ns
-        since_ns = self.last_trade_ms * 1_000_000
-        payload = {}
-        headers = {'Accept': 'application/json'}
-        url = self.URL.format(product_id=self.product_id, since_sec=since_ns)
+        since_ms = self.last_trade_ms
+        since_ns = since_ms * 1_000_000
+        url = self.URL.format(
+            base_url=self.base_url, product_id=self.product_id, since_sec=since_ns
+        )
         logger.debug(f'{url=}')
 
-        if self.use_cache and self.cache.has(url):
-            # read the data from the cache
-            trades = self.cache.read(url)
-            logger.debug(
-                f'Loaded {len(trades)} trades for {self.product_id}, since={ns_to_date(since_ns)} from the cache'
-            )
+        # make the request to the Kraken REST API
+        data = self._request(url)
+
+        # Python trick
+        # Instead of initializing an empty list and appending to it, like this
+        #
+        # trades = []
+        # for trade in data['result'][self.product_ids[0]]:
+        #     trades.append({
+        #         'price': float(trade[0]),
+        #         'volume': float(trade[1]),
+        #         'time': int(trade[2]),
+        #     })
+        #
+        # You can use a list comprehension to do the same thing, and here we go
+        # one step further and build the columns of the TradeBatch directly
+        raw_trades = data['result'][self.product_id]
+        trades = TradeBatch(
+            product_ids=[self.product_id] * len(raw_trades),
+            prices=[float(trade[0]) for trade in raw_trades],
+            volumes=[float(trade[1]) for trade in raw_trades],
+            timestamps_ms=[int(trade[2] * 1000) for trade in raw_trades],
+            # 'b' or 's', the side of the taker
+            sides=['buy' if trade[3] == 'b' else 'sell' for trade in raw_trades],
+        )
+
+        logger.debug(
+            f'Fetched {len(trades)} trades for {self.product_id}, since={ns_to_date(since_ns)} from the Kraken REST API'
+        )
+
+        if not trades:
+            # no trades after `since` yet, so we keep the same cursor and try again later
+            return trades
+
+        last_ms = trades.timestamps_ms[-1]
+        if last_ms == since_ms:
+            # if all trades in the batch have the same timestamp as `since`, we need to
+            # move the cursor by 1 to avoid repeating the exact same API request,
+            # which would result in an infinite loop
+            self.last_trade_ms = last_ms + 1
         else:
-            # make the request to the Kraken REST API
-            response = requests.request('GET', url, headers=headers, data=payload)
+            # otherwise, the page might have been cut in the middle of the trades with
+            # timestamp `last_ms`. We keep the ones before it, and the next request
+            # starts at `last_ms`, so every trade is returned exactly once.
+            trades = trades.filter_by_timestamp(max_ms=last_ms - 1)
+            self.last_trade_ms = last_ms
 
-            # parse string into dictionary
-            data = json.loads(response.text)
+        if self.use_cache:
+            # the batch has all the trades in [since_ms, self.last_trade_ms - 1]
+            self.store.write(self.product_id, trades, since_ms, self.last_trade_ms - 1)
 
-            # TODO: Error handling
-            # It can happen that we get an error response from KrakenRESTAP like the following:
-            # data = {'error': ['EGeneral:Too many requests']}
-            # To solve this have several options
-            #
-            # Option 1. Check if the `error` key is present in the `data` and has
-            # a non-empty list value. If so, we could raise an exception, or even better, implment
-            # a retry mechanism, using a library like `retry` https://github.com/invl/retry
-            #
-            # Option 2. Simply slow down the rate at which we are making requests to the Kraken API,
-            # and cross your fingers.
-            #
-            # Option 3. Implement both Option 1 and Option 2, so you don't need to cross your fingers.
-            #
-            # Here is an example of how you could implement Option 2
-            if ('error' in data) and ('EGeneral:Too many requests' in data['error']):
-                # slow down the rate at which we are making requests to the Kraken API
-                logger.info('Too many requests. Sleeping for 30 seconds')
-                sleep(30)
-
-            # Python trick
-            # Instead of initializing an empty list and appending to it, like this
-            #
-            # trades = []
-            # for trade in data['result'][self.product_ids[0]]:
-            #     trades.append({
-            #         'price': float(trade[0]),
-            #         'volume': float(trade[1]),
-            #         'time': int(trade[2]),
-            #     })
-            #
-            # You can use a list comprehension to do the same thing
-            trades = [
-                Trade(
-                    price=float(trade[0]),
-                    volume=float(trade[1]),
-                    timestamp_ms=int(trade[2] * 1000),
-                    product_id=self.product_id,
-                )
-                for trade in data['result'][self.product_id]
-            ]
+        # filter out trades that are after the end timestamp
+        trades = trades.filter_by_timestamp(max_ms=self.to_ms)
 
-            logger.debug(
-                f'Fetched {len(trades)} trades for {self.product_id}, since={ns_to_date(since_ns)} from the Kraken REST API'
-            )
+        return trades
 
-            if self.use_cache:
-                # write the data to the cache
-                self.cache.write(url, trades)
-                logger.debug(
-                    f'Wrote to cache for {self.product_id}, since={ns_to_date(since_ns)}'
-                )
+    def _read_from_store(self, covered_to_ms: int) -> TradeBatch:
+        """
+        Reads the trades from `self.last_trade_ms` up to `covered_to_ms` from the trade
+        store, one day at most, and moves the cursor past them.
+
+        Args:
+            covered_to_ms (int): The end of the covered range `self.last_trade_ms` is in.
 
-            # slow down the rate at which we are making requests to the Kraken API
-            sleep(1)
+        Returns:
+            TradeBatch: The trades, column by column.
+        """
+        from src.kraken_api.trade_store import DAY_MS
 
-        if trades[-1].timestamp_ms == self.last_trade_ms:
-            # if the last trade timestamp in the batch is the same as self.last_trade_ms,
-            # then we need to increment it by 1 to avoid repeating the exact same API request,
-            # which would result in an infinite loop
-            self.last_trade_ms = trades[-1].timestamp_ms + 1
-        else:
-            # otherwise, update self.last_trade_ms to the timestamp of the last trade
-            # in the batch
-            self.last_trade_ms = trades[-1].timestamp_ms
-        
-        # filter out trades that are after the end timestamp
-        trades = [trade for trade in trades if trade.timestamp_ms <= self.to_ms]
+        from_ms = self.last_trade_ms
+        end_of_day_ms = from_ms - from_ms % DAY_MS + DAY_MS - 1
+        to_ms = min(covered_to_ms, self.to_ms, end_of_day_ms)
 
-        # if ns_to_date(since_ns) == '2024-04-30 18:33:41':
-        #     # self.cache._get_file_path(url)
-        #     breakpoint()
+        trades = self.store.read(self.product_id, from_ms, to_ms)
+        self.last_trade_ms = to_ms + 1
 
+        logger.debug(
+            f'Loaded {len(trades)} trades for {self.product_id}, from={ts_to_date(from_ms)} from the trade store'
+        )
         return trades
 
+    def _request(self, url: str) -> dict:
+        """
+        Makes a GET request to the Kraken REST API and returns the parsed response.
+
+        Before each request we acquire a token from `self.rate_limiter`. If Kraken
+        answers with one of the `RETRIABLE_ERROR_PREFIXES` errors we tell the rate
+        limiter to slow down and try again. Connection errors, timeouts and 5xx responses are retried
+        by `self.http_client`.
+
+        Args:
+            url (str): The URL to request.
+
+        Returns:
+            dict: The parsed JSON response, with no errors in it.
+        """
+        while True:
+            self.rate_limiter.acquire()
+
+            # keep-alive, gzip compressed request, parsed into a dictionary
+            data = self.http_client.get_json(url)
+
+            # It can happen that we get an error response from Kraken like the following:
+            # data = {'error': ['EGeneral:Too many requests']}
+            # In this case we slow down and retry. Any other error is unexpected.
+            errors = data.get('error', [])
+            if any(error.startswith(RETRIABLE_ERROR_PREFIXES) for error in errors):
+                self.rate_limiter.on_rate_limited(reason=', '.join(errors))
+                continue
+
+            if data.get('error'):
+                raise ValueError(f'Kraken REST API error for {url}: {data["error"]}')
+
+            self.rate_limiter.on_success()
+            return data
+
     def is_done(self) -> bool:
         # return self._is_done
-        return self.last_trade_ms >= self.to_ms
+        return self.last_trade_ms > self.to_ms
 
 
-class CachedTradeData:
+class KrakenRestAPITimeSharded:
     """
-    A class to handle the caching of trade data fetched from the Kraken REST API.
+    Fetches the historical trades for one product, splitting its time range
+    [from_ms, to_ms] into `n_shards` segments. Each segment is a KrakenRestAPI with its
+    own cursor, that stops at the segment boundary, so the segments can be paged
+    concurrently.
+
+    The segments only go faster than one cursor if they have more rate budget than
+    one cursor uses, so they are spread across `egress_routes`, one rate budget per
+    egress IP.
+
+    The trades are still returned in timestamp order. We only return the pages of the
+    first segment that is not done yet (the head), while the pages of the following
+    segments wait in a buffer of up to `max_buffered_pages` pages. Once it is full:
+    - with a trade store, the segment keeps fetching, and its pages only go to the
+    store. When the segment becomes the head, it reads them back from the store.
+    - without one, the segment stops fetching until it becomes the head, to keep
+    memory capped.
     """
 
-    def __init__(self, cache_dir: str) -> None:
-        self.cache_dir = Path(cache_dir)
-
-        if not self.cache_dir.exists():
-            # create the cache directory if it does not exist
-            self.cache_dir.mkdir(parents=True)
-
-    def read(self, url: str) -> List[Trade]:
+    def __init__(
+        self,
+        product_id: str,
+        last_n_days: int,
+        n_shards: int,
+        cache_dir: Optional[str] = None,
+        max_buffered_pages: Optional[int] = 10,
+        from_ms: Optional[int] = None,
+        to_ms: Optional[int] = None,
+        base_url: Optional[str] = None,
+        egress_routes: Optional[List[EgressRoute]] = None,
+    ) -> None:
         """
-        Reads from the cache the trade data for the given url
+        Args:
+            product_id (str): One product ID for which we want to get the trades.
+            last_n_days (int): The number of days from which we want to get historical data.
+            n_shards (int): The number of segments we split the time range into.
+            cache_dir (Optional[str]): The directory where we store the historical data.
+            max_buffered_pages (Optional[int]): The maximum number of pages each segment
+                keeps in memory while waiting for its turn to be returned.
+            from_ms (Optional[int]): If given, together with `to_ms`, the time range
+                we fetch instead of the one computed from `last_n_days`.
+            to_ms (Optional[int]): The end of the time range, inclusive.
+            base_url (Optional[str]): The base URL of the REST API.
+            egress_routes (Optional[List[EgressRoute]]): The egress IPs the segments
+                are spread across, round-robin. By default, the single route of the
+                process.
+
+        Returns:
+            None
         """
-        file_path = self._get_file_path(url)
+        from concurrent.futures import ThreadPoolExecutor
 
-        if file_path.exists():
-            # read the data from the parquet file
-            import pandas as pd
+        self.product_id = product_id
+        self.last_n_days = last_n_days
+        self.cache_dir = cache_dir
+        self.base_url = base_url
+        if from_ms is None or to_ms is None:
+            from_ms, to_ms = KrakenRestAPI._init_from_to_ms(last_n_days)
+        self.from_ms, self.to_ms = from_ms, to_ms
+
+        egress_routes = egress_routes or get_egress_routes(None)
+        self.segments = [
+            KrakenRestAPI(
+                product_id=product_id,
+                last_n_days=last_n_days,
+                cache_dir=cache_dir,
+                rate_limiter=egress_routes[i % len(egress_routes)].rate_limiter,
+                http_client=egress_routes[i % len(egress_routes)].http_client,
+                from_ms=segment_from_ms,
+                to_ms=segment_to_ms,
+                base_url=base_url,
+            )
+            for i, (segment_from_ms, segment_to_ms) in enumerate(
+                split_time_range(from_ms, to_ms, n_shards)
+            )
+        ]
+        self.max_buffered_pages = max_buffered_pages
+
+        n_rate_budgets = len({id(route.rate_limiter) for route in egress_routes})
+        if n_shards > 1 and n_rate_budgets == 1:
+            logger.warning(
+                f'The {n_shards} segments of {product_id} share the rate budget of one '
+                'egress IP, so they fetch no faster than one cursor once it uses the '
+                'whole budget. Set KRAKEN_REST_EGRESS_IPS to spread them across IPs'
+            )
 
-            data = pd.read_parquet(file_path)
-            # transform the data to a list of Trade objects
-            return [Trade(**trade) for trade in data.to_dict(orient='records')]
+        # pages fetched for each segment, waiting to be returned
+        self._buffers: List[Deque[TradeBatch]] = [deque() for _ in self.segments]
 
-        return []
+        # for the segments whose pages went to the trade store only, the cursor of
+        # their first page that is not in their buffer
+        self._spilled_from_ms: Dict[int, int] = {}
 
-    def write(self, url: str, trades: List[Trade]) -> None:
-        """
-        Saves the given trades to a parquet file in the cache directory.
-        """
-        if not trades:
-            return
+        # index of the first segment we have not returned all the trades for
+        self._head = 0
 
-        # transform the trades to a pandas DataFrame
-        import pandas as pd
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(self.segments), thread_name_prefix='kraken-rest-shard'
+        )
 
-        data = pd.DataFrame([trade.model_dump() for trade in trades])
+    def get_trades(self) -> TradeBatch:
+        """
+        Fetches the next page of every segment that is not done, and has room in its
+        buffer or can spill to the trade store, and returns all the trades we can emit
+        in timestamp order.
 
-        # write the DataFrame to a parquet file
-        file_path = self._get_file_path(url)
-        data.to_parquet(file_path)
+        Returns:
+            TradeBatch: The trades, in timestamp order. Possibly empty.
+        """
+        can_spill = self.cache_dir is not None
+        to_fetch = [
+            i
+            for i in range(self._head, len(self.segments))
+            if not self.segments[i].is_done()
+            and (can_spill or len(self._buffers[i]) < self.max_buffered_pages)
+        ]
+        cursors_ms = {i: self.segments[i].last_trade_ms for i in to_fetch}
+        pages = self._executor.map(lambda i: self.segments[i].get_trades(), to_fetch)
+        for i, page in zip(to_fetch, pages):
+            if not page:
+                continue
+
+            if i == self._head or (
+                i not in self._spilled_from_ms
+                and len(self._buffers[i]) < self.max_buffered_pages
+            ):
+                self._buffers[i].append(page)
+            else:
+                # the page is in the trade store already, we read it back from there
+                # when the segment becomes the head
+                self._spilled_from_ms.setdefault(i, cursors_ms[i])
+
+        # emit the pages of the head segment, and move on to the next segment once
+        # the head is done
+        trades = TradeBatch()
+        while self._head < len(self.segments):
+            buffer = self._buffers[self._head]
+            while buffer:
+                trades.extend(buffer.popleft())
+
+            if not self.segments[self._head].is_done():
+                break
+            self._head += 1
+            self._read_spilled_pages(self._head)
 
-    def has(self, url: str) -> bool:
+        return trades
+
+    def _read_spilled_pages(self, i: int) -> None:
         """
-        Returns True if the cache has the trade data for the given url, False otherwise.
+        If segment `i` spilled pages to the trade store, replaces it with a segment
+        that starts at the first of them. It reads them back from the store, and then
+        carries on fetching from Kraken where the old segment stopped.
         """
-        file_path = self._get_file_path(url)
-        return file_path.exists()
+        if i not in self._spilled_from_ms:
+            return
+
+        segment = self.segments[i]
+        self.segments[i] = KrakenRestAPI(
+            product_id=self.product_id,
+            last_n_days=self.last_n_days,
+            cache_dir=self.cache_dir,
+            rate_limiter=segment.rate_limiter,
+            http_client=segment.http_client,
+            from_ms=self._spilled_from_ms.pop(i),
+            to_ms=segment.to_ms,
+            base_url=self.base_url,
+        )
 
-    def _get_file_path(self, url: str) -> str:
+    def is_done(self) -> bool:
         """
-        Returns the file path where the trade data for the given url is (or will be) stored.
+        Returns True once all the trades of all segments have been returned.
         """
-        # use the given url to generate a unique file name in a deterministic way
-        import hashlib
+        if self._head < len(self.segments):
+            return False
+
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+        return True
 
-        url_hash = hashlib.md5(url.encode()).hexdigest()
-        return self.cache_dir / f'{url_hash}.parquet'
-        # return self.cache_dir / f'{product_id.replace ("/","-")}_{from_ms}.parquet'
+
+def split_time_range(from_ms: int, to_ms: int, n: int) -> List[Tuple[int, int]]:
+    """
+    Splits [from_ms, to_ms] into `n` contiguous segments of (almost) the same length.
+    Segment boundaries are inclusive and do not overlap, so a trade at the boundary
+    belongs to the following segment.
+
+    Args:
+        from_ms (int): The start of the time range, in Unix milliseconds.
+        to_ms (int): The end of the time range, in Unix milliseconds.
+        n (int): The number of segments.
+
+    Returns:
+        List[Tuple[int, int]]: The (from_ms, to_ms) of each segment.
+    """
+    step = (to_ms - from_ms) // n
+    starts = [from_ms + i * step for i in range(n)]
+    ends = [start - 1 for start in starts[1:]] + [to_ms]
+    return list(zip(starts, ends))
 
 
 def ts_to_date(ts: int) -> str:
@@ -367,4 +708,4 @@ def ns_to_date(ns: int) -> str:
 
     return datetime.fromtimestamp(ns / 1_000_000_000, tz=timezone.utc).strftime(
         '%Y-%m-%d %H:%M:%S'
-    )
\ No newline at end of file
+    )
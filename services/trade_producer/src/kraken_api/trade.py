@@ -1,3 +1,7 @@
+import json
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
 from pydantic import BaseModel
 
 
@@ -9,4 +13,210 @@ class Trade(BaseModel):
     product_id: str
     price: float
     volume: float
-    timestamp_ms: int
\ No newline at end of file
+    timestamp_ms: int
+    # 'buy' or 'sell', the side of the taker. None for the trades we stored before
+    # we kept the side
+    side: Optional[str] = None
+
+
+class TradeBatch:
+    """
+    A compact representation of a list of trades, stored column by column.
+
+    Prices and volumes live in `array('d')` and timestamps in `array('q')`, so a batch
+    of 1000 trades is 5 objects instead of 1000 pydantic models. This is what the
+    Kraken APIs return, and what `serialize()` turns into Kafka messages.
+
+    Product ids and sides are lists of strings, but there are only a few distinct
+    ones, so the lists hold references to the same few objects.
+    """
+
+    __slots__ = ('product_ids', 'prices', 'volumes', 'timestamps_ms', 'sides')
+
+    def __init__(
+        self,
+        product_ids: Optional[List[str]] = None,
+        prices: Optional[Iterable[float]] = None,
+        volumes: Optional[Iterable[float]] = None,
+        timestamps_ms: Optional[Iterable[int]] = None,
+        sides: Optional[List[Optional[str]]] = None,
+    ) -> None:
+        self.product_ids: List[str] = product_ids if product_ids is not None else []
+        self.prices = array('d', prices if prices is not None else [])
+        self.volumes = array('d', volumes if volumes is not None else [])
+        self.timestamps_ms = array(
+            'q', timestamps_ms if timestamps_ms is not None else []
+        )
+        # without sides, we do not know the side of any of the trades
+        self.sides: List[Optional[str]] = (
+            sides if sides is not None else [None] * len(self.product_ids)
+        )
+
+    def __len__(self) -> int:
+        return len(self.timestamps_ms)
+
+    def __iter__(self) -> Iterator[Trade]:
+        """Iterates over the batch as Trade objects. Slow, use it for debugging only."""
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, i: int) -> Trade:
+        return Trade(
+            product_id=self.product_ids[i],
+            price=self.prices[i],
+            volume=self.volumes[i],
+            timestamp_ms=self.timestamps_ms[i],
+            side=self.sides[i],
+        )
+
+    def append(
+        self,
+        product_id: str,
+        price: float,
+        volume: float,
+        timestamp_ms: int,
+        side: Optional[str] = None,
+    ) -> None:
+        """
+        Appends one trade at the end of the batch.
+        """
+        self.product_ids.append(product_id)
+        self.prices.append(price)
+        self.volumes.append(volume)
+        self.timestamps_ms.append(timestamp_ms)
+        self.sides.append(side)
+
+    def extend(self, other: 'TradeBatch') -> None:
+        """
+        Appends all trades in `other` at the end of the batch.
+        """
+        self.product_ids += other.product_ids
+        self.prices += other.prices
+        self.volumes += other.volumes
+        self.timestamps_ms += other.timestamps_ms
+        self.sides += other.sides
+
+    def take(self, indices: Iterable[int]) -> 'TradeBatch':
+        """
+        Returns a new batch with the trades at the given positions.
+        """
+        indices = list(indices)
+        return TradeBatch(
+            product_ids=[self.product_ids[i] for i in indices],
+            prices=[self.prices[i] for i in indices],
+            volumes=[self.volumes[i] for i in indices],
+            timestamps_ms=[self.timestamps_ms[i] for i in indices],
+            sides=[self.sides[i] for i in indices],
+        )
+
+    def slice(self, start: int, stop: int) -> 'TradeBatch':
+        """
+        Returns a new batch with the trades in positions [start, stop).
+        """
+        batch = TradeBatch(
+            product_ids=self.product_ids[start:stop], sides=self.sides[start:stop]
+        )
+        batch.prices = self.prices[start:stop]
+        batch.volumes = self.volumes[start:stop]
+        batch.timestamps_ms = self.timestamps_ms[start:stop]
+        return batch
+
+    def filter_by_timestamp(
+        self, min_ms: Optional[int] = None, max_ms: Optional[int] = None
+    ) -> 'TradeBatch':
+        """
+        Returns a new batch with the trades whose timestamp is in [min_ms, max_ms].
+        If all trades are already in the range, the batch itself is returned.
+        """
+        lo = min_ms if min_ms is not None else -(2**63)
+        hi = max_ms if max_ms is not None else 2**63 - 1
+        indices = [i for i, ts in enumerate(self.timestamps_ms) if lo <= ts <= hi]
+        if len(indices) == len(self):
+            return self
+        return self.take(indices)
+
+    def to_columns(self) -> Dict[str, list]:
+        """
+        Returns the batch as a dictionary of columns, ready for pd.DataFrame(...)
+        """
+        return {
+            'product_id': self.product_ids,
+            'price': self.prices.tolist(),
+            'volume': self.volumes.tolist(),
+            'timestamp_ms': self.timestamps_ms.tolist(),
+            'side': self.sides,
+        }
+
+    def to_arrow(self):
+        """
+        Returns the batch as a pyarrow Table. The numeric columns share their memory
+        with the arrays of the batch.
+        """
+        import pyarrow as pa
+
+        def to_arrow_array(column: array, arrow_type: pa.DataType) -> pa.Array:
+            return pa.Array.from_buffers(
+                arrow_type, len(column), [None, pa.py_buffer(column)]
+            )
+
+        return pa.table(
+            {
+                'product_id': pa.array(self.product_ids, pa.string()),
+                'price': to_arrow_array(self.prices, pa.float64()),
+                'volume': to_arrow_array(self.volumes, pa.float64()),
+                'timestamp_ms': to_arrow_array(self.timestamps_ms, pa.int64()),
+                'side': pa.array(self.sides, pa.string()),
+            }
+        )
+
+    @classmethod
+    def from_arrow(cls, table) -> 'TradeBatch':
+        """
+        Builds a batch from a pyarrow Table with the columns written by `to_arrow()`.
+        The numeric columns are copied in one go, without going through Python floats.
+        Tables written before we kept the side have no `side` column.
+        """
+
+        def to_array(typecode: str, column) -> array:
+            values = array(typecode)
+            values.frombytes(column.to_numpy().tobytes())
+            return values
+
+        batch = cls(
+            product_ids=table['product_id'].to_pylist(),
+            sides=(table['side'].to_pylist() if 'side' in table.column_names else None),
+        )
+        batch.prices = to_array('d', table['price'])
+        batch.volumes = to_array('d', table['volume'])
+        batch.timestamps_ms = to_array('q', table['timestamp_ms'])
+        return batch
+
+    def serialize(self) -> Iterator[Tuple[bytes, bytes]]:
+        """
+        Yields the (key, value) bytes of the Kafka message for each trade in the batch.
+        The value is the same JSON we used to get from `topic.serialize(...)` with
+        `trade.model_dump()`, written directly from the columns.
+        """
+        # product_ids repeat a lot inside a batch, so we encode each of them once
+        keys: Dict[str, Tuple[bytes, str]] = {}
+        sides_json = {'buy': '"buy"', 'sell': '"sell"', None: 'null'}
+
+        for product_id, price, volume, timestamp_ms, side in zip(
+            self.product_ids,
+            self.prices,
+            self.volumes,
+            self.timestamps_ms,
+            self.sides,
+        ):
+            try:
+                key, product_id_json = keys[product_id]
+            except KeyError:
+                key, product_id_json = product_id.encode(), json.dumps(product_id)
+                keys[product_id] = (key, product_id_json)
+
+            value = (
+                f'{{"product_id":{product_id_json},"price":{price!r},'
+                f'"volume":{volume!r},"timestamp_ms":{timestamp_ms},'
+                f'"side":{sides_json[side]}}}'
+            )
+            yield key, value.encode()
@@ -0,0 +1,295 @@
+import bisect
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from src.kraken_api.trade import TradeBatch
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+class TradeStore:
+    """
+    A local store of historical trades, partitioned by product and day, that we use
+    to avoid fetching the same trades from the Kraken REST API twice.
+
+    Trades live in parquet files with this layout
+
+        <cache_dir>/<product_id>/<YYYY-MM-DD>/<from_ms>-<to_ms>.parquet
+
+    where [from_ms, to_ms] is the time range the file covers. A file covers a range
+    if it contains ALL the trades in it, so an empty file is still useful: it tells us
+    there were no trades in that range.
+
+    We keep an in-memory index of the covered ranges of each product, rebuilt from the
+    file names on startup. It tells the REST client which ranges it can read from
+    disk and which gaps it has to fetch from Kraken. Once a whole day is covered we
+    compact its files into one, so the store does not fill up with tiny files.
+    """
+
+    def __init__(self, cache_dir: str) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # product_id -> sorted list of (from_ms, to_ms, path) of the files we have
+        self._files: Dict[str, List[Tuple[int, int, Path]]] = {}
+
+        # product_id -> sorted list of merged, non-overlapping covered (from_ms, to_ms)
+        self._covered: Dict[str, List[Tuple[int, int]]] = {}
+
+        # the store is shared by all the REST clients of the process, which run in
+        # different threads
+        self._lock = threading.Lock()
+
+        self._load_index()
+
+    def covered_until(self, product_id: str, ts_ms: int) -> Optional[int]:
+        """
+        Returns the end (inclusive) of the covered range that contains `ts_ms`, or None
+        if `ts_ms` is not covered.
+        """
+        with self._lock:
+            covered = self._covered.get(product_id, [])
+            i = bisect.bisect_right(covered, (ts_ms, float('inf'))) - 1
+            if i >= 0 and covered[i][0] <= ts_ms <= covered[i][1]:
+                return covered[i][1]
+            return None
+
+    def gaps(self, product_id: str, from_ms: int, to_ms: int) -> List[Tuple[int, int]]:
+        """
+        Returns the sub-ranges of [from_ms, to_ms] we do not have trades for.
+        """
+        with self._lock:
+            return self._gaps(product_id, from_ms, to_ms)
+
+    def read(self, product_id: str, from_ms: int, to_ms: int) -> TradeBatch:
+        """
+        Reads the trades of `product_id` in [from_ms, to_ms], in timestamp order.
+        The range should be covered, otherwise we only return what we have.
+        """
+        return TradeBatch.from_arrow(self.read_table(product_id, from_ms, to_ms))
+
+    def read_table(self, product_id: str, from_ms: int, to_ms: int):
+        """
+        Same as `read()`, but returns the pyarrow Table, memory-mapped from the
+        parquet files.
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        # we read the files with the lock held, as another thread could compact
+        # them, which deletes them, right after we list them. Once read, the tables
+        # are memory-mapped, and stay valid after the files are deleted
+        with self._lock:
+            tables = [
+                _read_file(path, memory_map=True)
+                for file_from_ms, file_to_ms, path in self._files.get(product_id, [])
+                if file_from_ms <= to_ms and file_to_ms >= from_ms
+            ]
+        if not tables:
+            return TradeBatch().to_arrow()
+
+        table = pa.concat_tables(tables)
+        mask = pc.and_(
+            pc.greater_equal(table['timestamp_ms'], from_ms),
+            pc.less_equal(table['timestamp_ms'], to_ms),
+        )
+        return table.filter(mask)
+
+    def write(
+        self, product_id: str, trades: TradeBatch, from_ms: int, to_ms: int
+    ) -> None:
+        """
+        Saves the `trades` of `product_id`, that are ALL the trades in [from_ms, to_ms].
+        Parts of the range we already have are skipped, so we never store a trade
+        twice.
+        """
+        with self._lock:
+            for gap_from_ms, gap_to_ms in self._gaps(product_id, from_ms, to_ms):
+                # one file per day, so we never write across partitions
+                day_from_ms = gap_from_ms
+                while day_from_ms <= gap_to_ms:
+                    day_to_ms = min(gap_to_ms, day_start_ms(day_from_ms) + DAY_MS - 1)
+                    self._write_file(
+                        product_id,
+                        trades.filter_by_timestamp(day_from_ms, day_to_ms),
+                        day_from_ms,
+                        day_to_ms,
+                    )
+                    self._maybe_compact(product_id, day_start_ms(day_from_ms))
+                    day_from_ms = day_to_ms + 1
+
+    def _gaps(self, product_id: str, from_ms: int, to_ms: int) -> List[Tuple[int, int]]:
+        """
+        Same as `gaps()`. Must be called with the lock held.
+        """
+        gaps = []
+        cursor = from_ms
+        for covered_from_ms, covered_to_ms in self._covered.get(product_id, []):
+            if covered_to_ms < cursor:
+                continue
+            if covered_from_ms > to_ms:
+                break
+            if covered_from_ms > cursor:
+                gaps.append((cursor, covered_from_ms - 1))
+            cursor = covered_to_ms + 1
+        if cursor <= to_ms:
+            gaps.append((cursor, to_ms))
+        return gaps
+
+    def _write_file(
+        self, product_id: str, trades: TradeBatch, from_ms: int, to_ms: int
+    ) -> None:
+        """
+        Writes one parquet file and adds it to the index. Must be called with the lock
+        held.
+        """
+        import pyarrow.parquet as pq
+
+        day_dir = self._day_dir(product_id, from_ms)
+        day_dir.mkdir(parents=True, exist_ok=True)
+        path = day_dir / f'{from_ms}-{to_ms}.parquet'
+
+        # write to a temporary file first, so a crash never leaves a half-written
+        # file that the index would consider complete
+        tmp_path = path.with_suffix('.tmp')
+        pq.write_table(trades.to_arrow(), tmp_path)
+        os.replace(tmp_path, path)
+
+        self._add_to_index(product_id, from_ms, to_ms, path)
+
+    def _maybe_compact(self, product_id: str, day_start_ms: int) -> None:
+        """
+        Merges all the files of a day into one, once the whole day is covered.
+        Must be called with the lock held.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        day_end_ms = day_start_ms + DAY_MS - 1
+        if self._gaps(product_id, day_start_ms, day_end_ms):
+            return
+
+        files = [
+            (file_from_ms, file_to_ms, path)
+            for file_from_ms, file_to_ms, path in self._files[product_id]
+            if day_start_ms <= file_from_ms and file_to_ms <= day_end_ms
+        ]
+        if len(files) <= 1:
+            return
+
+        # files do not overlap, so concatenating them sorted by from_ms keeps the
+        # trades in timestamp order
+        table = pa.concat_tables([_read_file(path) for _, _, path in files])
+        path = self._day_dir(product_id, day_start_ms) / (
+            f'{day_start_ms}-{day_end_ms}.parquet'
+        )
+        tmp_path = path.with_suffix('.tmp')
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+
+        for _, _, old_path in files:
+            old_path.unlink()
+        self._files[product_id] = [f for f in self._files[product_id] if f not in files]
+        self._add_to_index(product_id, day_start_ms, day_end_ms, path)
+
+        logger.debug(f'Compacted {len(files)} files of {product_id} into {path}')
+
+    def _add_to_index(
+        self, product_id: str, from_ms: int, to_ms: int, path: Path
+    ) -> None:
+        """
+        Adds a file to the index and merges its range into the covered ranges.
+        Must be called with the lock held.
+        """
+        bisect.insort(self._files.setdefault(product_id, []), (from_ms, to_ms, path))
+
+        merged: List[Tuple[int, int]] = []
+        for covered_from_ms, covered_to_ms in sorted(
+            self._covered.get(product_id, []) + [(from_ms, to_ms)]
+        ):
+            if merged and covered_from_ms <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], covered_to_ms))
+            else:
+                merged.append((covered_from_ms, covered_to_ms))
+        self._covered[product_id] = merged
+
+    def _load_index(self) -> None:
+        """
+        Rebuilds the index from the file names in the cache directory.
+        If a compaction was interrupted, the files already merged into the compacted
+        one are removed.
+        """
+        for product_dir in sorted(p for p in self.cache_dir.iterdir() if p.is_dir()):
+            product_id = product_dir.name.replace('-', '/')
+
+            for day_dir in sorted(p for p in product_dir.iterdir() if p.is_dir()):
+                files = []
+                for path in day_dir.glob('*.parquet'):
+                    from_ms, to_ms = (int(ts) for ts in path.stem.split('-'))
+                    files.append((from_ms, to_ms, path))
+
+                # sorted by from_ms, and the widest range first
+                files.sort(key=lambda f: (f[0], -f[1]))
+                max_to_ms = -1
+                for from_ms, to_ms, path in files:
+                    if to_ms <= max_to_ms:
+                        path.unlink()
+                        continue
+                    max_to_ms = to_ms
+                    self._add_to_index(product_id, from_ms, to_ms, path)
+
+        for product_id, covered in self._covered.items():
+            logger.info(
+                f'Trade store has {len(covered)} covered ranges for {product_id}'
+            )
+
+    def _day_dir(self, product_id: str, ts_ms: int) -> Path:
+        """
+        Returns the directory of the day partition `ts_ms` belongs to.
+        """
+        from datetime import datetime, timezone
+
+        day = datetime.fromtimestamp(ts_ms / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+        return self.cache_dir / product_id.replace('/', '-') / day
+
+
+def _read_file(path: Path, memory_map: bool = False):
+    """
+    Reads a parquet file of the store as a pyarrow Table. The files we wrote before we
+    kept the side of the trades get a `side` column of nulls, so all the tables have
+    the same schema.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path, memory_map=memory_map)
+    if 'side' not in table.column_names:
+        table = table.append_column('side', pa.nulls(len(table), pa.string()))
+    return table
+
+
+def day_start_ms(ts_ms: int) -> int:
+    """
+    Returns the timestamp of midnight UTC of the day `ts_ms` belongs to.
+    """
+    return ts_ms - ts_ms % DAY_MS
+
+
+# all the REST clients of the process that use the same cache_dir must share the
+# same TradeStore, so they see the same index
+_trade_stores: Dict[str, TradeStore] = {}
+_trade_stores_lock = threading.Lock()
+
+
+def get_trade_store(cache_dir: str) -> TradeStore:
+    """
+    Returns the TradeStore for `cache_dir`, creating it the first time.
+    """
+    with _trade_stores_lock:
+        if cache_dir not in _trade_stores:
+            _trade_stores[cache_dir] = TradeStore(cache_dir)
+        return _trade_stores[cache_dir]
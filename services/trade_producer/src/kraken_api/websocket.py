@@ -1,10 +1,10 @@
 import json
-from typing import List
+from typing import List, Optional
 
 from loguru import logger
 from websocket import create_connection
 
-from src.kraken_api.trade import Trade
+from src.kraken_api.trade import TradeBatch
 
 
 class KrakenWebsocketTradeAPI:
@@ -13,11 +13,14 @@ class KrakenWebsocketTradeAPI:
     def __init__(
         self,
         product_ids: List[str],
+        url: Optional[str] = None,
     ):
         self.product_ids = product_ids
+        # e.g. the local Kraken stand-in. By default, Kraken's
+        self.url = url or self.URL
 
         # establish connection to the Kraken websocket API
-        self._ws = create_connection(self.URL)
+        self._ws = create_connection(self.url)
         logger.info('Connection established')
 
         # subscribe to the trades for the given `product_id`
@@ -47,35 +50,44 @@ class KrakenWebsocketTradeAPI:
             _ = self._ws.recv()
             _ = self._ws.recv()
 
-    def get_trades(self) -> List[Trade]:
+    def get_trades(self) -> TradeBatch:
         """
-        Fetches trade data from the Kraken Websocket API and returns a list
-        of Trades.
+        Fetches trade data from the Kraken Websocket API and returns a TradeBatch.
         """
         message = self._ws.recv()
 
         if 'heartbeat' in message:
-            # when I get a heartbeat, I return an empty list
-            return []
+            # when I get a heartbeat, I return an empty batch
+            return TradeBatch()
 
         # parse the message string as a dictionary
         message = json.loads(message)
 
+        return self.parse_trades(message['data'])
+
+    @classmethod
+    def parse_trades(cls, data: List[dict]) -> TradeBatch:
+        """
+        Transforms the `data` field of a websocket trade message into a TradeBatch.
+
+        Args:
+            data (List[dict]): The trades in the message, as sent by Kraken.
+
+        Returns:
+            TradeBatch: The trades, column by column.
+        """
         # extract trades from the message['data'] field
-        trades = []
-        for trade in message['data']:
+        trades = TradeBatch()
+        for trade in data:
             # transform the timestamp from Kraken which is a string
             # like '2024-06-17T09:45:38.494012Z' into Unix
             # milliseconds
-            timestamp_ms = self.to_ms(trade['timestamp'])
-
             trades.append(
-                Trade(
-                    product_id=trade['symbol'],
-                    price=trade['price'],
-                    volume=trade['qty'],
-                    timestamp_ms=timestamp_ms,
-                )
+                product_id=trade['symbol'],
+                price=trade['price'],
+                volume=trade['qty'],
+                timestamp_ms=cls.to_ms(trade['timestamp']),
+                side=trade['side'],
             )
 
         return trades
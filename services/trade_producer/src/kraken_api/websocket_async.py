@@ -0,0 +1,276 @@
+import asyncio
+import json
+import queue
+import threading
+import time
+from typing import List, Optional, Set
+
+from loguru import logger
+
+from src.kraken_api.trade import TradeBatch
+from src.kraken_api.websocket import KrakenWebsocketTradeAPI
+
+
+class KrakenAsyncWebsocketTradeAPI:
+    """
+    Asyncio version of the KrakenWebsocketTradeAPI.
+
+    The `product_ids` are sharded across `n_connections` websocket connections, that
+    run concurrently in an asyncio event loop living in a background thread.
+    Each connection decodes its own frames and pushes the trades into a bounded queue,
+    which `get_trades()` drains. This way a slow Kafka produce in the main thread
+    never stalls the socket reads.
+
+    If the queue is full, the connections stop reading from their sockets until
+    `get_trades()` makes some room, so memory stays capped.
+    """
+
+    URL = 'wss://ws.kraken.com/v2'
+
+    # the longest we wait before reconnecting a connection that keeps failing
+    MAX_RECONNECT_BACKOFF_SEC = 30
+
+    def __init__(
+        self,
+        product_ids: List[str],
+        n_connections: int = 4,
+        queue_size: int = 10_000,
+        max_batch_size: int = 1_000,
+        log_stats_every_sec: int = 60,
+        snapshot: bool = False,
+        url: Optional[str] = None,
+    ):
+        """
+        Starts the event loop and opens the websocket connections.
+
+        Args:
+            product_ids (List[str]): The product IDs for which we want to get the trades.
+            n_connections (int): The number of websocket connections we shard the
+                `product_ids` across.
+            queue_size (int): The maximum number of websocket frames waiting in the
+                queue to be drained by `get_trades()`.
+            max_batch_size (int): The maximum number of frames `get_trades()` drains
+                from the queue at once.
+            log_stats_every_sec (int): How often we log throughput and receive lag.
+            snapshot (bool): Whether Kraken sends the most recent trades of each
+                product right after we subscribe.
+            url (Optional[str]): The websocket URL, e.g. to point at the local Kraken
+                stand-in. By default, Kraken's.
+
+        Returns:
+            None
+        """
+        self.product_ids = product_ids
+        self.url = url or self.URL
+        self.shards = shard_product_ids(product_ids, n_connections)
+        self.max_batch_size = max_batch_size
+        self.log_stats_every_sec = log_stats_every_sec
+        self.snapshot = snapshot
+
+        # set once every connection sent its first subscription
+        self.subscribed = threading.Event()
+        self._subscribed_shard_ids: Set[int] = set()
+
+        # frames decoded by the websocket connections, waiting to be produced to Kafka
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+
+        # counters updated from the event loop thread and reset every
+        # `log_stats_every_sec` seconds
+        self._n_trades = 0
+        self._sum_lag_ms = 0
+        self._max_lag_ms = 0
+
+        # how many times the connections failed, and how many frames we could not
+        # parse, since we started
+        self.n_reconnects = 0
+        self.n_skipped_messages = 0
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run_event_loop, name='kraken-websocket', daemon=True
+        )
+        self._thread.start()
+        logger.info(
+            f'Started {len(self.shards)} websocket connections for {len(product_ids)} products'
+        )
+
+    def get_trades(self) -> TradeBatch:
+        """
+        Drains the trades decoded by the websocket connections.
+
+        It blocks for at most 1 second waiting for the first frame, and then takes
+        whatever else is already in the queue, up to `self.max_batch_size` frames.
+
+        Returns:
+            TradeBatch: The trades, possibly none.
+        """
+        try:
+            trades = self._queue.get(timeout=1)
+        except queue.Empty:
+            return TradeBatch()
+
+        for _ in range(self.max_batch_size - 1):
+            try:
+                trades.extend(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return trades
+
+    def is_done(self) -> bool:
+        """The websocket never stops, so we never stop fetching trades."""
+        return False
+
+    def _run_event_loop(self) -> None:
+        """
+        Runs one task per shard of product_ids, plus the stats reporter, until the
+        process exits.
+        """
+        asyncio.set_event_loop(self._loop)
+        tasks = [
+            self._consume_shard(shard_id, product_ids)
+            for shard_id, product_ids in enumerate(self.shards)
+        ]
+        tasks.append(self._log_stats())
+        self._loop.run_until_complete(asyncio.gather(*tasks))
+
+    async def _consume_shard(self, shard_id: int, product_ids: List[str]) -> None:
+        """
+        Keeps one websocket connection open for the given `product_ids`, reconnecting
+        when it drops, and pushes the decoded trades into the queue.
+
+        Any error, not only a dropped connection (e.g. Kraken rejecting the handshake),
+        makes us reconnect, waiting twice as long after each failed attempt, up to
+        `MAX_RECONNECT_BACKOFF_SEC`. Otherwise the shard would stop for good while
+        `get_trades()` keeps returning empty batches.
+        """
+        import websockets
+
+        backoff_sec = 1.0
+        while True:
+            try:
+                async with websockets.connect(self.url) as ws:
+                    await self._subscribe(ws, product_ids)
+                    logger.info(f'Connection {shard_id} subscribed to {product_ids}')
+                    self._subscribed_shard_ids.add(shard_id)
+                    if len(self._subscribed_shard_ids) == len(self.shards):
+                        self.subscribed.set()
+                    backoff_sec = 1.0
+
+                    async for message in ws:
+                        trades = self._parse_message_or_skip(shard_id, message)
+                        if trades:
+                            await self._put(trades)
+
+                logger.warning(f'Connection {shard_id} closed. Reconnecting...')
+                await asyncio.sleep(backoff_sec)
+
+            except Exception as e:
+                self.n_reconnects += 1
+                logger.warning(
+                    f'Connection {shard_id} failed: {e!r}. '
+                    f'Reconnecting in {backoff_sec:.0f} seconds...'
+                )
+                await asyncio.sleep(backoff_sec)
+                backoff_sec = min(backoff_sec * 2, self.MAX_RECONNECT_BACKOFF_SEC)
+
+    async def _subscribe(self, ws, product_ids: List[str]) -> None:
+        """
+        Subscribes the given websocket connection to the trades for the `product_ids`.
+        We do not wait for the confirmation messages, as `_parse_message` skips
+        everything that is not a trade.
+        """
+        msg = {
+            'method': 'subscribe',
+            'params': {
+                'channel': 'trade',
+                'symbol': product_ids,
+                'snapshot': self.snapshot,
+            },
+        }
+        await ws.send(json.dumps(msg))
+
+    def _parse_message_or_skip(self, shard_id: int, message: str) -> TradeBatch:
+        """
+        Parses the websocket frame, skipping it if it is malformed instead of dropping
+        the connection for it.
+        """
+        try:
+            return self._parse_message(message)
+        except (ValueError, KeyError, TypeError) as e:
+            self.n_skipped_messages += 1
+            logger.error(f'Connection {shard_id} skipped a malformed message: {e!r}')
+            return TradeBatch()
+
+    def _parse_message(self, message: str) -> TradeBatch:
+        """
+        Transforms a websocket frame into a TradeBatch. Heartbeats, subscription
+        confirmations and status messages result in an empty batch.
+        """
+        if 'heartbeat' in message:
+            return TradeBatch()
+
+        message = json.loads(message)
+        if message.get('channel') != 'trade':
+            return TradeBatch()
+
+        trades = KrakenWebsocketTradeAPI.parse_trades(message.get('data', []))
+
+        # receive lag is the time between the trade happening at Kraken and us
+        # decoding it
+        now_ms = int(time.time() * 1000)
+        for timestamp_ms in trades.timestamps_ms:
+            lag_ms = now_ms - timestamp_ms
+            self._sum_lag_ms += lag_ms
+            self._max_lag_ms = max(self._max_lag_ms, lag_ms)
+        self._n_trades += len(trades)
+
+        return trades
+
+    async def _put(self, trades: TradeBatch) -> None:
+        """
+        Pushes the trades into the queue. If the queue is full we stop reading from
+        this connection until `get_trades()` makes room for them.
+        """
+        while True:
+            try:
+                self._queue.put_nowait(trades)
+                return
+            except queue.Full:
+                await asyncio.sleep(0.01)
+
+    async def _log_stats(self) -> None:
+        """
+        Logs the ingestion throughput (trades/sec) and the receive lag every
+        `self.log_stats_every_sec` seconds.
+        """
+        while True:
+            await asyncio.sleep(self.log_stats_every_sec)
+
+            n_trades = self._n_trades
+            mean_lag_ms = self._sum_lag_ms / n_trades if n_trades else 0
+            logger.info(
+                f'Ingested {n_trades / self.log_stats_every_sec:.1f} trades/sec, '
+                f'receive lag mean={mean_lag_ms:.0f}ms max={self._max_lag_ms}ms, '
+                f'queue size={self._queue.qsize()}, '
+                f'reconnects={self.n_reconnects}, '
+                f'skipped messages={self.n_skipped_messages}'
+            )
+            self._n_trades = 0
+            self._sum_lag_ms = 0
+            self._max_lag_ms = 0
+
+
+def shard_product_ids(product_ids: List[str], n_shards: int) -> List[List[str]]:
+    """
+    Splits the `product_ids` into at most `n_shards` lists, in a round-robin fashion.
+
+    Args:
+        product_ids (List[str]): The product IDs we want to shard.
+        n_shards (int): The number of shards.
+
+    Returns:
+        List[List[str]]: The non-empty shards.
+    """
+    shards = [product_ids[i::n_shards] for i in range(n_shards)]
+    return [shard for shard in shards if shard]
@@ -0,0 +1,142 @@
+import json
+from typing import Dict, List, Optional
+
+from loguru import logger
+from websocket import create_connection
+
+from src.kraken_api.order_book import OrderBook
+
+
+class KrakenWebsocketBookAPI:
+    """
+    Keeps an up to date OrderBook per product from the Kraken websocket `book`
+    channel.
+
+    Every update is applied as it arrives and verified against the checksum Kraken
+    sends with it. On a mismatch we re-subscribe to the product, to get a fresh
+    snapshot. Reading the books (e.g. to publish their features) is up to the caller,
+    at whatever cadence it wants.
+    """
+
+    URL = 'wss://ws.kraken.com/v2'
+
+    def __init__(
+        self, product_ids: List[str], depth: int = 10, url: Optional[str] = None
+    ):
+        """
+        Connects to the Kraken websocket API, gets the precision of each product and
+        subscribes to their books.
+
+        Args:
+            product_ids (List[str]): The product IDs for which we want the books.
+            depth (int): The number of levels per side, one of 10, 25, 100, 500, 1000.
+            url (Optional[str]): The websocket URL. By default, Kraken's.
+
+        Returns:
+            None
+        """
+        self.product_ids = product_ids
+        self.depth = depth
+        self.url = url or self.URL
+
+        self.n_updates = 0
+        self.n_checksum_mismatches = 0
+
+        # establish connection to the Kraken websocket API
+        self._ws = create_connection(self.url)
+        logger.info('Connection established')
+
+        # the checksums depend on the number of decimals of prices and quantities
+        precisions = self._get_precisions(product_ids)
+        self.books: Dict[str, OrderBook] = {
+            product_id: OrderBook(
+                product_id=product_id,
+                depth=depth,
+                price_precision=precisions[product_id]['price_precision'],
+                qty_precision=precisions[product_id]['qty_precision'],
+            )
+            for product_id in product_ids
+        }
+
+        self._subscribe('book', product_ids, depth=depth)
+
+    def update(self) -> None:
+        """
+        Reads one message from the websocket and applies it to the books.
+        """
+        message = self._ws.recv()
+
+        if 'heartbeat' in message:
+            return
+
+        message = json.loads(message)
+        if message.get('channel') != 'book':
+            # subscription confirmations and status messages
+            return
+
+        for data in message['data']:
+            book = self.books[data['symbol']]
+
+            if message['type'] == 'snapshot':
+                book.apply_snapshot(data['bids'], data['asks'])
+            elif book.is_synced:
+                book.apply_update(data['bids'], data['asks'])
+            else:
+                # an update sent before the snapshot we asked for
+                continue
+
+            self.n_updates += 1
+            if book.checksum() != data['checksum']:
+                self.n_checksum_mismatches += 1
+                logger.warning(
+                    f'Checksum mismatch for the book of {book.product_id}. '
+                    'Re-subscribing to get a fresh snapshot'
+                )
+                book.is_synced = False
+                self._resubscribe(book.product_id)
+
+    def get_features(self) -> List[dict]:
+        """
+        Returns the current features of all the books in sync with Kraken.
+        """
+        features = [book.features() for book in self.books.values() if book.is_synced]
+        return [f for f in features if f is not None]
+
+    def _get_precisions(self, product_ids: List[str]) -> Dict[str, dict]:
+        """
+        Reads the number of decimals of prices and quantities of each product from the
+        snapshot of the `instrument` channel, and unsubscribes from it.
+        """
+        self._subscribe('instrument')
+        while True:
+            message = json.loads(self._ws.recv())
+            is_instrument = message.get('channel') == 'instrument'
+            if is_instrument and message.get('type') == 'snapshot':
+                break
+        self._unsubscribe('instrument')
+
+        precisions = {
+            pair['symbol']: pair
+            for pair in message['data']['pairs']
+            if pair['symbol'] in product_ids
+        }
+        missing = set(product_ids) - set(precisions)
+        assert not missing, f'Unknown product ids: {missing}'
+        return precisions
+
+    def _resubscribe(self, product_id: str) -> None:
+        self._unsubscribe('book', [product_id], depth=self.depth)
+        self._subscribe('book', [product_id], depth=self.depth)
+
+    def _subscribe(self, channel: str, product_ids: List[str] = None, **params):
+        logger.info(f'Subscribing to the {channel} channel for {product_ids}')
+        self._send('subscribe', channel, product_ids, snapshot=True, **params)
+
+    def _unsubscribe(self, channel: str, product_ids: List[str] = None, **params):
+        self._send('unsubscribe', channel, product_ids, **params)
+
+    def _send(self, method: str, channel: str, product_ids: List[str], **params):
+        msg = {'method': method, 'params': {'channel': channel, **params}}
+        if product_ids is not None:
+            msg['params']['symbol'] = product_ids
+        self._ws.send(json.dumps(msg))
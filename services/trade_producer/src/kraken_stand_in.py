@@ -0,0 +1,380 @@
+"""
+A local stand-in for the Kraken APIs the trade_producer talks to, so we can load
+test and regression test the ingestion without the real exchange.
+
+- The websocket v2 API: the `status` message on connect, the `subscribe` flow of the
+`trade` channel (one confirmation per symbol), trade updates and heartbeats. Together,
+the status message and the confirmation are the two messages
+`KrakenWebsocketTradeAPI._subscribe` discards for one product. There is no snapshot.
+- The REST `Trades` endpoint, with `since` paging (1000 trades per page at most) and
+`EGeneral:Too many requests` errors once a client IP goes over the rate limit.
+
+Trades are either synthetic, generated at `--trades-per-sec` per product, or replayed
+from the trade store in `--cache-dir`. Run it with
+
+    poetry run python -m src.kraken_stand_in --trades-per-sec 100
+
+and point the trade_producer at it with
+
+    KRAKEN_WS_URL=ws://localhost:8765 KRAKEN_REST_URL=http://localhost:8080
+"""
+
+import asyncio
+import json
+import math
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from loguru import logger
+
+# the most trades the REST Trades endpoint returns per page, like Kraken
+MAX_TRADES_PER_PAGE = 1_000
+
+# a trade as the stand-in keeps it: (timestamp_ns, price, volume)
+RawTrade = Tuple[int, float, float]
+
+
+class SyntheticTrades:
+    """
+    Trades generated on the fly, `trades_per_sec` per product, evenly spaced in time.
+
+    The i-th trade of a product is always the same, so paging through the REST
+    endpoint is consistent, and trades can share the same millisecond when
+    `trades_per_sec` is above 1000.
+    """
+
+    def __init__(self, trades_per_sec: float) -> None:
+        self.trades_per_sec = trades_per_sec
+        self._interval_ns = 1e9 / trades_per_sec
+
+    def page(self, product_id: str, since_ns: int, limit: int) -> List[RawTrade]:
+        """
+        Returns up to `limit` trades at or after `since_ns`, and not after now.
+        """
+        first_i = math.ceil(since_ns / self._interval_ns)
+        last_i = min(first_i + limit, int(time.time_ns() / self._interval_ns) + 1)
+        return [self._trade(product_id, i) for i in range(first_i, last_i)]
+
+    def live(self, product_id: str) -> Iterator[Tuple[float, float]]:
+        """
+        Yields the (price, volume) of the trades of `product_id` from now on.
+        """
+        i = int(time.time_ns() / self._interval_ns)
+        while True:
+            _, price, volume = self._trade(product_id, i)
+            yield price, volume
+            i += 1
+
+    def _trade(self, product_id: str, i: int) -> RawTrade:
+        # a slow wave plus some deterministic noise, around a price that depends on
+        # the product, so different products do not look the same
+        base_price = 1_000 + sum(product_id.encode()) * 100
+        noise = ((i * 2_654_435_761) % 1_000) / 1_000
+        price = round(base_price * (1 + 0.01 * math.sin(i / 5_000) + 0.001 * noise), 1)
+        volume = round(0.001 + ((i * 40_503) % 10_000) / 10_000, 8)
+        return int(i * self._interval_ns), price, volume
+
+
+class CachedTrades:
+    """
+    Trades replayed from a TradeStore: the REST endpoint serves them with their
+    original timestamps, and the websocket streams them in a loop, at
+    `trades_per_sec` per product, with the current time as timestamp.
+    """
+
+    def __init__(self, cache_dir: str, last_n_days: int) -> None:
+        from src.kraken_api.rest import KrakenRestAPI
+        from src.kraken_api.trade_store import get_trade_store
+
+        self.store = get_trade_store(cache_dir)
+        self.from_ms, self.to_ms = KrakenRestAPI._init_from_to_ms(last_n_days)
+
+    def page(self, product_id: str, since_ns: int, limit: int) -> List[RawTrade]:
+        from src.kraken_api.trade_store import DAY_MS
+
+        trades: List[RawTrade] = []
+        from_ms = math.ceil(since_ns / 1_000_000)
+        while len(trades) < limit and from_ms <= self.to_ms:
+            batch = self.store.read(product_id, from_ms, from_ms + DAY_MS - 1)
+            trades += [
+                (timestamp_ms * 1_000_000, price, volume)
+                for timestamp_ms, price, volume in zip(
+                    batch.timestamps_ms, batch.prices, batch.volumes
+                )
+            ]
+            from_ms += DAY_MS
+        return trades[:limit]
+
+    def live(self, product_id: str) -> Iterator[Tuple[float, float]]:
+        from src.kraken_api.trade_store import DAY_MS
+
+        while True:
+            n_trades = 0
+            for day_from_ms in range(self.from_ms, self.to_ms + 1, DAY_MS):
+                batch = self.store.read(
+                    product_id, day_from_ms, min(day_from_ms + DAY_MS - 1, self.to_ms)
+                )
+                n_trades += len(batch)
+                yield from zip(batch.prices, batch.volumes)
+
+            if n_trades == 0:
+                raise ValueError(f'No cached trades for {product_id}')
+
+
+class RestRateLimit:
+    """
+    A token bucket per client IP, like Kraken's per-IP limit on its public endpoints.
+    """
+
+    def __init__(self, requests_per_sec: float, burst: int) -> None:
+        self.requests_per_sec = requests_per_sec
+        self.burst = burst
+        # client IP -> (tokens, last time we updated them)
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+        self.n_rate_limited = 0
+
+    def allow(self, client_ip: str = '') -> bool:
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated_at = self._buckets.get(client_ip, (float(self.burst), now))
+            tokens = min(
+                self.burst, tokens + (now - updated_at) * self.requests_per_sec
+            )
+            if tokens < 1:
+                self._buckets[client_ip] = (tokens, now)
+                self.n_rate_limited += 1
+                return False
+            self._buckets[client_ip] = (tokens - 1, now)
+            return True
+
+
+def start_rest_server(trades, rate_limit: RestRateLimit, port: int) -> None:
+    """
+    Serves the REST Trades endpoint in background threads.
+    """
+
+    class TradesHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != '/0/public/Trades':
+                self._send(404, {'error': ['EGeneral:Unknown method']})
+                return
+
+            if not rate_limit.allow(self.client_address[0]):
+                # Kraken answers with a 200 and the error in the body
+                self._send(200, {'error': ['EGeneral:Too many requests']})
+                return
+
+            query = parse_qs(url.query)
+            product_id = query['pair'][0]
+            # like Kraken, `since` is in seconds or in nanoseconds
+            since = int(query.get('since', ['0'])[0])
+            since_ns = since if since > 10**12 else since * 1_000_000_000
+
+            page = trades.page(product_id, since_ns, MAX_TRADES_PER_PAGE)
+            last_ns = page[-1][0] if page else since_ns
+            self._send(
+                200,
+                {
+                    'error': [],
+                    'result': {
+                        product_id: [
+                            [
+                                f'{price:.1f}',
+                                f'{volume:.8f}',
+                                timestamp_ns / 1e9,
+                                'b' if i % 2 else 's',
+                                'l',
+                                '',
+                                i,
+                            ]
+                            for i, (timestamp_ns, price, volume) in enumerate(page)
+                        ],
+                        'last': str(last_ns),
+                    },
+                },
+            )
+
+        def _send(self, status: int, body: dict):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), TradesHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f'REST API listening on http://localhost:{port}')
+
+
+def to_iso(timestamp_ns: int) -> str:
+    return datetime.fromtimestamp(timestamp_ns / 1e9, tz=timezone.utc).strftime(
+        '%Y-%m-%dT%H:%M:%S.%fZ'
+    )
+
+
+async def serve_websocket(trades, trades_per_sec: float, port: int) -> None:
+    """
+    Serves the websocket v2 API until the process exits.
+    """
+    import websockets
+
+    async def handler(ws) -> None:
+        # symbol -> live trades iterator
+        subscriptions = {}
+        n_trades_due = 0.0
+        last_tick = time.monotonic()
+        last_heartbeat = last_tick
+        trade_id = 0
+
+        await ws.send(
+            json.dumps(
+                {
+                    'channel': 'status',
+                    'type': 'update',
+                    'data': [{'system': 'online', 'api_version': 'v2'}],
+                }
+            )
+        )
+
+        async def receive() -> None:
+            async for message in ws:
+                request = json.loads(message)
+                params = request.get('params', {})
+                if request.get('method') != 'subscribe':
+                    continue
+                for symbol in params.get('symbol', []):
+                    now_ns = time.time_ns()
+                    await ws.send(
+                        json.dumps(
+                            {
+                                'method': 'subscribe',
+                                'result': {
+                                    'channel': params.get('channel'),
+                                    'snapshot': params.get('snapshot', True),
+                                    'symbol': symbol,
+                                },
+                                'success': True,
+                                'time_in': to_iso(now_ns),
+                                'time_out': to_iso(now_ns),
+                            }
+                        )
+                    )
+                    if params.get('channel') == 'trade':
+                        subscriptions[symbol] = trades.live(symbol)
+
+        receiver = asyncio.create_task(receive())
+        try:
+            while not receiver.done():
+                await asyncio.sleep(0.01)
+                now = time.monotonic()
+                n_trades_due += (now - last_tick) * trades_per_sec
+                last_tick = now
+
+                n_trades = int(n_trades_due)
+                n_trades_due -= n_trades
+                now_ns = time.time_ns()
+                for symbol, live_trades in list(subscriptions.items()):
+                    data = []
+                    for _ in range(n_trades):
+                        price, volume = next(live_trades)
+                        trade_id += 1
+                        data.append(
+                            {
+                                'symbol': symbol,
+                                'side': 'buy' if trade_id % 2 else 'sell',
+                                'price': price,
+                                'qty': volume,
+                                'ord_type': 'limit',
+                                'trade_id': trade_id,
+                                'timestamp': to_iso(now_ns),
+                            }
+                        )
+                    if data:
+                        await ws.send(
+                            json.dumps(
+                                {'channel': 'trade', 'type': 'update', 'data': data}
+                            )
+                        )
+
+                if now - last_heartbeat >= 1:
+                    await ws.send(json.dumps({'channel': 'heartbeat'}))
+                    last_heartbeat = now
+
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            receiver.cancel()
+
+    async with websockets.serve(handler, '0.0.0.0', port):
+        logger.info(f'Websocket API listening on ws://localhost:{port}')
+        await asyncio.Future()
+
+
+def run(
+    ws_port: int = 8765,
+    rest_port: int = 8080,
+    trades_per_sec: float = 10,
+    cache_dir: Optional[str] = None,
+    last_n_days: int = 1,
+    rest_requests_per_sec: float = 1,
+    rest_burst: int = 15,
+) -> None:
+    """
+    Starts the REST and websocket stand-ins and serves them until interrupted.
+
+    Args:
+        ws_port (int): The port of the websocket API.
+        rest_port (int): The port of the REST API.
+        trades_per_sec (float): The trades per second and per product the websocket
+            sends, and the density of the synthetic trades of the REST API.
+        cache_dir (Optional[str]): If given, the trade store we replay the trades
+            from, instead of generating them.
+        last_n_days (int): With `cache_dir`, the days of trades we replay.
+        rest_requests_per_sec (float): The rate limit of the REST API.
+        rest_burst (int): How many REST requests a client can make at once before
+            hitting the rate limit.
+
+    Returns:
+        None
+    """
+    if cache_dir is not None:
+        trades = CachedTrades(cache_dir, last_n_days)
+    else:
+        trades = SyntheticTrades(trades_per_sec)
+
+    start_rest_server(
+        trades, RestRateLimit(rest_requests_per_sec, rest_burst), rest_port
+    )
+    asyncio.run(serve_websocket(trades, trades_per_sec, ws_port))
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('--ws-port', type=int, default=8765)
+    parser.add_argument('--rest-port', type=int, default=8080)
+    parser.add_argument('--trades-per-sec', type=float, default=10)
+    parser.add_argument('--cache-dir', type=str, default=None)
+    parser.add_argument('--last-n-days', type=int, default=1)
+    parser.add_argument('--rest-requests-per-sec', type=float, default=1)
+    parser.add_argument('--rest-burst', type=int, default=15)
+    args = parser.parse_args()
+
+    try:
+        run(**vars(args))
+    except KeyboardInterrupt:
+        logger.info('Exiting...')
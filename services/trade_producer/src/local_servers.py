@@ -0,0 +1,175 @@
+"""
+Local stand-ins for the Kraken REST Trades endpoint and the websocket v2 API, that
+run in a background thread of the current process. The benchmarks measure our
+clients against them, and the tests use them to inject faults.
+
+Unlike `src.kraken_stand_in`, they serve the same trades over and over, as fast as
+they can.
+"""
+
+import json
+import random
+import time
+from typing import List, Optional, Sequence, Union
+
+
+def generate_raw_rest_trades(n_trades: int) -> List[list]:
+    """
+    Generates trades with the same format as the `result` field of the Kraken REST
+    API Trades endpoint: [price, volume, time, buy/sell, market/limit, misc, trade_id]
+    """
+    start_sec = 1_717_000_000.0
+    return [
+        [
+            f'{60_000 + random.random() * 1_000:.1f}',
+            f'{random.random():.8f}',
+            start_sec + i * 0.01,
+            'b',
+            'l',
+            '',
+            i,
+        ]
+        for i in range(n_trades)
+    ]
+
+
+def start_local_trades_server(
+    n_trades: int = 1_000,
+    faults: Sequence[Union[int, str]] = (),
+    fault_delay_sec: float = 1.0,
+    request_log: Optional[List[dict]] = None,
+) -> str:
+    """
+    Starts, in a background thread, a local HTTP stand-in for the Kraken REST API
+    Trades endpoint that always returns the same page of `n_trades` trades, gzip
+    compressed if the client asks for it.
+
+    Args:
+        n_trades (int): The number of trades in the page.
+        faults (Sequence[Union[int, str]]): How the server answers the first requests,
+            one per request: an HTTP status code to return instead of the page, or
+            'timeout' to wait `fault_delay_sec` before returning the page.
+        fault_delay_sec (float): How long the 'timeout' faults wait.
+        request_log (Optional[List[dict]]): If given, the server appends to it the
+            client port and the content encoding of every request.
+
+    Returns:
+        str: The URL of the Trades endpoint, with the `product_id` and `since_sec`
+        placeholders of `KrakenRestAPI.URL`.
+    """
+    import gzip
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    body = json.dumps(
+        {
+            'error': [],
+            'result': {'BTC/USD': generate_raw_rest_trades(n_trades), 'last': '0'},
+        }
+    ).encode()
+    gzipped_body = gzip.compress(body)
+    faults = list(faults)
+    faults_lock = threading.Lock()
+
+    class TradesHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            with faults_lock:
+                fault = faults.pop(0) if faults else None
+            if fault == 'timeout':
+                time.sleep(fault_delay_sec)
+            elif fault is not None:
+                self.send_response(fault)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            use_gzip = 'gzip' in self.headers.get('Accept-Encoding', '')
+            payload = gzipped_body if use_gzip else body
+            if request_log is not None:
+                request_log.append(
+                    {
+                        'client_port': self.client_address[1],
+                        'content_encoding': 'gzip' if use_gzip else None,
+                    }
+                )
+            try:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                if use_gzip:
+                    self.send_header('Content-Encoding', 'gzip')
+                self.end_headers()
+                self.wfile.write(payload)
+            except (BrokenPipeError, ConnectionResetError):
+                # the client timed out and closed the connection
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('localhost', 0), TradesHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return f'http://localhost:{server.server_port}/0/public/Trades?pair={{product_id}}&since={{since_sec}}'
+
+
+def start_local_websocket_server(trades_per_frame: int = 100) -> str:
+    """
+    Starts, in a background thread, a local websocket server that sends frames of
+    `trades_per_frame` trades of the websocket v2 API, as fast as it can, for the
+    symbols each connection subscribes to.
+
+    Returns:
+        str: The URL of the websocket server.
+    """
+    import asyncio
+    import threading
+
+    import websockets
+
+    async def handler(ws) -> None:
+        subscribe = json.loads(await ws.recv())
+        frames = [
+            json.dumps(
+                {
+                    'channel': 'trade',
+                    'type': 'update',
+                    'data': [
+                        {
+                            'symbol': symbol,
+                            'side': 'buy',
+                            'price': 60_000 + random.random() * 1_000,
+                            'qty': random.random(),
+                            'ord_type': 'limit',
+                            'trade_id': i,
+                            'timestamp': '2024-06-06T10:00:00.123456Z',
+                        }
+                        for i in range(trades_per_frame)
+                    ],
+                }
+            )
+            for symbol in subscribe['params']['symbol']
+        ]
+        try:
+            while True:
+                for frame in frames:
+                    await ws.send(frame)
+        except websockets.ConnectionClosed:
+            pass
+
+    ports = []
+    ready = threading.Event()
+
+    async def serve() -> None:
+        async with websockets.serve(handler, 'localhost', 0) as server:
+            ports.append(list(server.sockets)[0].getsockname()[1])
+            ready.set()
+            await asyncio.Future()
+
+    threading.Thread(target=lambda: asyncio.run(serve()), daemon=True).start()
+    ready.wait()
+
+    return f'ws://localhost:{ports[0]}'
@@ -1,11 +1,13 @@
-from typing import List
+import time
+from typing import List, Optional
 
 from loguru import logger
 from quixstreams import Application
 
 # from src import config
 from src.config import config
-from src.kraken_api.trade import Trade
+from src.delivery import DeliveryTracker
+from src.kraken_api.trade import TradeBatch
 from src.kraken_api.websocket import KrakenWebsocketTradeAPI
 
 
@@ -38,31 +40,158 @@ def produce_trades(
     #     'historical',
     # }, f'Invalid value for live_or_historical: {live_or_historical}'
 
-    app = Application(broker_address=kafka_broker_addres)
+    app = Application(
+        broker_address=kafka_broker_addres,
+        # librdkafka groups the messages into batches of up to `batch.size` bytes,
+        # waiting up to `linger.ms` for a batch to fill up, and compresses each batch
+        producer_extra_config={
+            'linger.ms': config.kafka_linger_ms,
+            'batch.size': config.kafka_batch_size,
+            'compression.type': config.kafka_compression_type,
+            # the DeliveryTracker waits before a batch would take us above this many
+            # messages in flight, so the producer queue of librdkafka never fills up
+            'queue.buffering.max.messages': config.kafka_max_in_flight,
+        },
+    )
 
     # the topic where we will save the trades
     topic = app.topic(name=kafka_topic, value_serializer='json')
 
     logger.info(f'Creating the Kraken API to fetch data for {product_ids}')
 
+    # the per-product cursors of the backfill, only used in historical and catch_up
+    # modes
+    checkpoints = None
+
     # Create an instance of the Kraken API
-    if live_or_historical == 'live':
-        kraken_api = KrakenWebsocketTradeAPI(product_ids=product_ids)
-    else:
-        # I need historical data, so
-        from src.kraken_api.rest import KrakenRestAPIMultipleProducts
+    if live_or_historical == 'live' and config.websocket_async:
+        from src.kraken_api.websocket_async import KrakenAsyncWebsocketTradeAPI
 
-        kraken_api = KrakenRestAPIMultipleProducts(
+        kraken_api = KrakenAsyncWebsocketTradeAPI(
+            product_ids=product_ids,
+            n_connections=config.websocket_n_connections,
+            queue_size=config.websocket_queue_size,
+            url=config.kraken_ws_url,
+        )
+    elif live_or_historical == 'live':
+        kraken_api = KrakenWebsocketTradeAPI(
+            product_ids=product_ids, url=config.kraken_ws_url
+        )
+    elif live_or_historical == 'replay':
+        # we replay the trades we already have in the trade store, without calling
+        # Kraken, e.g. to rebuild the downstream topics
+        from src.kraken_api.replay import TradeStoreReplay
+
+        assert config.cache_dir_historical_data is not None, (
+            'Replay mode needs CACHE_DIR_HISTORICAL_DATA'
+        )
+
+        kraken_api = TradeStoreReplay(
             product_ids=product_ids,
-            last_n_days=last_n_days,
-            n_threads=1,  # len(product_ids),
             cache_dir=config.cache_dir_historical_data,
+            last_n_days=last_n_days,
+            batch_size=config.replay_batch_size,
+            speed=config.replay_speed,
+        )
+    else:
+        # I need historical data, so
+        from src.checkpoint import BackfillCheckpoints
+        from src.kraken_api.rest import (
+            KrakenRestAPIMultipleProducts,
+            get_egress_routes,
+        )
+
+        # Kraken rate limits each IP, so with several egress IPs the cursors are
+        # spread across them, each with a rate budget of its own. Without them, this
+        # creates the rate limiter the whole process shares, with the configured rate
+        egress_routes = get_egress_routes(
+            config.kraken_rest_egress_ips, config.kraken_rest_max_requests_per_sec
+        )
+
+        # If the container restarts, we resume from the last trade Kafka confirmed
+        # for each product, instead of re-producing the whole backfill
+        checkpoint_file = config.checkpoint_file
+        if checkpoint_file is None and config.cache_dir_historical_data is not None:
+            checkpoint_file = (
+                f'{config.cache_dir_historical_data}/checkpoints/{kafka_topic}.json'
+            )
+        resume_from_ms = {}
+        if checkpoint_file is not None:
+            checkpoints = BackfillCheckpoints(checkpoint_file)
+            resume_from_ms = {
+                product_id: checkpoints.last_trade_ms(product_id)
+                for product_id in product_ids
+                if checkpoints.last_trade_ms(product_id) is not None
+            }
+
+        def create_historical_api(to_ms: Optional[int] = None):
+            kraken_api = KrakenRestAPIMultipleProducts(
+                product_ids=product_ids,
+                last_n_days=last_n_days,
+                # one worker thread per product. The products on the same egress
+                # IP share its rate limiter, so together they fetch at Kraken's
+                # rate limit
+                n_threads=len(product_ids),
+                n_time_shards=config.n_time_shards,
+                cache_dir=config.cache_dir_historical_data,
+                resume_from_ms=resume_from_ms,
+                to_ms=to_ms,
+                base_url=config.kraken_rest_url,
+                egress_routes=egress_routes,
+            )
+
+            if config.prefetch_lookahead > 0:
+                # overlap the REST requests with producing to Kafka
+                from src.kraken_api.prefetch import PrefetchingTradeAPI
+
+                kraken_api = PrefetchingTradeAPI(
+                    kraken_api, lookahead=config.prefetch_lookahead
+                )
+
+            return kraken_api
+
+        if live_or_historical == 'historical':
+            kraken_api = create_historical_api()
+        else:
+            # catch_up: we backfill from the checkpoints (or `last_n_days` ago) until
+            # now, and then keep going with the live trades. The websocket connections
+            # open first, so the live trades are buffered while we catch up.
+            from src.kraken_api.catch_up import CatchUpThenLiveTradeAPI
+            from src.kraken_api.websocket_async import KrakenAsyncWebsocketTradeAPI
+
+            live_api = KrakenAsyncWebsocketTradeAPI(
+                product_ids=product_ids,
+                n_connections=config.websocket_n_connections,
+                queue_size=config.websocket_queue_size,
+                snapshot=True,
+                url=config.kraken_ws_url,
+            )
+            kraken_api = CatchUpThenLiveTradeAPI(
+                live_api=live_api, historical_api_factory=create_historical_api
+            )
+
+    # Kraken re-sends trades across REST pages and websocket reconnects, and every
+    # duplicate would be aggregated again downstream. The trade store never holds a
+    # trade twice, so replays skip it.
+    deduplicator = None
+    if config.dedup_window_size > 0 and live_or_historical != 'replay':
+        from src.kraken_api.dedup import TradeDeduplicator
+
+        deduplicator = TradeDeduplicator(
+            window_size=config.dedup_window_size,
+            bloom_capacity=config.dedup_bloom_capacity,
         )
 
     logger.info('Creating the producer...')
 
     # Create a Producer instance
     with app.get_producer() as producer:
+        # counts the delivery reports of all the batches, and stops us pulling trades
+        # from Kraken while too many messages are in flight
+        delivery = DeliveryTracker(
+            producer=producer, max_in_flight=config.kafka_max_in_flight
+        )
+
         while True:
             # check if we are done fetching historical data
             if kraken_api.is_done():
@@ -72,28 +201,100 @@ def produce_trades(
             # breakpoint()
 
             # Get the trades from the Kraken API
-            trades: List[Trade] = kraken_api.get_trades()
+            trades: TradeBatch = kraken_api.get_trades()
 
             # Challenge 1: Send a heartbeat to Prometheus to check the service is alive
             # Challenge 2: Send an event with trade latency to Prometheus, to monitor the trade latency
 
-            for trade in trades:
-                # Serialize an event using the defined Topic
-                message = topic.serialize(
-                    key=trade.product_id,
-                    value=trade.model_dump(),
-                )
+            if deduplicator is not None:
+                trades = deduplicator.filter(trades)
 
-                # Produce a message into the Kafka topic
+            if not trades:
+                continue
+
+            # blocks while the batch would take us above the max messages in flight
+            delivery.wait_for_capacity(len(trades))
+
+            # In historical mode, the delivery reports of the batch also move the
+            # per-product cursors forward once Kafka confirmed all its messages
+            on_delivery = delivery.track(
+                trades, on_delivery=checkpoints.track(trades) if checkpoints else None
+            )
+
+            # Produce the trades into the Kafka topic. The TradeBatch writes the key
+            # and value bytes of each message directly, so we skip
+            # topic.serialize(...) and the per-trade dicts
+            for key, value in trades.serialize():
                 producer.produce(
-                    topic=topic.name,
-                    value=message.value,
-                    key=message.key,
+                    topic=topic.name, value=value, key=key, on_delivery=on_delivery
                 )
 
-                logger.debug(f'{trade.model_dump()}')
+            logger.debug(f'Produced {len(trades)} trades to Kafka topic {topic.name}')
+            delivery.maybe_log_stats()
+
+    # the producer waited for the last delivery reports when it closed
+    delivery.log_stats()
+    if deduplicator is not None:
+        deduplicator.log_stats()
+
+
+def produce_book_features(
+    kafka_broker_addres: str,
+    kafka_topic: str,
+    product_ids: List[str],
+    depth: int,
+    publish_interval_ms: int,
+) -> None:
+    """
+    Keeps the order books of the `product_ids` up to date from the Kraken websocket
+    API, and saves their features into a Kafka topic every `publish_interval_ms`.
 
-            # logger.info(f'Produced {len(trades)} trades to Kafka topic {topic.name}')
+    Kraken sends many book updates per second for liquid products. We apply all of
+    them, but only publish the state of each book at a fixed cadence, so the
+    bandwidth downstream does not depend on how busy the market is.
+
+    Args:
+        kafka_broker_addres (str): The address of the Kafka broker.
+        kafka_topic (str): The name of the Kafka topic.
+        product_ids (List[str]): The product IDs for which we want the books.
+        depth (int): The number of levels per side of each book.
+        publish_interval_ms (int): How often we publish the features of each book.
+
+    Returns:
+        None
+    """
+    from src.kraken_api.websocket_book import KrakenWebsocketBookAPI
+
+    app = Application(broker_address=kafka_broker_addres)
+
+    # the topic where we will save the book features
+    topic = app.topic(name=kafka_topic, value_serializer='json')
+
+    kraken_api = KrakenWebsocketBookAPI(
+        product_ids=product_ids, depth=depth, url=config.kraken_ws_url
+    )
+
+    next_publish_ms = int(time.time() * 1000)
+    with app.get_producer() as producer:
+        while True:
+            # Kraken sends a heartbeat every second, so this never blocks for long
+            kraken_api.update()
+
+            now_ms = int(time.time() * 1000)
+            if now_ms < next_publish_ms:
+                continue
+            next_publish_ms = now_ms + publish_interval_ms
+
+            for features in kraken_api.get_features():
+                features['timestamp_ms'] = now_ms
+                message = topic.serialize(key=features['product_id'], value=features)
+                producer.produce(topic=topic.name, value=message.value, key=message.key)
+
+            logger.debug(
+                f'Published the features of {len(kraken_api.books)} books. '
+                f'{kraken_api.n_updates} updates and '
+                f'{kraken_api.n_checksum_mismatches} checksum mismatches so far'
+            )
 
 
 if __name__ == '__main__':
@@ -113,14 +314,23 @@ if __name__ == '__main__':
     # breakpoint()
 
     try:
-        produce_trades(
-            kafka_broker_addres=config.kafka_broker_address,
-            kafka_topic=config.kafka_topic,
-            product_ids=config.product_ids,
-            # extra parameters I need when running the trade_producer against
-            # historical data from the KrakenREST API
-            live_or_historical=config.live_or_historical,
-            last_n_days=config.last_n_days,
-        )
+        if config.channel == 'book':
+            produce_book_features(
+                kafka_broker_addres=config.kafka_broker_address,
+                kafka_topic=config.kafka_book_topic,
+                product_ids=config.product_ids,
+                depth=config.book_depth,
+                publish_interval_ms=config.book_publish_interval_ms,
+            )
+        else:
+            produce_trades(
+                kafka_broker_addres=config.kafka_broker_address,
+                kafka_topic=config.kafka_topic,
+                product_ids=config.product_ids,
+                # extra parameters I need when running the trade_producer against
+                # historical data from the KrakenREST API
+                live_or_historical=config.live_or_historical,
+                last_n_days=config.last_n_days,
+            )
     except KeyboardInterrupt:
-        logger.info('Exiting...')
\ No newline at end of file
+        logger.info('Exiting...')
@@ -0,0 +1,141 @@
+import json
+from typing import List
+
+import pytest
+
+from src import checkpoint
+from src.checkpoint import BackfillCheckpoints
+from src.kraken_api.trade import TradeBatch
+
+
+class FakeMessage:
+    def __init__(self, key: bytes, offset: int):
+        self._key = key
+        self._offset = offset
+
+    def key(self) -> bytes:
+        return self._key
+
+    def offset(self) -> int:
+        return self._offset
+
+
+class FakeTopic:
+    """
+    Hands out the offsets of the messages in the order we produce them, and keeps
+    their delivery callbacks so the test decides when, and in which order, they are
+    delivered.
+    """
+
+    def __init__(self):
+        self.next_offset = 0
+
+    def produce(self, checkpoints: BackfillCheckpoints, trades: TradeBatch) -> List:
+        on_delivery = checkpoints.track(trades)
+        deliveries = []
+        for key, _ in trades.serialize():
+            msg = FakeMessage(key, self.next_offset)
+            self.next_offset += 1
+            deliveries.append((on_delivery, msg))
+        return deliveries
+
+
+def trade_batch(product_ids: List[str], timestamps_ms: List[int]) -> TradeBatch:
+    return TradeBatch(
+        product_ids=product_ids,
+        prices=[60_000.0] * len(product_ids),
+        volumes=[1.0] * len(product_ids),
+        timestamps_ms=timestamps_ms,
+    )
+
+
+def deliver(deliveries: List, err=None) -> None:
+    for on_delivery, msg in deliveries:
+        on_delivery(err, msg)
+
+
+def saved_cursors(checkpoints: BackfillCheckpoints) -> dict:
+    if not checkpoints.file_path.exists():
+        return {}
+    return json.loads(checkpoints.file_path.read_text())
+
+
+@pytest.fixture
+def checkpoints(tmp_path) -> BackfillCheckpoints:
+    return BackfillCheckpoints(str(tmp_path / 'checkpoints' / 'trade.json'))
+
+
+def test_moves_the_cursors_in_order_when_deliveries_complete_out_of_order(
+    checkpoints,
+):
+    topic = FakeTopic()
+    first = topic.produce(checkpoints, trade_batch(['BTC/USD', 'ETH/USD'], [10, 11]))
+    second = topic.produce(checkpoints, trade_batch(['BTC/USD', 'BTC/USD'], [20, 21]))
+    third = topic.produce(checkpoints, trade_batch(['ETH/USD'], [30]))
+
+    # the second batch is fully delivered before the first one
+    deliver(second)
+    deliver(first[:1])
+
+    assert checkpoints.last_trade_ms('BTC/USD') is None
+    assert saved_cursors(checkpoints) == {}
+
+    # the first batch completes, and the cursors move past the second one too
+    deliver(first[1:])
+
+    expected = {
+        'BTC/USD': {'last_trade_ms': 21, 'offset': 3},
+        'ETH/USD': {'last_trade_ms': 11, 'offset': 1},
+    }
+    assert checkpoints.cursors == expected
+    assert saved_cursors(checkpoints) == expected
+
+    deliver(third)
+
+    expected['ETH/USD'] = {'last_trade_ms': 30, 'offset': 4}
+    assert saved_cursors(checkpoints) == expected
+    assert not list(checkpoints.file_path.parent.glob('*.tmp'))
+
+
+def test_stops_the_cursors_at_a_batch_that_failed_to_deliver(checkpoints):
+    topic = FakeTopic()
+    first = topic.produce(checkpoints, trade_batch(['BTC/USD'], [10]))
+    deliver(first)
+
+    failed = topic.produce(checkpoints, trade_batch(['BTC/USD', 'ETH/USD'], [20, 21]))
+    after = topic.produce(checkpoints, trade_batch(['BTC/USD'], [30]))
+    deliver(after)
+    deliver(failed[:1])
+    deliver(failed[1:], err='Message timed out')
+
+    expected = {'BTC/USD': {'last_trade_ms': 10, 'offset': 0}}
+    assert checkpoints.cursors == expected
+    assert saved_cursors(checkpoints) == expected
+
+    # a restart resumes after the last batch before the failed one, so it produces
+    # the failed batch again
+    restarted = BackfillCheckpoints(str(checkpoints.file_path))
+    assert restarted.last_trade_ms('BTC/USD') == 10
+    assert restarted.last_trade_ms('ETH/USD') is None
+
+
+def test_keeps_the_previous_checkpoint_if_we_crash_while_saving(
+    checkpoints, monkeypatch
+):
+    topic = FakeTopic()
+    deliver(topic.produce(checkpoints, trade_batch(['BTC/USD'], [10])))
+    saved = checkpoints.file_path.read_text()
+
+    def crash(src, dst):
+        raise OSError('No space left on device')
+
+    # we crash after writing the temporary file and before renaming it
+    monkeypatch.setattr(checkpoint.os, 'replace', crash)
+
+    with pytest.raises(OSError):
+        deliver(topic.produce(checkpoints, trade_batch(['BTC/USD'], [20])))
+
+    assert checkpoints.file_path.read_text() == saved
+    assert (
+        BackfillCheckpoints(str(checkpoints.file_path)).last_trade_ms('BTC/USD') == 10
+    )
@@ -0,0 +1,97 @@
+from typing import List
+
+from src.kraken_api.dedup import BloomFilter, TradeDeduplicator
+from src.kraken_api.trade import TradeBatch
+
+
+def trade_batch(timestamps_ms: List[int], product_id: str = 'BTC/USD') -> TradeBatch:
+    """
+    One trade per timestamp, with a price and a volume that only depend on it, so the
+    same timestamp is the same trade.
+    """
+    return TradeBatch(
+        product_ids=[product_id] * len(timestamps_ms),
+        prices=[60_000.0 + ts for ts in timestamps_ms],
+        volumes=[1.0 + ts / 1_000 for ts in timestamps_ms],
+        timestamps_ms=list(timestamps_ms),
+    )
+
+
+def test_drops_the_trades_a_page_shares_with_the_previous_one():
+    deduplicator = TradeDeduplicator(window_size=100)
+
+    first_page = deduplicator.filter(trade_batch(list(range(10))))
+    # the next page starts from the timestamp of the last trade of the previous one
+    second_page = deduplicator.filter(trade_batch(list(range(5, 15))))
+
+    assert list(first_page.timestamps_ms) == list(range(10))
+    assert list(second_page.timestamps_ms) == list(range(10, 15))
+    assert deduplicator.stats() == {'BTC/USD': 5}
+
+
+def test_keeps_the_duplicates_inside_a_batch():
+    deduplicator = TradeDeduplicator(window_size=100)
+
+    # two fills of the same price and volume in the same millisecond
+    trades = deduplicator.filter(trade_batch([1, 2, 2, 3]))
+    replayed = deduplicator.filter(trade_batch([2, 2, 4]))
+
+    assert list(trades.timestamps_ms) == [1, 2, 2, 3]
+    assert list(replayed.timestamps_ms) == [4]
+
+
+def test_keeps_the_same_trade_of_another_product():
+    deduplicator = TradeDeduplicator(window_size=100)
+
+    deduplicator.filter(trade_batch([1, 2, 3], product_id='BTC/USD'))
+    trades = deduplicator.filter(trade_batch([1, 2, 3], product_id='ETH/USD'))
+
+    assert list(trades.timestamps_ms) == [1, 2, 3]
+
+
+def test_catches_a_trade_evicted_from_the_ring_with_the_bloom_filter():
+    deduplicator = TradeDeduplicator(window_size=3, bloom_capacity=100)
+    without_bloom = TradeDeduplicator(window_size=3, bloom_capacity=0)
+
+    for dedup in (deduplicator, without_bloom):
+        dedup.filter(trade_batch(list(range(10))))
+
+    # the trades 0 to 6 fell out of the ring of the last 3 trades
+    assert list(deduplicator.filter(trade_batch([0, 6])).timestamps_ms) == []
+    assert list(without_bloom.filter(trade_batch([0, 6])).timestamps_ms) == [0, 6]
+
+
+def test_never_asks_the_bloom_filter_about_trades_newer_than_the_evicted_ones(
+    monkeypatch,
+):
+    asked = []
+
+    def false_positive(self, fingerprint):
+        asked.append(fingerprint[0])
+        return True
+
+    # a Bloom filter that says it holds everything
+    monkeypatch.setattr(BloomFilter, '__contains__', false_positive)
+
+    deduplicator = TradeDeduplicator(window_size=3, bloom_capacity=100)
+    deduplicator.filter(trade_batch(list(range(10))))
+    # trades 0 to 6 were evicted, 7 to 9 are in the ring
+    asked.clear()
+
+    trades = deduplicator.filter(trade_batch([5, 8, 10, 11]))
+
+    # 8 is in the ring, 10 and 11 are newer than every evicted trade, and only 5 can
+    # be in the Bloom filter
+    assert asked == [5]
+    assert list(trades.timestamps_ms) == [10, 11]
+
+
+def test_reports_the_duplicates_per_product():
+    deduplicator = TradeDeduplicator(window_size=100)
+
+    deduplicator.filter(trade_batch([1, 2], product_id='BTC/USD'))
+    deduplicator.filter(trade_batch([1], product_id='ETH/USD'))
+    deduplicator.filter(trade_batch([1, 2, 3], product_id='BTC/USD'))
+    deduplicator.filter(trade_batch([1, 2], product_id='ETH/USD'))
+
+    assert deduplicator.stats() == {'BTC/USD': 2, 'ETH/USD': 1}
@@ -0,0 +1,107 @@
+from src.delivery import DeliveryTracker
+from src.kraken_api.trade import TradeBatch
+
+
+class FakeMessage:
+    def __init__(self, key: bytes):
+        self._key = key
+
+    def key(self) -> bytes:
+        return self._key
+
+
+class FakeProducer:
+    """
+    Keeps the delivery callbacks of the messages produced, and serves them on `poll`,
+    with the `errors` first if there are any.
+    """
+
+    def __init__(self, errors=()):
+        self.pending = []
+        self.errors = list(errors)
+
+    def produce(self, key: bytes, on_delivery) -> None:
+        self.pending.append((key, on_delivery))
+
+    def poll(self, timeout: float = 0) -> None:
+        if self.pending:
+            key, on_delivery = self.pending.pop(0)
+            error = self.errors.pop(0) if self.errors else None
+            on_delivery(error, FakeMessage(key))
+
+
+def trade_batch(n_trades: int) -> TradeBatch:
+    return TradeBatch(
+        product_ids=['BTC/USD'] * n_trades,
+        prices=[60_000.0] * n_trades,
+        volumes=[1.0] * n_trades,
+        timestamps_ms=list(range(n_trades)),
+    )
+
+
+def produce(producer: FakeProducer, tracker: DeliveryTracker, trades, on_delivery=None):
+    tracker.wait_for_capacity(len(trades))
+    callback = tracker.track(trades, on_delivery=on_delivery)
+    for key, _ in trades.serialize():
+        producer.produce(key, callback)
+
+
+def test_counts_delivered_failed_and_in_flight_trades():
+    producer = FakeProducer(errors=[None, 'timed out'])
+    tracker = DeliveryTracker(producer)
+
+    produce(producer, tracker, trade_batch(5))
+    for _ in range(3):
+        producer.poll()
+
+    assert tracker.stats() == {
+        'n_produced': 5,
+        'n_delivered': 2,
+        'n_failed': 1,
+        'n_in_flight': 2,
+        'n_backpressure_waits': 0,
+    }
+
+
+def test_passes_the_delivery_reports_on_to_the_batch_callback():
+    producer = FakeProducer()
+    tracker = DeliveryTracker(producer)
+    reports = []
+
+    produce(
+        producer,
+        tracker,
+        trade_batch(2),
+        on_delivery=lambda *report: reports.append(report),
+    )
+    producer.poll()
+    producer.poll()
+
+    assert [(err, msg.key()) for err, msg in reports] == [
+        (None, b'BTC/USD'),
+        (None, b'BTC/USD'),
+    ]
+
+
+def test_waits_for_delivery_reports_above_max_in_flight():
+    producer = FakeProducer()
+    tracker = DeliveryTracker(producer, max_in_flight=10)
+
+    produce(producer, tracker, trade_batch(8))
+    # room for 2 more, so it waits for 3 delivery reports
+    produce(producer, tracker, trade_batch(5))
+
+    assert tracker.n_backpressure_waits == 1
+    assert tracker.n_delivered == 3
+    assert tracker.n_in_flight == 10
+
+
+def test_a_batch_larger_than_max_in_flight_waits_for_all_the_others():
+    producer = FakeProducer()
+    tracker = DeliveryTracker(producer, max_in_flight=10)
+
+    produce(producer, tracker, trade_batch(4))
+    produce(producer, tracker, trade_batch(20))
+
+    assert tracker.n_delivered == 4
+    assert tracker.n_in_flight == 20
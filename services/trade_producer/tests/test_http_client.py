@@ -0,0 +1,75 @@
+import pytest
+import requests
+
+from src.kraken_api.http_client import KrakenHttpClient
+from src.local_servers import start_local_trades_server
+
+
+def trades_url(**kwargs) -> str:
+    return start_local_trades_server(n_trades=10, **kwargs).format(
+        product_id='BTC/USD', since_sec=0
+    )
+
+
+def test_reuses_the_connection_across_requests():
+    request_log = []
+    url = trades_url(request_log=request_log)
+    client = KrakenHttpClient()
+
+    for _ in range(20):
+        client.get_json(url)
+
+    assert client.stats()['n_requests'] == 20
+    assert client.stats()['n_new_connections'] == 1
+    assert len({request['client_port'] for request in request_log}) == 1
+
+
+def test_asks_for_gzip_and_decodes_it():
+    request_log = []
+    url = trades_url(request_log=request_log)
+
+    data = KrakenHttpClient().get_json(url)
+
+    assert request_log[0]['content_encoding'] == 'gzip'
+    assert len(data['result']['BTC/USD']) == 10
+
+
+@pytest.mark.parametrize('status_code', [429, 500, 502, 503])
+def test_retries_on_5xx_and_429(status_code):
+    url = trades_url(faults=[status_code, status_code])
+    client = KrakenHttpClient(backoff_sec=0.01)
+
+    data = client.get_json(url)
+
+    assert len(data['result']['BTC/USD']) == 10
+    assert client.stats()['n_retries'] == 2
+
+
+def test_retries_on_timeouts():
+    url = trades_url(faults=['timeout'], fault_delay_sec=0.5)
+    client = KrakenHttpClient(timeout_sec=(1, 0.1), backoff_sec=0.01)
+
+    data = client.get_json(url)
+
+    assert len(data['result']['BTC/USD']) == 10
+    assert client.stats()['n_retries'] == 1
+
+
+def test_gives_up_after_max_retries():
+    url = trades_url(faults=[503] * 3)
+    client = KrakenHttpClient(max_retries=2, backoff_sec=0.01)
+
+    with pytest.raises(requests.HTTPError):
+        client.get_json(url)
+
+    assert client.stats()['n_retries'] == 2
+
+
+def test_does_not_retry_on_4xx():
+    url = trades_url(faults=[404])
+    client = KrakenHttpClient(backoff_sec=0.01)
+
+    with pytest.raises(requests.HTTPError):
+        client.get_json(url)
+
+    assert client.stats()['n_retries'] == 0
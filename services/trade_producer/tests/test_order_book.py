@@ -0,0 +1,149 @@
+import zlib
+from typing import List, Tuple
+
+from src.kraken_api.order_book import OrderBook
+
+# A snapshot of the BTC/USD book of depth 10, with 1 decimal for prices and 8 for
+# quantities, as in the Kraken guide on the checksums of the v2 book channel
+ASKS = [
+    (45285.2, 0.001),
+    (45286.4, 1.54582015),
+    (45286.6, 1.54592586),
+    (45289.6, 1.54642498),
+    (45290.2, 0.1525),
+    (45291.8, 1.5466963),
+    (45294.7, 0.04),
+    (45296.1, 0.35),
+    (45297.5, 0.092),
+    (45299.5, 0.185),
+]
+BIDS = [
+    (45283.5, 0.1),
+    (45283.4, 1.54582015),
+    (45282.1, 0.1),
+    (45281.0, 0.1),
+    (45280.3, 1.54592586),
+    (45279.0, 0.0799),
+    (45277.6, 0.03310103),
+    (45277.5, 0.3),
+    (45277.3, 1.54602737),
+    (45276.6, 0.15445238),
+]
+
+# The string Kraken computes the CRC32 of: the asks from best to worst and then the
+# bids from best to worst, each price and quantity without the decimal point and
+# without leading zeros, e.g. 0.00100000 is 100000. One level per line, its price
+# and then its quantity
+CHECKSUM_STRING = ''.join(
+    [
+        # asks
+        '452852100000',
+        '452864154582015',
+        '452866154592586',
+        '452896154642498',
+        '45290215250000',
+        '452918154669630',
+        '4529474000000',
+        '45296135000000',
+        '4529759200000',
+        '45299518500000',
+        # bids
+        '45283510000000',
+        '452834154582015',
+        '45282110000000',
+        '45281010000000',
+        '452803154592586',
+        '4527907990000',
+        '4527763310103',
+        '45277530000000',
+        '452773154602737',
+        '45276615445238',
+    ]
+)
+
+
+def levels(prices_and_qtys: List[Tuple[float, float]]) -> List[dict]:
+    return [{'price': price, 'qty': qty} for price, qty in prices_and_qtys]
+
+
+def book_from_snapshot(
+    bids: List[Tuple[float, float]], asks: List[Tuple[float, float]]
+) -> OrderBook:
+    book = OrderBook('BTC/USD', depth=10, price_precision=1, qty_precision=8)
+    book.apply_snapshot(levels(bids), levels(asks))
+    return book
+
+
+def test_computes_the_checksum_of_a_snapshot_the_way_kraken_does():
+    book = book_from_snapshot(BIDS, ASKS)
+
+    assert book.checksum() == zlib.crc32(CHECKSUM_STRING.encode())
+
+
+def test_updates_the_quantity_of_a_level():
+    book = book_from_snapshot(BIDS, ASKS)
+
+    book.apply_update(levels([(45282.1, 0.25)]), levels([(45285.2, 0.5)]))
+
+    expected_bids = [(45282.1, 0.25) if p == 45282.1 else (p, q) for p, q in BIDS]
+    expected_asks = [(45285.2, 0.5)] + ASKS[1:]
+    assert (
+        book.checksum() == book_from_snapshot(expected_bids, expected_asks).checksum()
+    )
+    assert book.checksum() != book_from_snapshot(BIDS, ASKS).checksum()
+
+
+def test_deletes_a_level_and_adds_the_next_one_kraken_sends():
+    book = book_from_snapshot(BIDS, ASKS)
+
+    # Kraken sends the deleted level with a quantity of 0, and the level that comes
+    # into the top 10 in its place in the same update
+    book.apply_update(
+        levels([(45280.3, 0), (45276.0, 2.0)]), levels([(45290.2, 0), (45300.1, 1.0)])
+    )
+
+    expected_bids = [(p, q) for p, q in BIDS if p != 45280.3] + [(45276.0, 2.0)]
+    expected_asks = [(p, q) for p, q in ASKS if p != 45290.2] + [(45300.1, 1.0)]
+    assert len(book.bids) == len(book.asks) == 10
+    assert (
+        book.checksum() == book_from_snapshot(expected_bids, expected_asks).checksum()
+    )
+
+
+def test_deleting_a_level_that_is_not_in_the_book_changes_nothing():
+    book = book_from_snapshot(BIDS, ASKS)
+
+    book.apply_update(levels([(45000.0, 0)]), levels([]))
+
+    assert book.checksum() == zlib.crc32(CHECKSUM_STRING.encode())
+
+
+def test_drops_the_levels_pushed_past_the_depth():
+    book = book_from_snapshot(BIDS, ASKS)
+
+    # a better bid and a better ask push the worst levels out of the top 10
+    book.apply_update(levels([(45284.0, 0.5)]), levels([(45284.9, 0.7)]))
+
+    expected_bids = [(45284.0, 0.5)] + BIDS[:-1]
+    expected_asks = [(45284.9, 0.7)] + ASKS[:-1]
+    assert len(book.bids) == len(book.asks) == 10
+    assert (
+        book.checksum() == book_from_snapshot(expected_bids, expected_asks).checksum()
+    )
+
+    # the dropped levels do not come back when a level above them is deleted
+    book.apply_update(levels([(45284.0, 0)]), levels([(45284.9, 0)]))
+
+    assert len(book.bids) == len(book.asks) == 9
+    assert book.checksum() == book_from_snapshot(BIDS[:-1], ASKS[:-1]).checksum()
+
+
+def test_a_snapshot_replaces_the_whole_book():
+    book = book_from_snapshot(BIDS, ASKS)
+    book.apply_update(levels([(45284.0, 0.5)]), levels([(45250.0, 3.0)]))
+    book.is_synced = False
+
+    book.apply_snapshot(levels(BIDS), levels(ASKS))
+
+    assert book.is_synced
+    assert book.checksum() == zlib.crc32(CHECKSUM_STRING.encode())
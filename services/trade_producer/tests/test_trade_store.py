@@ -0,0 +1,65 @@
+import threading
+
+from src.kraken_api import trade_store
+from src.kraken_api.trade import TradeBatch
+from src.kraken_api.trade_store import DAY_MS, TradeStore
+
+DAY_START_MS = 1_717_000_000_000 - 1_717_000_000_000 % DAY_MS
+DAY_END_MS = DAY_START_MS + DAY_MS - 1
+
+
+def trades(from_ms: int, to_ms: int, every_ms: int = 60_000) -> TradeBatch:
+    timestamps_ms = list(range(from_ms, to_ms + 1, every_ms))
+    return TradeBatch(
+        product_ids=['BTC/USD'] * len(timestamps_ms),
+        prices=[60_000.0] * len(timestamps_ms),
+        volumes=[1.0] * len(timestamps_ms),
+        timestamps_ms=timestamps_ms,
+        sides=['buy'] * len(timestamps_ms),
+    )
+
+
+def test_reads_the_day_while_another_thread_compacts_it(tmp_path, monkeypatch):
+    store = TradeStore(str(tmp_path))
+    middle_ms = DAY_START_MS + DAY_MS // 2
+    # the day is covered but for an hour in the middle
+    store.write(
+        'BTC/USD', trades(DAY_START_MS, middle_ms - 1), DAY_START_MS, middle_ms - 1
+    )
+    store.write(
+        'BTC/USD',
+        trades(middle_ms + 3_600_000, DAY_END_MS),
+        middle_ms + 3_600_000,
+        DAY_END_MS,
+    )
+
+    # another REST worker fetches the missing hour, which completes the day and
+    # compacts its files, right when we start reading them
+    read_file = trade_store._read_file
+    writer = threading.Thread(
+        target=store.write,
+        args=(
+            'BTC/USD',
+            trades(middle_ms, middle_ms + 3_600_000 - 1),
+            middle_ms,
+            middle_ms + 3_600_000 - 1,
+        ),
+    )
+
+    def read_file_while_compacting(path, memory_map=False):
+        if not writer.is_alive() and writer.ident is None:
+            writer.start()
+            # it either compacts the files now, or waits for us to read them
+            writer.join(timeout=0.5)
+        return read_file(path, memory_map=memory_map)
+
+    monkeypatch.setattr(trade_store, '_read_file', read_file_while_compacting)
+
+    table = store.read_table('BTC/USD', DAY_START_MS, DAY_END_MS)
+    writer.join(timeout=5)
+
+    expected = trades(DAY_START_MS, DAY_END_MS)
+    # the missing hour is not in the files we read
+    assert len(table) == len(expected) - 60
+    assert len(store.read('BTC/USD', DAY_START_MS, DAY_END_MS)) == len(expected)
+    assert len(list(tmp_path.glob('*/*/*.parquet'))) == 1
@@ -3,4 +3,5 @@
 export KAFKA_INPUT_TOPIC=trade_historical
 export KAFKA_OUTPUT_TOPIC=ohlc_historical
 export KAFKA_CONSUMER_GROUP=trade_to_ohlc_historical_consumer_group
+export LIVE_OR_HISTORICAL=historical
 export OHLC_WINDOW_SECONDS=60
\ No newline at end of file
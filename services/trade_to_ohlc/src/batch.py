@@ -0,0 +1,274 @@
+"""
+Offline trade -> OHLC converter, for backfills.
+
+Instead of replaying the historical trades one by one through Kafka and the streaming
+service, it reads them in columnar chunks, from the trade store of the trade_producer
+or from a dump of the trade topic, and aggregates each chunk with vectorized pandas
+group-bys. The candles have exactly the same keys as the ones of the streaming
+service, so they can go to the same topic, or to a JSON lines file.
+
+    poetry run python -m src.batch --cache-dir /path/to/cache_dir_historical_data \\
+        --product-ids BTC/USD ETH/USD --last-n-days 30 --window-seconds 60 \\
+        --output-file ohlc.jsonl
+"""
+
+import time
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+import pandas as pd
+from loguru import logger
+
+from src.candle_aggregator import CANDLE_KEYS
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+TRADE_COLUMNS = ['product_id', 'price', 'volume', 'timestamp_ms', 'side']
+
+
+def read_trade_store(
+    cache_dir: str, product_id: str, from_ms: int, to_ms: int
+) -> Iterator[pd.DataFrame]:
+    """
+    Yields the trades of `product_id` in [from_ms, to_ms] from the trade store of the
+    trade_producer, one day at a time, in timestamp order.
+
+    The store keeps the trades in parquet files with this layout
+
+        <cache_dir>/<product_id>/<YYYY-MM-DD>/<from_ms>-<to_ms>.parquet
+
+    where the files of a day do not overlap.
+    """
+    from datetime import datetime, timezone
+
+    product_dir = Path(cache_dir) / product_id.replace('/', '-')
+    from_day = datetime.fromtimestamp(from_ms / 1000, tz=timezone.utc).strftime(
+        '%Y-%m-%d'
+    )
+
+    for day_dir in sorted(p for p in product_dir.iterdir() if p.is_dir()):
+        if day_dir.name < from_day:
+            continue
+
+        paths = sorted(
+            day_dir.glob('*.parquet'), key=lambda p: int(p.stem.split('-')[0])
+        )
+        if not paths:
+            continue
+
+        trades = pd.concat([pd.read_parquet(path) for path in paths])
+        trades = trades[trades['timestamp_ms'].between(from_ms, to_ms)]
+        if trades.empty:
+            continue
+
+        yield _with_trade_columns(trades)
+
+
+def read_trade_dump(path: str, chunk_size: int = 1_000_000) -> Iterator[pd.DataFrame]:
+    """
+    Yields the trades of a dump of the trade topic, `chunk_size` at a time, in the
+    order of the dump.
+
+    The dump is a JSON lines file with the value of one message per line, e.g. from
+    `rpk topic consume trade --format '%v\\n'`.
+    """
+    # `timestamp_ms` would be parsed as a date otherwise, and the prices would lose
+    # their last digits
+    with pd.read_json(
+        path,
+        lines=True,
+        chunksize=chunk_size,
+        convert_dates=False,
+        precise_float=True,
+    ) as chunks:
+        for trades in chunks:
+            yield _with_trade_columns(trades)
+
+
+def _with_trade_columns(trades: pd.DataFrame) -> pd.DataFrame:
+    """
+    Keeps the columns of the trades we need. Trades from before we kept the side of
+    the taker get a null one.
+    """
+    if 'side' not in trades.columns:
+        trades = trades.assign(side=None)
+    return trades[TRADE_COLUMNS].reset_index(drop=True)
+
+
+def aggregate_candles(trades: pd.DataFrame, window_seconds: int) -> pd.DataFrame:
+    """
+    Aggregates the trades into one candle per product and window, with vectorized
+    group-bys on `timestamp_ms // window_ms`.
+
+    The open and close prices are the ones of the first and last trades of the window
+    in the order of `trades`, as in the streaming service.
+
+    Args:
+        trades (pd.DataFrame): The trades, with the TRADE_COLUMNS.
+        window_seconds (int): The size of the tumbling windows.
+
+    Returns:
+        pd.DataFrame: The candles, with the CANDLE_KEYS as columns.
+    """
+    window_ms = window_seconds * 1000
+    is_buy = trades['side'] == 'buy'
+    is_sell = trades['side'] == 'sell'
+
+    candles = (
+        trades.assign(
+            window=trades['timestamp_ms'] // window_ms,
+            notional=trades['price'] * trades['volume'],
+            buy_volume=trades['volume'].where(is_buy, 0.0),
+            sell_volume=trades['volume'].where(is_sell, 0.0),
+        )
+        .groupby(['product_id', 'window'], sort=False)
+        .agg(
+            open=('price', 'first'),
+            high=('price', 'max'),
+            low=('price', 'min'),
+            close=('price', 'last'),
+            volume=('volume', 'sum'),
+            notional=('notional', 'sum'),
+            trade_count=('price', 'size'),
+            buy_volume=('buy_volume', 'sum'),
+            sell_volume=('sell_volume', 'sum'),
+        )
+        .reset_index()
+    )
+
+    # `timestamp` is the end of the window
+    candles['timestamp'] = (candles['window'] + 1) * window_ms
+    candles['vwap'] = (candles['notional'] / candles['volume']).where(
+        candles['volume'] > 0, candles['close']
+    )
+    return candles[CANDLE_KEYS]
+
+
+def trades_to_candles(
+    chunks: Iterable[pd.DataFrame], window_seconds: int
+) -> Iterator[pd.DataFrame]:
+    """
+    Turns chunks of trades into chunks of candles, with the same semantics as the
+    tumbling windows of the streaming service:
+
+    - a window of a product closes when a trade of a later window of the product
+      comes in, so the trades of its last window in a chunk are carried over to the
+      next chunk, in case the window continues there.
+    - a trade of a window that already closed is dropped.
+
+    Once the chunks are over, the last window of each product is emitted too, as we
+    know there are no more trades. The streaming service would keep it open.
+
+    Args:
+        chunks (Iterable[pd.DataFrame]): The trades, with the TRADE_COLUMNS, in the
+            order the streaming service would read them.
+        window_seconds (int): The size of the tumbling windows.
+
+    Returns:
+        Iterator[pd.DataFrame]: The candles, with the CANDLE_KEYS as columns.
+    """
+    window_ms = window_seconds * 1000
+
+    # the trades of the last window of each product, that may not be over
+    open_trades: Optional[pd.DataFrame] = None
+
+    for chunk in chunks:
+        trades = pd.concat([open_trades, chunk], ignore_index=True)
+        windows = trades['timestamp_ms'] // window_ms
+
+        # the windows of a product close in order, so a trade whose window is before
+        # the latest window of its product so far is late
+        by_product = windows.groupby(trades['product_id'], sort=False)
+        is_on_time = windows == by_product.cummax()
+        trades, windows = trades[is_on_time], windows[is_on_time]
+
+        is_open = windows == windows.groupby(trades['product_id']).transform('max')
+        open_trades = trades[is_open]
+
+        candles = aggregate_candles(trades[~is_open], window_seconds)
+        if not candles.empty:
+            yield candles
+
+    if open_trades is not None and not open_trades.empty:
+        yield aggregate_candles(open_trades, window_seconds)
+
+
+def write_candles(
+    candles: Iterable[pd.DataFrame],
+    output_file: Optional[str] = None,
+    kafka_output_topic: Optional[str] = None,
+    kafka_broker_address: Optional[str] = None,
+) -> int:
+    """
+    Writes the candles to a JSON lines file, or to a Kafka topic with the product_id
+    as key, and returns how many we wrote.
+    """
+    from quixstreams.utils.json import dumps
+
+    n_candles = 0
+
+    if output_file is not None:
+        with open(output_file, 'wb') as f:
+            for chunk in candles:
+                f.writelines(
+                    dumps(candle) + b'\n' for candle in chunk.to_dict('records')
+                )
+                n_candles += len(chunk)
+                logger.info(f'Wrote {n_candles} candles to {output_file}')
+        return n_candles
+
+    from quixstreams.kafka import Producer
+
+    with Producer(broker_address=kafka_broker_address) as producer:
+        for chunk in candles:
+            for candle in chunk.to_dict('records'):
+                producer.produce(
+                    topic=kafka_output_topic,
+                    key=candle['product_id'].encode(),
+                    value=dumps(candle),
+                )
+            n_candles += len(chunk)
+            logger.info(f'Produced {n_candles} candles to {kafka_output_topic}')
+    return n_candles
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('--window-seconds', type=int, default=60)
+    parser.add_argument('--cache-dir', type=str, default=None)
+    parser.add_argument('--product-ids', type=str, nargs='+', default=[])
+    parser.add_argument('--last-n-days', type=int, default=None)
+    parser.add_argument('--dump-file', type=str, default=None)
+    parser.add_argument('--output-file', type=str, default=None)
+    parser.add_argument('--kafka-output-topic', type=str, default=None)
+    parser.add_argument('--kafka-broker-address', type=str, default=None)
+    args = parser.parse_args()
+
+    if args.dump_file is not None:
+        chunks = read_trade_dump(args.dump_file)
+    else:
+        assert args.cache_dir and args.product_ids and args.last_n_days, (
+            'Pass --dump-file, or --cache-dir, --product-ids and --last-n-days'
+        )
+        to_ms = int(time.time() * 1000)
+        from_ms = to_ms - args.last_n_days * DAY_MS
+        chunks = (
+            chunk
+            for product_id in args.product_ids
+            for chunk in read_trade_store(args.cache_dir, product_id, from_ms, to_ms)
+        )
+
+    assert args.output_file or (
+        args.kafka_output_topic and args.kafka_broker_address
+    ), 'Pass --output-file, or --kafka-output-topic and --kafka-broker-address'
+
+    start = time.perf_counter()
+    n_candles = write_candles(
+        trades_to_candles(chunks, args.window_seconds),
+        output_file=args.output_file,
+        kafka_output_topic=args.kafka_output_topic,
+        kafka_broker_address=args.kafka_broker_address,
+    )
+    logger.info(f'{n_candles} candles in {time.perf_counter() - start:.1f} seconds')
@@ -0,0 +1,158 @@
+"""
+Micro-benchmarks for the hot paths of the trade_to_ohlc service.
+
+They do not need Kafka, so you can run them anywhere with
+
+    poetry run python -m src.benchmarks <benchmark_name>
+"""
+
+import contextvars
+import random
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from loguru import logger
+
+BENCHMARKS: Dict[str, Callable[[], None]] = {}
+
+
+def benchmark(func: Callable[[], None]) -> Callable[[], None]:
+    """
+    Registers the given function as a benchmark we can run from the command line.
+    """
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def generate_trades(n_trades: int, product_ids: List[str]) -> List[dict]:
+    """
+    Generates trades with the same format as the messages of the trade topic, 100 per
+    second and per product.
+    """
+    start_ms = 1_717_000_000_000
+    return [
+        {
+            'product_id': product_ids[i % len(product_ids)],
+            'price': 60_000 + random.random() * 1_000,
+            'volume': random.random(),
+            'timestamp_ms': start_ms + (i // len(product_ids)) * 10,
+            'side': random.choice(['buy', 'sell']),
+        }
+        for i in range(n_trades)
+    ]
+
+
+def run_pipeline(
+    trades: List[dict],
+    ohlc_window_seconds: int,
+    ohlc_aggregator: str,
+    commit_interval_sec: float = 5,
+) -> List[dict]:
+    """
+    Runs the trades through the same StreamingDataFrame as the service, and returns the
+    candles.
+
+    We skip Kafka: instead of consuming the messages, we call the dataframe on each of
+    them as `Application.run` does, and instead of checkpointing with Kafka we flush
+    the state transactions to RocksDB every `commit_interval_sec`.
+    """
+    from quixstreams import Application
+    from quixstreams.context import set_message_context
+    from quixstreams.models import MessageContext, MessageTimestamp, TimestampType
+
+    from src.main import aggregate_trades
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        app = Application(
+            broker_address='localhost:9092',
+            consumer_group='benchmark',
+            state_dir=state_dir,
+            use_changelog_topics=False,
+        )
+        topic = app.topic(name='trade', value_serializer='json')
+
+        candles = []
+        sdf = aggregate_trades(
+            app.dataframe(topic),
+            ohlc_window_seconds=ohlc_window_seconds,
+            ohlc_aggregator=ohlc_aggregator,
+        )
+        sdf = sdf.update(candles.append)
+        process = sdf.compose()[topic.name]
+
+        processing_context = app._processing_context
+        app._state_manager.on_partition_assign(
+            topic=topic.name, partition=0, committed_offset=-1001
+        )
+
+        def commit(offset: int) -> None:
+            checkpoint = processing_context.checkpoint
+            for transaction in checkpoint._store_transactions.values():
+                transaction.prepare(processed_offset=offset)
+                transaction.flush(processed_offset=offset)
+            processing_context.init_checkpoint()
+
+        processing_context.init_checkpoint()
+        committed_at = time.monotonic()
+        context = contextvars.copy_context()
+
+        for offset, trade in enumerate(trades):
+            message_context = MessageContext(
+                topic=topic.name,
+                partition=0,
+                offset=offset,
+                size=0,
+                timestamp=MessageTimestamp.create(
+                    TimestampType.TIMESTAMP_CREATE_TIME, trade['timestamp_ms']
+                ),
+                key=trade['product_id'].encode(),
+            )
+            context.run(set_message_context, message_context)
+            context.run(process, trade)
+
+            if time.monotonic() - committed_at >= commit_interval_sec:
+                commit(offset)
+                committed_at = time.monotonic()
+
+        commit(len(trades) - 1)
+        app._state_manager.close()
+
+    return candles
+
+
+@benchmark
+def aggregator(n_trades: int = 500_000, ohlc_window_seconds: int = 60) -> None:
+    """
+    Compares the `tumbling_window(...).reduce(...).final()` pipeline against the
+    CandleAggregator, from the trades to the candles of the output topic, with the
+    state in RocksDB as in the service.
+    """
+    trades = generate_trades(n_trades, product_ids=['BTC/USD', 'ETH/USD'])
+
+    timings = {}
+    candles = {}
+    for ohlc_aggregator in ['quix', 'native']:
+        start = time.perf_counter()
+        candles[ohlc_aggregator] = run_pipeline(
+            trades,
+            ohlc_window_seconds=ohlc_window_seconds,
+            ohlc_aggregator=ohlc_aggregator,
+        )
+        timings[ohlc_aggregator] = time.perf_counter() - start
+
+    assert candles['quix'] == candles['native'], 'The candles do not match'
+
+    logger.info(f'{len(candles["native"])} candles from {n_trades} trades')
+    for ohlc_aggregator, seconds in timings.items():
+        logger.info(f'{ohlc_aggregator}: {n_trades / seconds:,.0f} trades/sec')
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('name', choices=sorted(BENCHMARKS))
+    args = parser.parse_args()
+
+    BENCHMARKS[args.name]()
@@ -0,0 +1,391 @@
+import time
+from array import array
+from typing import Dict, List, Optional
+
+from quixstreams import State
+
+# the keys of the candles we write to the output topic
+CANDLE_KEYS = [
+    'timestamp',
+    'open',
+    'high',
+    'low',
+    'close',
+    'volume',
+    'vwap',
+    'trade_count',
+    'buy_volume',
+    'sell_volume',
+    'product_id',
+]
+
+
+class CandleAggregator:
+    """
+    Aggregates the trades into OHLC candles, as a replacement for the
+    `tumbling_window(...).reduce(...).final()` pipeline of Quix Streams.
+
+    The candle being built of each product lives in a fixed slot of a few arrays, and
+    every trade updates it in place. There is no new dict per trade, and no read nor
+    write of the state store per trade either: we only save the open candle in the
+    state of the product every `snapshot_interval_sec`, and when its window closes.
+    Quix Streams sends these snapshots to the changelog topic with the next
+    checkpoint, as for any other state update.
+
+    The candles we emit already have the format of the output topic:
+
+        {'timestamp': <end of the window>, 'open': ..., 'high': ..., 'low': ...,
+         'close': ..., 'volume': ..., 'vwap': ..., 'trade_count': ...,
+         'buy_volume': ..., 'sell_volume': ..., 'product_id': ...}
+
+    As with a tumbling window without grace period, a trade for a window that already
+    closed is dropped.
+
+    The price to pay is that, if the service crashes, the trades it processed since the
+    last snapshot are not in the open candle when it restarts. Their offsets may have
+    been committed, so they are not read again. That is up to `snapshot_interval_sec`
+    worth of trades, in the candle of the current window only.
+
+    The arrays are the source of truth while the service runs, so we assume a product
+    is not processed by another consumer in the meantime (e.g. after a rebalance that
+    took its partition away and gave it back).
+    """
+
+    def __init__(self, window_seconds: int, snapshot_interval_sec: float = 5) -> None:
+        """
+        Args:
+            window_seconds (int): The size of the tumbling windows.
+            snapshot_interval_sec (float): How often we save the open candle of a
+                product in its state, at most.
+
+        Returns:
+            None
+        """
+        self.window_ms = window_seconds * 1000
+        self.snapshot_interval_sec = snapshot_interval_sec
+
+        # the slot of each product in the arrays below
+        self._slots: Dict[str, int] = {}
+
+        # the candle being built of each product, -1 as start if there is none yet
+        self._start_ms = array('q')
+        self._open = array('d')
+        self._high = array('d')
+        self._low = array('d')
+        self._close = array('d')
+        self._volume = array('d')
+        # the sum of price times volume, from which we get the VWAP
+        self._notional = array('d')
+        self._trade_count = array('q')
+        self._buy_volume = array('d')
+        self._sell_volume = array('d')
+
+        # time.monotonic() of the last snapshot of each product
+        self._snapshot_at = array('d')
+
+    def __call__(self, trade: dict, state: State) -> List[dict]:
+        """
+        Adds the trade to the candle of its product, and returns the candle that closed
+        because of it, if any.
+
+        To pass to `sdf.apply(..., stateful=True, expand=True)`.
+        """
+        product_id = trade['product_id']
+        price = trade['price']
+        volume = trade['volume']
+        start_ms = trade['timestamp_ms'] - trade['timestamp_ms'] % self.window_ms
+
+        slot = self._slots.get(product_id)
+        if slot is None:
+            slot = self._add_slot(product_id, state)
+
+        current_start_ms = self._start_ms[slot]
+
+        if start_ms < current_start_ms:
+            # the window of this trade already closed
+            return []
+
+        closed_candles = []
+        is_new_window = start_ms > current_start_ms
+        if is_new_window:
+            closed_candles = self._close_window(product_id, slot, start_ms)
+            self._start_window(slot, start_ms)
+
+        if self._trade_count[slot] == 0:
+            # the first trade of the window
+            self._open[slot] = price
+            self._high[slot] = price
+            self._low[slot] = price
+        elif price > self._high[slot]:
+            self._high[slot] = price
+        elif price < self._low[slot]:
+            self._low[slot] = price
+        self._close[slot] = price
+        self._volume[slot] += volume
+        self._notional[slot] += price * volume
+        self._trade_count[slot] += 1
+        self._add_side_volume(slot, trade.get('side'), volume)
+
+        # we always save the candle of a new window, so that after a restart we do not
+        # emit the closed one again
+        if (
+            is_new_window
+            or time.monotonic() - self._snapshot_at[slot] >= self.snapshot_interval_sec
+        ):
+            self._snapshot(slot, state)
+
+        return closed_candles
+
+    def current_candle(self, product_id: str) -> Optional[dict]:
+        """
+        Returns the candle being built of the product, with the same format as the
+        ones we emit, or None if we have not seen a trade of the product yet.
+        """
+        slot = self._slots.get(product_id)
+        if slot is None or self._start_ms[slot] < 0:
+            return None
+        return self._to_candle(product_id, slot)
+
+    def _close_window(
+        self, product_id: str, slot: int, next_start_ms: int
+    ) -> List[dict]:
+        """
+        Returns the candles to emit because the product got a trade of the window that
+        starts at `next_start_ms`: the candle of the current window, if any.
+        """
+        if self._start_ms[slot] < 0:
+            return []
+        return [self._to_candle(product_id, slot)]
+
+    def _start_window(self, slot: int, start_ms: int) -> None:
+        """
+        Starts an empty candle in the slot, for the window that starts at `start_ms`.
+        Its prices are the close price of the previous candle, until it gets a trade.
+        """
+        self._start_ms[slot] = start_ms
+        self._open[slot] = self._close[slot]
+        self._high[slot] = self._close[slot]
+        self._low[slot] = self._close[slot]
+        self._volume[slot] = 0.0
+        self._notional[slot] = 0.0
+        self._trade_count[slot] = 0
+        self._buy_volume[slot] = 0.0
+        self._sell_volume[slot] = 0.0
+
+    def _add_side_volume(self, slot: int, side: Optional[str], volume: float) -> None:
+        """
+        Trades without a side (from producers older than the field) count towards
+        neither side.
+        """
+        if side == 'buy':
+            self._buy_volume[slot] += volume
+        elif side == 'sell':
+            self._sell_volume[slot] += volume
+
+    def _add_slot(self, product_id: str, state: State) -> int:
+        """
+        Adds a slot for the product, with the candle we saved in its state if any.
+        """
+        slot = len(self._start_ms)
+        self._slots[product_id] = slot
+
+        default = [-1, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0, 0.0, 0.0]
+        candle = state.get('candle', default)
+        # snapshots saved before we kept the volumes only have the prices, of at
+        # least one trade
+        candle = candle + [0.0, 0.0, 1, 0.0, 0.0][len(candle) - 5 :]
+
+        (
+            start_ms,
+            open_,
+            high,
+            low,
+            close,
+            volume,
+            notional,
+            trade_count,
+            buy_volume,
+            sell_volume,
+        ) = candle
+        self._start_ms.append(start_ms)
+        self._open.append(open_)
+        self._high.append(high)
+        self._low.append(low)
+        self._close.append(close)
+        self._volume.append(volume)
+        self._notional.append(notional)
+        self._trade_count.append(trade_count)
+        self._buy_volume.append(buy_volume)
+        self._sell_volume.append(sell_volume)
+        self._snapshot_at.append(time.monotonic())
+
+        return slot
+
+    def _snapshot(self, slot: int, state: State) -> None:
+        state.set(
+            'candle',
+            [
+                self._start_ms[slot],
+                self._open[slot],
+                self._high[slot],
+                self._low[slot],
+                self._close[slot],
+                self._volume[slot],
+                self._notional[slot],
+                self._trade_count[slot],
+                self._buy_volume[slot],
+                self._sell_volume[slot],
+            ],
+        )
+        self._snapshot_at[slot] = time.monotonic()
+
+    def _to_candle(self, product_id: str, slot: int) -> dict:
+        volume = self._volume[slot]
+        return {
+            'timestamp': self._start_ms[slot] + self.window_ms,
+            'open': self._open[slot],
+            'high': self._high[slot],
+            'low': self._low[slot],
+            'close': self._close[slot],
+            'volume': volume,
+            'vwap': self._notional[slot] / volume if volume > 0 else self._close[slot],
+            'trade_count': self._trade_count[slot],
+            'buy_volume': self._buy_volume[slot],
+            'sell_volume': self._sell_volume[slot],
+            'product_id': product_id,
+        }
+
+
+class WallClockCandleAggregator(CandleAggregator):
+    """
+    A CandleAggregator that closes the windows on a wall-clock deadline, and emits a
+    candle for every window, with or without trades.
+
+    With event time only, the window of a quiet product closes when its next trade
+    comes in, which can be minutes late, and a window without trades has no candle at
+    all. Here the window [start, end) of every product closes at `end + grace_ms` on
+    our clock, if no later trade of the product closed it before. A window without
+    trades gets a forward-filled candle: the close price of the previous candle as
+    open, high, low, close and VWAP, and no volume nor trades. So downstream consumers
+    get a dense series of candles, on time.
+
+    A trade of a later window still closes the window right away, as the trades of a
+    product come in timestamp order. `grace_ms` covers the time it takes a trade to
+    get from Kraken to us, and the skew between Kraken's clock and ours. A trade that
+    arrives after the deadline of its window is dropped.
+
+    Limitations:
+
+    - It is for live trades only. The trades of a historical replay are far behind
+      our clock, so they would all be dropped as late, after a forward-filled candle
+      for every window from the first trade up to now.
+    - Quix Streams only calls us when a message comes in, so the deadlines are
+      checked on every trade of the partition, of any product. If the whole topic
+      goes silent, no window closes until the next trade.
+    - We emit the candles of every product when their deadline passes, but we can
+      only save the state of the product of the current message. After a restart,
+      the last candle saved for a product is emitted again, with its forward-filled
+      successors up to its next trade. Candles are unique by (product_id, timestamp),
+      so the feature store keeps one of them. A product only gets candles again once
+      it has traded after the restart.
+    - The candles must be produced with their product_id as key, as they do not
+      belong to the product of the message that closed them.
+    """
+
+    def __init__(
+        self,
+        window_seconds: int,
+        grace_ms: int = 1000,
+        snapshot_interval_sec: float = 5,
+    ) -> None:
+        """
+        Args:
+            window_seconds (int): The size of the tumbling windows.
+            grace_ms (int): How long after the end of a window, on our clock, we
+                wait for its trades before closing it.
+            snapshot_interval_sec (float): How often we save the open candle of a
+                product in its state, at most.
+
+        Returns:
+            None
+        """
+        super().__init__(
+            window_seconds=window_seconds, snapshot_interval_sec=snapshot_interval_sec
+        )
+        self.grace_ms = grace_ms
+
+        # the earliest deadline of all the open windows, so we only go through the
+        # products when one of them is due
+        self._next_deadline_ms = float('inf')
+
+    def __call__(self, trade: dict, state: State) -> List[dict]:
+        """
+        Closes the windows whose deadline passed, of any product, and then adds the
+        trade to the candle of its product.
+
+        To pass to `sdf.apply(..., stateful=True, expand=True)`.
+        """
+        now_ms = time.time() * 1000
+        if now_ms < self._next_deadline_ms:
+            return super().__call__(trade, state)
+
+        return self._close_due_windows(now_ms) + super().__call__(trade, state)
+
+    def _close_due_windows(self, now_ms: float) -> List[dict]:
+        """
+        Returns the candles of all the windows whose deadline passed, forward-filling
+        the windows without trades, and starts the next window of each product.
+        """
+        candles = []
+        self._next_deadline_ms = float('inf')
+
+        for product_id, slot in self._slots.items():
+            if self._start_ms[slot] < 0:
+                continue
+
+            # the start of the first window whose deadline has not passed
+            next_start_ms = int(now_ms - self.grace_ms)
+            next_start_ms -= next_start_ms % self.window_ms
+            if self._start_ms[slot] < next_start_ms:
+                candles += self._close_window(product_id, slot, next_start_ms)
+                self._start_window(slot, next_start_ms)
+
+            self._next_deadline_ms = min(
+                self._next_deadline_ms, self._deadline_ms(slot)
+            )
+
+        return candles
+
+    def _close_window(
+        self, product_id: str, slot: int, next_start_ms: int
+    ) -> List[dict]:
+        """
+        Returns the candle of the current window and the forward-filled candles of the
+        windows without trades until `next_start_ms`.
+        """
+        if self._start_ms[slot] < 0:
+            return []
+
+        candles = [self._to_candle(product_id, slot)]
+        for start_ms in range(
+            self._start_ms[slot] + self.window_ms, next_start_ms, self.window_ms
+        ):
+            self._start_window(slot, start_ms)
+            candles.append(self._to_candle(product_id, slot))
+        return candles
+
+    def _add_slot(self, product_id: str, state: State) -> int:
+        slot = super()._add_slot(product_id, state)
+        if self._start_ms[slot] >= 0:
+            # the candle we saved before a restart
+            self._next_deadline_ms = min(
+                self._next_deadline_ms, self._deadline_ms(slot)
+            )
+        return slot
+
+    def _start_window(self, slot: int, start_ms: int) -> None:
+        super()._start_window(slot, start_ms)
+        self._next_deadline_ms = min(self._next_deadline_ms, self._deadline_ms(slot))
+
+    def _deadline_ms(self, slot: int) -> int:
+        return self._start_ms[slot] + self.window_ms + self.grace_ms
@@ -0,0 +1,93 @@
+from typing import Callable, List
+
+from quixstreams import State
+
+
+def cascade_candles(
+    fine_window_seconds: int, coarse_windows_seconds: List[int]
+) -> Callable[[dict, State], List[dict]]:
+    """
+    Returns the function we `apply` on the stream of the finest candles to derive the
+    coarser ones, instead of re-reducing the raw trades once per window size.
+
+    For each coarser window size we keep the candle being built in the state of the
+    product. Each finest candle is merged into it, and the coarser candle is emitted
+    when the finest candle that closes its window comes in. If that one has no trades
+    (so no candle), we emit it with the first finest candle of a later window.
+
+    Every candle we emit carries its `window_seconds`, so they can all go to the same
+    topic.
+
+    Args:
+        fine_window_seconds (int): The window size of the input candles.
+        coarse_windows_seconds (List[int]): The window sizes we derive, all multiples
+            of `fine_window_seconds`.
+
+    Returns:
+        Callable[[dict, State], List[dict]]: The function to pass to
+        `sdf.apply(..., stateful=True, expand=True)`.
+    """
+    fine_window_ms = fine_window_seconds * 1000
+
+    def cascade(candle: dict, state: State) -> List[dict]:
+        candles = [{**candle, 'window_seconds': fine_window_seconds}]
+
+        # `timestamp` is the end of the window of the candle
+        start_ms = candle['timestamp'] - fine_window_ms
+
+        for window_seconds in coarse_windows_seconds:
+            window_ms = window_seconds * 1000
+            state_key = f'candle_{window_seconds}s'
+            coarse_candle = state.get(state_key)
+
+            if coarse_candle is not None and coarse_candle['timestamp'] <= start_ms:
+                # the window of the coarse candle ended without a closing finest
+                # candle, so we emit it now
+                candles.append(coarse_candle)
+                coarse_candle = None
+
+            if coarse_candle is None:
+                coarse_candle = {
+                    'timestamp': start_ms - start_ms % window_ms + window_ms,
+                    'open': candle['open'],
+                    'high': candle['high'],
+                    'low': candle['low'],
+                    'close': candle['close'],
+                    'volume': candle['volume'],
+                    'vwap': candle['vwap'],
+                    'trade_count': candle['trade_count'],
+                    'buy_volume': candle['buy_volume'],
+                    'sell_volume': candle['sell_volume'],
+                    'product_id': candle['product_id'],
+                    'window_seconds': window_seconds,
+                }
+            else:
+                coarse_candle['high'] = max(coarse_candle['high'], candle['high'])
+                coarse_candle['low'] = min(coarse_candle['low'], candle['low'])
+                coarse_candle['close'] = candle['close']
+
+                # the VWAP of the merged candles is the average of their VWAPs,
+                # weighted by their volumes
+                volume = coarse_candle['volume'] + candle['volume']
+                if volume > 0:
+                    coarse_candle['vwap'] = (
+                        coarse_candle['vwap'] * coarse_candle['volume']
+                        + candle['vwap'] * candle['volume']
+                    ) / volume
+                else:
+                    coarse_candle['vwap'] = candle['close']
+                coarse_candle['volume'] = volume
+                coarse_candle['trade_count'] += candle['trade_count']
+                coarse_candle['buy_volume'] += candle['buy_volume']
+                coarse_candle['sell_volume'] += candle['sell_volume']
+
+            if coarse_candle['timestamp'] == candle['timestamp']:
+                # this finest candle closes the window of the coarse one
+                candles.append(coarse_candle)
+                state.delete(state_key)
+            else:
+                state.set(state_key, coarse_candle)
+
+        return candles
+
+    return cascade
@@ -1,5 +1,6 @@
-from typing import Optional
+from typing import List, Optional
 
+from pydantic import field_validator, model_validator
 from pydantic_settings import BaseSettings
 
 # load my .env file variables as environment variables so pydantic_settings can access them
@@ -15,7 +16,29 @@ class Config(BaseSettings):
         kafka_broker_address (str): The address of the Kafka broker.
         kafka_input_topic (str): The name of the Kafka topic where the trade data is read from.
         kafka_output_topic (str): The name of the Kafka topic where the OHLC data is written to.
+        live_or_historical (str): Whether the input topic has live trades, or
+            historical trades replayed much faster than they happened.
         ohlc_window_seconds (int): The window size in seconds for OHLC aggregation.
+        ohlc_windows_seconds (Optional[List[int]]): If given, the window sizes in
+            seconds of all the candles we generate in one pass. The smallest one is
+            aggregated from the trades and the others are cascaded from it, so they
+            must be multiples of it. Every candle then carries its `window_seconds`.
+        ohlc_aggregator (str): How we aggregate the trades into candles: 'quix' with
+            the windows of Quix Streams, or 'native' with our CandleAggregator.
+        state_snapshot_interval_sec (float): With the 'native' aggregator, how often we
+            save the open candle of each product in the state.
+        ohlc_close_windows_on (str): 'event_time' to close the window of a product when
+            its next trade comes in, or 'wall_clock' to close it `ohlc_grace_ms` after
+            its end on our clock, and emit forward-filled candles for the windows
+            without trades. 'wall_clock' needs the 'native' aggregator, a single
+            window size and live trades.
+        ohlc_grace_ms (int): With 'wall_clock', how long we wait for the trades of a
+            window after its end.
+        kafka_partial_output_topic (Optional[str]): If given, the Kafka topic where we
+            also write the candles being built, before their window closes. Needs the
+            'native' aggregator.
+        partial_candle_interval_ms (int): The minimum time between two partial
+            candles of the same product.
 
     Values are read from environment variables.
     If they are not found there, default values are used.
@@ -25,7 +48,76 @@ class Config(BaseSettings):
     kafka_input_topic: str
     kafka_output_topic: str
     kafka_consumer_group: str
+    live_or_historical: str = 'live'
     ohlc_window_seconds: int
+    ohlc_windows_seconds: Optional[List[int]] = None
+    ohlc_aggregator: str = 'quix'
+    state_snapshot_interval_sec: float = 5
+    ohlc_close_windows_on: str = 'event_time'
+    ohlc_grace_ms: int = 1000
+    kafka_partial_output_topic: Optional[str] = None
+    partial_candle_interval_ms: int = 500
+
+    @field_validator('ohlc_aggregator')
+    @classmethod
+    def validate_ohlc_aggregator(cls, value):
+        assert value in {
+            'quix',
+            'native',
+        }, f'Invalid value for ohlc_aggregator: {value}'
+        return value
+
+    @field_validator('live_or_historical')
+    @classmethod
+    def validate_live_or_historical(cls, value):
+        assert value in {
+            'live',
+            'historical',
+        }, f'Invalid value for live_or_historical: {value}'
+        return value
+
+    @field_validator('ohlc_close_windows_on')
+    @classmethod
+    def validate_ohlc_close_windows_on(cls, value):
+        assert value in {
+            'event_time',
+            'wall_clock',
+        }, f'Invalid value for ohlc_close_windows_on: {value}'
+        return value
+
+    @model_validator(mode='after')
+    def validate_ohlc_windows_seconds(self):
+        if self.ohlc_windows_seconds:
+            finest = min(self.ohlc_windows_seconds)
+            assert all(
+                window_seconds % finest == 0
+                for window_seconds in self.ohlc_windows_seconds
+            ), f'Window sizes must be multiples of {finest}: {self.ohlc_windows_seconds}'
+        return self
+
+    @model_validator(mode='after')
+    def validate_wall_clock(self):
+        if self.ohlc_close_windows_on == 'wall_clock':
+            assert (
+                self.ohlc_aggregator == 'native'
+            ), 'Closing windows on the wall clock needs OHLC_AGGREGATOR=native'
+            assert (
+                not self.ohlc_windows_seconds or len(self.ohlc_windows_seconds) == 1
+            ), 'Closing windows on the wall clock works with a single window size'
+            # the trades of a replay are hours or days behind our clock, so every
+            # window would be closed, and its trades dropped, before they come in
+            assert (
+                self.live_or_historical == 'live'
+            ), 'Closing windows on the wall clock needs live trades, not historical ones'
+        return self
+
+    @model_validator(mode='after')
+    def validate_partial_candles(self):
+        if self.kafka_partial_output_topic:
+            assert (
+                self.ohlc_aggregator == 'native'
+            ), 'Partial candles need OHLC_AGGREGATOR=native'
+        return self
 
 
 config = Config()
\ No newline at end of file
@@ -5,30 +5,50 @@ from typing import Any, List, Optional, Tuple
 # third-party packages
 from loguru import logger
 from quixstreams import Application
+from quixstreams.dataframe import StreamingDataFrame
+from quixstreams.kafka import Producer
+from quixstreams.models import Topic
 
 # your own local packages
-from src.config import config
+from src.candle_aggregator import (
+    CANDLE_KEYS,
+    CandleAggregator,
+    WallClockCandleAggregator,
+)
+from src.cascade import cascade_candles
+from src.partial_candles import PartialCandlePublisher
 
 def init_ohlc_candle(value: dict) -> dict:
     """
     Initialize the OHLC candle with the first trade
+
+    Besides the prices, the candle keeps the volume, the sum of price times volume
+    (`notional`, from which we get the VWAP when the window closes), the number of
+    trades and the volume of the trades on each side. Trades without a `side` (from
+    producers older than the field) count towards neither side.
     """
+    side = value.get('side')
     return {
         'open': value['price'],
         'high': value['price'],
         'low': value['price'],
         'close': value['price'],
         'product_id': value['product_id'],
-
-        # Uncomment this line if you plan to use `volume` in your feature engineering
-        # For you Olanrewaju!
-        # 'volume': value['volume']
+        'volume': value['volume'],
+        'notional': value['price'] * value['volume'],
+        'trade_count': 1,
+        'buy_volume': value['volume'] if side == 'buy' else 0.0,
+        'sell_volume': value['volume'] if side == 'sell' else 0.0,
     }
 
 def update_ohlc_candle(ohlc_candle: dict, trade: dict) -> dict:
     """
     Update the OHLC candle with the new trade and return the updated candle
 
+    Candles saved in the window state before we kept the volume aggregates only have
+    the prices, so their aggregates start from 0. Their `trade_count` then only counts
+    the trades since the upgrade.
+
     Args:
         ohlc_candle : dict : The current OHLC candle
         trade : dict : The incoming trade
@@ -42,12 +62,25 @@ def update_ohlc_candle(ohlc_candle: dict, trade: dict) -> dict:
         'low': min(ohlc_candle['low'], trade['price']),
         'close': trade['price'],
         'product_id': trade['product_id'],
-
-        # Uncomment this line if you plan to use `volume` in your feature engineering
-        # For you Olanrewaju!
-        # 'volume': ohlc_candle['volume'] + trade['volume']
+        'volume': ohlc_candle.get('volume', 0) + trade['volume'],
+        'notional': ohlc_candle.get('notional', 0) + trade['price'] * trade['volume'],
+        'trade_count': ohlc_candle.get('trade_count', 0) + 1,
+        'buy_volume': ohlc_candle.get('buy_volume', 0)
+        + (trade['volume'] if trade.get('side') == 'buy' else 0.0),
+        'sell_volume': ohlc_candle.get('sell_volume', 0)
+        + (trade['volume'] if trade.get('side') == 'sell' else 0.0),
     }
 
+
+def vwap(candle: dict) -> float:
+    """
+    Returns the volume weighted average price of the candle built by
+    `update_ohlc_candle`, or its close price if it has no volume.
+    """
+    if candle.get('volume', 0) > 0:
+        return candle['notional'] / candle['volume']
+    return candle['close']
+
 def custom_ts_extractor(
     value: Any,
     headers: Optional[List[Tuple[str, bytes]]],
@@ -67,49 +100,64 @@ def custom_ts_extractor(
     return value['timestamp_ms']
 
 
-def trade_to_ohlc(
-    kafka_input_topic: str,
-    kafka_output_topic: str,
-    kafka_broker_address: str,
-    kafka_consumer_group: str,
+def aggregate_trades(
+    sdf: StreamingDataFrame,
     ohlc_window_seconds: int,
-) -> None:
+    ohlc_aggregator: str = 'quix',
+    state_snapshot_interval_sec: float = 5,
+    ohlc_close_windows_on: str = 'event_time',
+    ohlc_grace_ms: int = 1000,
+    partial_candle_producer: Optional[Producer] = None,
+    partial_candle_topic: Optional[Topic] = None,
+    partial_candle_interval_ms: int = 500,
+) -> StreamingDataFrame:
     """
-    Reads trades from the kafka input topic
-    Aggregates them into OHLC candles using the specified window in `ohlc_window_seconds`
-    Saves the ohlc data into another kafka topic
+    Aggregates the trades of the given streaming dataframe into OHLC candles, with the
+    format of the output topic.
 
     Args:
-        kafka_input_topic : str : Kafka topic to read trade data from
-        kafka_output_topic : str : Kafka topic to write ohlc data to
-        kafka_broker_address : str : Kafka broker address
-        kafka_consumer_group : str : Kafka consumer group
+        sdf : StreamingDataFrame : The trades
         ohlc_window_seconds : int : Window size in seconds for OHLC aggregation
+        ohlc_aggregator : str : 'quix' to use the tumbling windows of Quix Streams, or
+            'native' to use our CandleAggregator, which updates the candles in place
+            and saves them in the state every `state_snapshot_interval_sec` only.
+        state_snapshot_interval_sec : float : See `ohlc_aggregator`
+        ohlc_close_windows_on : str : 'event_time', or 'wall_clock' to close the
+            windows `ohlc_grace_ms` after their end on our clock and emit a candle
+            for every window, with the 'native' aggregator only.
+        ohlc_grace_ms : int : See `ohlc_close_windows_on`
+        partial_candle_producer : Optional[Producer] : With the 'native' aggregator,
+            the producer of the candles being built, if we publish them
+        partial_candle_topic : Optional[Topic] : The topic of the candles being built
+        partial_candle_interval_ms : int : The minimum time between two candles being
+            built of the same product
 
     Returns:
-        None
+        StreamingDataFrame : The candles
     """
-    # this handles all low level communication with kafka
-    app = Application(
-        broker_address=kafka_broker_address,
-        consumer_group=kafka_consumer_group,
-        auto_offset_reset='latest',
-    )
+    if ohlc_close_windows_on == 'wall_clock' or ohlc_aggregator == 'native':
+        if ohlc_close_windows_on == 'wall_clock':
+            aggregator = WallClockCandleAggregator(
+                window_seconds=ohlc_window_seconds,
+                grace_ms=ohlc_grace_ms,
+                snapshot_interval_sec=state_snapshot_interval_sec,
+            )
+        else:
+            aggregator = CandleAggregator(
+                window_seconds=ohlc_window_seconds,
+                snapshot_interval_sec=state_snapshot_interval_sec,
+            )
 
-    # specify input and output topics for this application
-    input_topic = app.topic(
-        name=kafka_input_topic,
-        value_serializer='json',
-        timestamp_extractor=custom_ts_extractor,
-    )
-    output_topic = app.topic(name=kafka_output_topic, value_serializer='json')
+        if partial_candle_topic is not None:
+            aggregator = PartialCandlePublisher(
+                aggregator,
+                producer=partial_candle_producer,
+                topic=partial_candle_topic,
+                min_interval_ms=partial_candle_interval_ms,
+            )
 
-    # creating a streaming dataframe
-    # to apply transformations on the incoming data
-    sdf = app.dataframe(input_topic)
+        return sdf.apply(aggregator, stateful=True, expand=True)
 
-    # apply tranformations to the incoming data - start
-    # Here we need to define how we transform the incoming trades into OHLC candles
     sdf = sdf.tumbling_window(duration_ms=timedelta(seconds=ohlc_window_seconds))
     sdf = sdf.reduce(reducer=update_ohlc_candle, initializer=init_ohlc_candle).final()
 
@@ -128,6 +176,11 @@ def trade_to_ohlc(
     #     'high': 3537.11,
     #     'low': 3535.98,
     #     'close': 3537.11,
+    #     'volume': 1.25,
+    #     'vwap': 3536.42,
+    #     'trade_count': 12,
+    #     'buy_volume': 0.75,
+    #     'sell_volume': 0.5,
     #     'product_id': 'ETH/USD',
     # }
 
@@ -138,28 +191,136 @@ def trade_to_ohlc(
     sdf['close'] = sdf['value']['close']
     sdf['product_id'] = sdf['value']['product_id']
 
-    # adding the volume key if you plan to use it generate features that depend on it
-    # For you Olanrewaju!
-    # sdf['volume'] = sdf['value']['volume']
+    # and the volume aggregates, computed in the same pass as the prices. A window
+    # with no trade since the upgrade has none, see `update_ohlc_candle`
+    sdf['volume'] = sdf['value'].apply(lambda candle: candle.get('volume', 0))
+    sdf['vwap'] = sdf['value'].apply(vwap)
+    sdf['trade_count'] = sdf['value'].apply(lambda candle: candle.get('trade_count', 0))
+    sdf['buy_volume'] = sdf['value'].apply(lambda candle: candle.get('buy_volume', 0))
+    sdf['sell_volume'] = sdf['value'].apply(lambda candle: candle.get('sell_volume', 0))
 
     # adding a timestamp key
     sdf['timestamp'] = sdf['end']
 
     # let's keep only the keys we want in our final message
-    # don't forget to add the volume key if you plan to use it
-    sdf = sdf[['timestamp', 'open', 'high', 'low', 'close', 'product_id']]
+    return sdf[CANDLE_KEYS]
+
+
+def trade_to_ohlc(
+    kafka_input_topic: str,
+    kafka_output_topic: str,
+    kafka_broker_address: str,
+    kafka_consumer_group: str,
+    ohlc_window_seconds: int,
+    ohlc_windows_seconds: Optional[List[int]] = None,
+    ohlc_aggregator: str = 'quix',
+    state_snapshot_interval_sec: float = 5,
+    ohlc_close_windows_on: str = 'event_time',
+    ohlc_grace_ms: int = 1000,
+    kafka_partial_output_topic: Optional[str] = None,
+    partial_candle_interval_ms: int = 500,
+) -> None:
+    """
+    Reads trades from the kafka input topic
+    Aggregates them into OHLC candles using the specified window in `ohlc_window_seconds`
+    Saves the ohlc data into another kafka topic
+
+    Args:
+        kafka_input_topic : str : Kafka topic to read trade data from
+        kafka_output_topic : str : Kafka topic to write ohlc data to
+        kafka_broker_address : str : Kafka broker address
+        kafka_consumer_group : str : Kafka consumer group
+        ohlc_window_seconds : int : Window size in seconds for OHLC aggregation
+        ohlc_windows_seconds : Optional[List[int]] : If given, the window sizes of all
+            the candles we generate. The coarser ones are cascaded from the finest one,
+            and every candle carries its `window_seconds`.
+        ohlc_aggregator : str : 'quix' or 'native', see `aggregate_trades`
+        state_snapshot_interval_sec : float : With the 'native' aggregator, how often
+            we save the open candle of each product in the state
+        ohlc_close_windows_on : str : 'event_time' or 'wall_clock', see
+            `aggregate_trades`
+        ohlc_grace_ms : int : With 'wall_clock', how long after the end of a window
+            we wait for its trades
+        kafka_partial_output_topic : Optional[str] : If given, Kafka topic to write
+            the candles being built to, at most once per product every
+            `partial_candle_interval_ms`. Needs the 'native' aggregator.
+        partial_candle_interval_ms : int : See `kafka_partial_output_topic`
+
+    Returns:
+        None
+    """
+    # this handles all low level communication with kafka
+    app = Application(
+        broker_address=kafka_broker_address,
+        consumer_group=kafka_consumer_group,
+        auto_offset_reset='latest',
+    )
+
+    # specify input and output topics for this application
+    input_topic = app.topic(
+        name=kafka_input_topic,
+        value_serializer='json',
+        timestamp_extractor=custom_ts_extractor,
+    )
+    output_topic = app.topic(name=kafka_output_topic, value_serializer='json')
+
+    # the candles being built go to their own topic, with their own producer, as a
+    # StreamingDataFrame can only write its output to one topic per message
+    partial_candle_topic = None
+    partial_candle_producer = None
+    if kafka_partial_output_topic:
+        partial_candle_topic = app.topic(
+            name=kafka_partial_output_topic, value_serializer='json'
+        )
+        partial_candle_producer = app.get_producer()
+
+    # with several window sizes, we aggregate the trades into the finest candles only
+    if ohlc_windows_seconds:
+        ohlc_windows_seconds = sorted(set(ohlc_windows_seconds))
+        ohlc_window_seconds = ohlc_windows_seconds[0]
+
+    # creating a streaming dataframe
+    # to apply transformations on the incoming data
+    sdf = app.dataframe(input_topic)
+
+    # apply tranformations to the incoming data - start
+    # Here we need to define how we transform the incoming trades into OHLC candles
+    sdf = aggregate_trades(
+        sdf,
+        ohlc_window_seconds=ohlc_window_seconds,
+        ohlc_aggregator=ohlc_aggregator,
+        state_snapshot_interval_sec=state_snapshot_interval_sec,
+        ohlc_close_windows_on=ohlc_close_windows_on,
+        ohlc_grace_ms=ohlc_grace_ms,
+        partial_candle_producer=partial_candle_producer,
+        partial_candle_topic=partial_candle_topic,
+        partial_candle_interval_ms=partial_candle_interval_ms,
+    )
+
+    # the coarser candles are derived from the finest ones, in the same pass
+    if ohlc_windows_seconds and len(ohlc_windows_seconds) > 1:
+        sdf = sdf.apply(
+            cascade_candles(ohlc_window_seconds, ohlc_windows_seconds[1:]),
+            stateful=True,
+            expand=True,
+        )
 
     # apply tranformations to the incoming data - end
 
     # let's print the data to the logs
     sdf = sdf.update(logger.info)
 
-    # write the data to the output topic
-    sdf = sdf.to_topic(output_topic)
+    # write the data to the output topic, with the product_id as key. Candles closed
+    # on the wall clock do not belong to the product of the trade that closed them
+    sdf = sdf.to_topic(output_topic, key=lambda candle: candle['product_id'].encode())
 
     # We are done defining the streaming application. Now we need to run it.
     # Let's kick-off the streaming application
-    app.run(sdf)
+    try:
+        app.run(sdf)
+    finally:
+        if partial_candle_producer is not None:
+            partial_candle_producer.flush()
 
 
 if __name__ == '__main__':
@@ -171,4 +332,11 @@ if __name__ == '__main__':
         kafka_broker_address=config.kafka_broker_address,
         kafka_consumer_group=config.kafka_consumer_group,
         ohlc_window_seconds=config.ohlc_window_seconds,
+        ohlc_windows_seconds=config.ohlc_windows_seconds,
+        ohlc_aggregator=config.ohlc_aggregator,
+        state_snapshot_interval_sec=config.state_snapshot_interval_sec,
+        ohlc_close_windows_on=config.ohlc_close_windows_on,
+        ohlc_grace_ms=config.ohlc_grace_ms,
+        kafka_partial_output_topic=config.kafka_partial_output_topic,
+        partial_candle_interval_ms=config.partial_candle_interval_ms,
     )
\ No newline at end of file
@@ -0,0 +1,131 @@
+import time
+from typing import Dict, List, Set
+
+from loguru import logger
+from quixstreams import State
+from quixstreams.kafka import Producer
+from quixstreams.models import Topic
+
+from src.candle_aggregator import CandleAggregator
+
+
+class PartialCandlePublisher:
+    """
+    Wraps a CandleAggregator to also publish the candle being built of each product
+    to a second topic, like the `.current()` of a Quix Streams window, so live views
+    do not have to wait for the window to close.
+
+    We publish at most one partial candle per product every `min_interval_ms`. The
+    first trade after a quiet period publishes right away. The trades that come in
+    before the interval is over are coalesced: once it is over we publish the latest
+    state of the candle, once, instead of one message per trade.
+
+    As Quix Streams only calls us when a message comes in, the coalesced updates go
+    out with the first trade of the partition, of any product, after their interval
+    is over.
+
+    The partial candles are produced with their own producer, outside of the
+    checkpoints of the Application. They are best-effort: a partial candle lost in
+    a crash is superseded by the next one, and by the final candle anyway.
+    """
+
+    def __init__(
+        self,
+        aggregator: CandleAggregator,
+        producer: Producer,
+        topic: Topic,
+        min_interval_ms: int = 500,
+        log_stats_every_sec: int = 60,
+    ) -> None:
+        """
+        Args:
+            aggregator (CandleAggregator): The aggregator whose candles we publish.
+            producer (Producer): The producer of the partial candles.
+            topic (Topic): The topic of the partial candles.
+            min_interval_ms (int): The minimum time between two partial candles of the
+                same product.
+            log_stats_every_sec (int): How often we log how many trades we coalesced.
+
+        Returns:
+            None
+        """
+        self.aggregator = aggregator
+        self.producer = producer
+        self.topic = topic
+        self.min_interval_sec = min_interval_ms / 1000
+        self.log_stats_every_sec = log_stats_every_sec
+
+        # time.monotonic() of the last partial candle of each product
+        self._sent_at: Dict[str, float] = {}
+
+        # products with trades not published yet, and the earliest time we can
+        # publish one of them
+        self._pending: Set[str] = set()
+        self._next_due = float('inf')
+
+        self._n_trades = 0
+        self._n_sent = 0
+        self._last_stats_at = time.monotonic()
+
+    def __call__(self, trade: dict, state: State) -> List[dict]:
+        """
+        Adds the trade to the aggregator, publishes the partial candles that are due,
+        and returns the closed candles of the aggregator.
+
+        To pass to `sdf.apply(..., stateful=True, expand=True)`.
+        """
+        candles = self.aggregator(trade, state)
+        self._n_trades += 1
+
+        now = time.monotonic()
+        product_id = trade['product_id']
+        sent_at = self._sent_at.get(product_id, float('-inf'))
+        if now - sent_at >= self.min_interval_sec:
+            self._publish(product_id, now)
+        else:
+            self._pending.add(product_id)
+            self._next_due = min(self._next_due, sent_at + self.min_interval_sec)
+
+        if now >= self._next_due:
+            self._publish_due(now)
+
+        if now - self._last_stats_at >= self.log_stats_every_sec:
+            self._log_stats(now)
+
+        return candles
+
+    def _publish_due(self, now: float) -> None:
+        """
+        Publishes the latest partial candle of the pending products whose interval is
+        over.
+        """
+        self._next_due = float('inf')
+        for product_id in list(self._pending):
+            due = self._sent_at[product_id] + self.min_interval_sec
+            if now >= due:
+                self._publish(product_id, now)
+            else:
+                self._next_due = min(self._next_due, due)
+
+    def _publish(self, product_id: str, now: float) -> None:
+        candle = self.aggregator.current_candle(product_id)
+        self._pending.discard(product_id)
+        if candle is None:
+            # the trade was dropped, for a window that already closed
+            return
+
+        message = self.topic.serialize(key=product_id.encode(), value=candle)
+        self.producer.produce(
+            topic=self.topic.name, key=message.key, value=message.value
+        )
+        self._sent_at[product_id] = now
+        self._n_sent += 1
+
+    def _log_stats(self, now: float) -> None:
+        logger.info(
+            f'Published {self._n_sent} partial candles for {self._n_trades} trades '
+            f'in the last {now - self._last_stats_at:.0f} seconds'
+        )
+        self._n_trades = 0
+        self._n_sent = 0
+        self._last_stats_at = now
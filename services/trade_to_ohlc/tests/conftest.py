@@ -0,0 +1,25 @@
+import pytest
+
+
+class FakeState(dict):
+    """
+    A stand-in for the State of a key in Quix Streams, with the methods the
+    aggregators and the cascade use.
+    """
+
+    def set(self, key, value):
+        self[key] = value
+
+    def delete(self, key):
+        self.pop(key, None)
+
+
+@pytest.fixture
+def make_state():
+    """Creates a state, e.g. one per product."""
+    return FakeState
+
+
+@pytest.fixture
+def state(make_state) -> FakeState:
+    return make_state()
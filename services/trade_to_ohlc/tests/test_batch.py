@@ -0,0 +1,161 @@
+import math
+import random
+from typing import Dict, Iterable, List
+
+import pandas as pd
+import pytest
+
+from src.batch import trades_to_candles
+from src.candle_aggregator import CANDLE_KEYS
+from src.main import init_ohlc_candle, update_ohlc_candle, vwap
+
+WINDOW_SECONDS = 60
+WINDOW_MS = WINDOW_SECONDS * 1000
+START_MS = 1_717_000_000_000 - 1_717_000_000_000 % WINDOW_MS
+
+
+def stream_candles(trades: Iterable[dict], window_seconds: int) -> List[dict]:
+    """
+    Aggregates the trades one by one with `init_ohlc_candle` and `update_ohlc_candle`,
+    the reducer of the streaming service, and the same window semantics as
+    `trades_to_candles`.
+    """
+    window_ms = window_seconds * 1000
+
+    # product_id -> (start of the window, candle of the reducer)
+    open_candles: Dict[str, tuple] = {}
+    candles = []
+
+    def to_output(start_ms: int, candle: dict) -> dict:
+        # the same unpacking as in `aggregate_trades`
+        output = {**candle, 'timestamp': start_ms + window_ms, 'vwap': vwap(candle)}
+        return {key: output[key] for key in CANDLE_KEYS}
+
+    for trade in trades:
+        start_ms = trade['timestamp_ms'] - trade['timestamp_ms'] % window_ms
+        current = open_candles.get(trade['product_id'])
+
+        if current is None or start_ms > current[0]:
+            if current is not None:
+                candles.append(to_output(*current))
+            open_candles[trade['product_id']] = (start_ms, init_ohlc_candle(trade))
+        elif start_ms == current[0]:
+            open_candles[trade['product_id']] = (
+                start_ms,
+                update_ohlc_candle(current[1], trade),
+            )
+
+    candles += [to_output(*current) for current in open_candles.values()]
+    return candles
+
+
+def batch_candles(trades: pd.DataFrame, chunk_size: int) -> List[dict]:
+    chunks = (
+        trades.iloc[i : i + chunk_size] for i in range(0, len(trades), chunk_size)
+    )
+    return pd.concat(trades_to_candles(chunks, WINDOW_SECONDS)).to_dict('records')
+
+
+def assert_same_candles(batch: List[dict], stream: List[dict]) -> None:
+    """
+    Prices, counts and timestamps must be equal. The sums may differ in the last
+    digits, as pandas adds the floats in a different order.
+    """
+    # both paths emit the candles of each product in the same order
+    batch = sorted(
+        batch, key=lambda candle: (candle['product_id'], candle['timestamp'])
+    )
+    stream = sorted(
+        stream, key=lambda candle: (candle['product_id'], candle['timestamp'])
+    )
+
+    assert len(batch) == len(stream)
+    for batch_candle, stream_candle in zip(batch, stream):
+        for key in CANDLE_KEYS:
+            if key in {'volume', 'vwap', 'buy_volume', 'sell_volume'}:
+                assert math.isclose(
+                    batch_candle[key], stream_candle[key], rel_tol=1e-9, abs_tol=1e-9
+                ), f'{key} differs: {batch_candle} vs {stream_candle}'
+            else:
+                assert batch_candle[key] == stream_candle[key], (
+                    f'{key} differs: {batch_candle} vs {stream_candle}'
+                )
+
+
+def random_trades(n_trades: int, seed: int) -> pd.DataFrame:
+    """
+    ~100 trades per second of a few products, with 1% of them a few seconds late.
+    """
+    rng = random.Random(seed)
+    product_ids = ['BTC/USD', 'ETH/USD', 'SOL/USD']
+    return pd.DataFrame(
+        {
+            'product_id': [rng.choice(product_ids) for _ in range(n_trades)],
+            'price': [60_000 + rng.random() * 1_000 for _ in range(n_trades)],
+            'volume': [rng.random() for _ in range(n_trades)],
+            'timestamp_ms': [
+                START_MS + i * 10 - (rng.randint(0, 5_000) if i % 100 == 0 else 0)
+                for i in range(n_trades)
+            ],
+            'side': [rng.choice(['buy', 'sell', None]) for _ in range(n_trades)],
+        }
+    )
+
+
+@pytest.mark.parametrize('chunk_size', [250, 997, 5_000])
+def test_matches_the_reducer_on_random_trades(chunk_size):
+    trades = random_trades(n_trades=5_000, seed=chunk_size)
+
+    assert_same_candles(
+        batch_candles(trades, chunk_size),
+        stream_candles(trades.to_dict('records'), WINDOW_SECONDS),
+    )
+
+
+def trade(product_id: str, window: int, offset_ms: int, price: float) -> dict:
+    return {
+        'product_id': product_id,
+        'price': price,
+        'volume': 1.0,
+        'timestamp_ms': START_MS + window * WINDOW_MS + offset_ms,
+        'side': 'buy',
+    }
+
+
+def test_drops_late_trades_across_a_chunk_boundary():
+    trades = pd.DataFrame(
+        [
+            # chunk 1: BTC/USD moves to window 1, ETH/USD stays in window 0
+            trade('BTC/USD', 0, 100, 1.0),
+            trade('ETH/USD', 0, 200, 10.0),
+            trade('BTC/USD', 1, 100, 2.0),
+            # chunk 2: a late BTC/USD trade of the closed window 0, then trades of
+            # the windows still open at the end of chunk 1
+            trade('BTC/USD', 0, 50_000, 100.0),
+            trade('BTC/USD', 1, 200, 3.0),
+            trade('ETH/USD', 0, 300, 20.0),
+            # chunk 3: a late BTC/USD trade of window 1, once window 2 started
+            trade('BTC/USD', 2, 100, 4.0),
+            trade('BTC/USD', 1, 59_000, 100.0),
+        ]
+    )
+
+    candles = batch_candles(trades, chunk_size=3)
+
+    assert_same_candles(candles, stream_candles(trades.to_dict('records'), 60))
+    by_window = {
+        (candle['product_id'], candle['timestamp']): candle for candle in candles
+    }
+    assert sorted(by_window) == [
+        ('BTC/USD', START_MS + WINDOW_MS),
+        ('BTC/USD', START_MS + 2 * WINDOW_MS),
+        ('BTC/USD', START_MS + 3 * WINDOW_MS),
+        ('ETH/USD', START_MS + WINDOW_MS),
+    ]
+    # the late trades, at a price of 100, made it into no candle
+    assert max(candle['high'] for candle in candles) == 20.0
+    btc_window_1 = by_window[('BTC/USD', START_MS + 2 * WINDOW_MS)]
+    assert (btc_window_1['open'], btc_window_1['close']) == (2.0, 3.0)
+    assert btc_window_1['trade_count'] == 2
+    eth_window_0 = by_window[('ETH/USD', START_MS + WINDOW_MS)]
+    assert (eth_window_0['open'], eth_window_0['close']) == (10.0, 20.0)
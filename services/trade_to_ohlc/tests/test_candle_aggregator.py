@@ -0,0 +1,164 @@
+import time
+
+import pytest
+
+from src.candle_aggregator import CandleAggregator, WallClockCandleAggregator
+
+WINDOW_MS = 60_000
+START_MS = 1_717_000_020_000 - 1_717_000_020_000 % WINDOW_MS
+
+
+def trade(window: int, offset_ms: int, price: float, product_id='BTC/USD') -> dict:
+    return {
+        'product_id': product_id,
+        'price': price,
+        'volume': 1.0,
+        'timestamp_ms': START_MS + window * WINDOW_MS + offset_ms,
+        'side': 'buy',
+    }
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """The wall clock, in milliseconds, for the WallClockCandleAggregator."""
+    now_ms = [START_MS]
+    monkeypatch.setattr(time, 'time', lambda: now_ms[0] / 1000)
+    return now_ms
+
+
+def test_closes_a_window_with_the_first_trade_of_the_next_one(state):
+    aggregator = CandleAggregator(window_seconds=60)
+
+    assert aggregator(trade(0, 100, 10.0), state) == []
+    assert aggregator(trade(0, 200, 12.0), state) == []
+    assert aggregator(trade(0, 300, 9.0), state) == []
+    # late, as window 0 closes before it
+    candles = aggregator(trade(1, 100, 11.0), state)
+    assert aggregator(trade(0, 400, 100.0), state) == []
+
+    assert candles == [
+        {
+            'timestamp': START_MS + WINDOW_MS,
+            'open': 10.0,
+            'high': 12.0,
+            'low': 9.0,
+            'close': 9.0,
+            'volume': 3.0,
+            'vwap': pytest.approx(31.0 / 3),
+            'trade_count': 3,
+            'buy_volume': 3.0,
+            'sell_volume': 0.0,
+            'product_id': 'BTC/USD',
+        }
+    ]
+    assert aggregator.current_candle('BTC/USD')['open'] == 11.0
+
+
+def test_resumes_the_open_candle_after_a_restart(state):
+    aggregator = CandleAggregator(window_seconds=60)
+    aggregator(trade(0, 100, 10.0), state)
+    aggregator(trade(1, 100, 11.0), state)
+    aggregator(trade(1, 200, 13.0), state)
+    # saved with the next snapshot
+    aggregator._snapshot(aggregator._slots['BTC/USD'], state)
+
+    restarted = CandleAggregator(window_seconds=60)
+    # the closed window 0 is not emitted again
+    assert restarted(trade(1, 300, 12.0), state) == []
+    candles = restarted(trade(2, 100, 14.0), state)
+
+    assert [candle['timestamp'] for candle in candles] == [START_MS + 2 * WINDOW_MS]
+    assert (candles[0]['open'], candles[0]['high'], candles[0]['close']) == (
+        11.0,
+        13.0,
+        12.0,
+    )
+    assert candles[0]['trade_count'] == 3
+
+
+def test_resumes_a_snapshot_saved_before_we_kept_the_volumes(make_state):
+    state = make_state(candle=[START_MS, 10.0, 12.0, 9.0, 11.0])
+    aggregator = CandleAggregator(window_seconds=60)
+
+    candles = aggregator(trade(1, 100, 11.0), state)
+
+    assert candles[0]['close'] == 11.0
+    assert (candles[0]['volume'], candles[0]['trade_count']) == (0.0, 1)
+
+
+def test_wall_clock_waits_for_the_grace_period(clock, state, make_state):
+    aggregator = WallClockCandleAggregator(window_seconds=60, grace_ms=1_000)
+    aggregator(trade(0, 100, 10.0), state)
+
+    # a trade of another product, right before the deadline of window 0
+    clock[0] = START_MS + WINDOW_MS + 999
+    assert aggregator(trade(0, 59_000, 50.0, 'ETH/USD'), make_state()) == []
+    # a trade of window 0 that made it within the grace period
+    assert aggregator(trade(0, 59_500, 12.0), state) == []
+
+    clock[0] = START_MS + WINDOW_MS + 1_000
+    candles = aggregator(trade(1, 500, 51.0, 'ETH/USD'), make_state())
+
+    assert [(candle['product_id'], candle['close']) for candle in candles] == [
+        ('BTC/USD', 12.0),
+        ('ETH/USD', 50.0),
+    ]
+    # too late for window 0, which already closed
+    assert aggregator(trade(0, 59_900, 100.0), state) == []
+    assert aggregator.current_candle('BTC/USD')['trade_count'] == 0
+
+
+def test_wall_clock_forward_fills_the_windows_without_trades(clock, state, make_state):
+    aggregator = WallClockCandleAggregator(window_seconds=60, grace_ms=1_000)
+    aggregator(trade(0, 100, 10.0), state)
+    aggregator(trade(0, 200, 11.0), state)
+
+    # window 3 is open, and the deadlines of windows 0 to 2 passed
+    clock[0] = START_MS + 3 * WINDOW_MS + 1_000
+    candles = aggregator(trade(3, 900, 50.0, 'ETH/USD'), make_state())
+
+    assert [candle['timestamp'] for candle in candles] == [
+        START_MS + WINDOW_MS,
+        START_MS + 2 * WINDOW_MS,
+        START_MS + 3 * WINDOW_MS,
+    ]
+    assert candles[0]['trade_count'] == 2
+    for candle in candles[1:]:
+        assert (candle['open'], candle['high'], candle['low'], candle['close']) == (
+            11.0,
+            11.0,
+            11.0,
+            11.0,
+        )
+        assert (candle['volume'], candle['vwap'], candle['trade_count']) == (
+            0.0,
+            11.0,
+            0,
+        )
+
+    # a trade of a later window fills the gap right away, before its deadline
+    candles = aggregator(trade(5, 100, 12.0), state)
+
+    assert [candle['timestamp'] for candle in candles] == [
+        START_MS + 4 * WINDOW_MS,
+        START_MS + 5 * WINDOW_MS,
+    ]
+    assert [candle['trade_count'] for candle in candles] == [0, 0]
+
+
+def test_wall_clock_closes_the_window_saved_before_a_restart(clock, state, make_state):
+    aggregator = WallClockCandleAggregator(window_seconds=60, grace_ms=1_000)
+    aggregator(trade(0, 100, 10.0), state)
+
+    # the product has no trade after the restart, but the deadline of the window we
+    # saved for it passes
+    restarted = WallClockCandleAggregator(window_seconds=60, grace_ms=1_000)
+    restarted(trade(0, 200, 10.5), state)
+    clock[0] = START_MS + 2 * WINDOW_MS + 1_000
+    candles = restarted(trade(2, 100, 50.0, 'ETH/USD'), make_state())
+
+    assert [(candle['product_id'], candle['timestamp']) for candle in candles] == [
+        ('BTC/USD', START_MS + WINDOW_MS),
+        ('BTC/USD', START_MS + 2 * WINDOW_MS),
+    ]
+    assert [candle['trade_count'] for candle in candles] == [2, 0]
@@ -0,0 +1,177 @@
+import math
+import random
+from typing import Dict, List
+
+import pandas as pd
+import pytest
+
+from src.batch import aggregate_candles
+from src.candle_aggregator import CANDLE_KEYS
+from src.cascade import cascade_candles
+
+FINE_WINDOW_MS = 60_000
+START_MS = 1_717_000_000_000 - 1_717_000_000_000 % 3_600_000
+
+
+def random_trades(n_minutes: int, seed: int) -> pd.DataFrame:
+    """
+    Trades of 2 products over `n_minutes`, with gaps: minutes without trades, some
+    of them the last minute of a 5-minute window, and whole 5-minute windows without
+    trades.
+    """
+    rng = random.Random(seed)
+    trades = []
+    for minute in range(n_minutes):
+        for product_id in ['BTC/USD', 'ETH/USD']:
+            if rng.random() < 0.3 or minute // 5 % 7 == 3:
+                continue
+            for _ in range(rng.randint(1, 5)):
+                trades.append(
+                    {
+                        'product_id': product_id,
+                        'price': 60_000 + rng.random() * 1_000,
+                        'volume': rng.random(),
+                        'timestamp_ms': START_MS
+                        + minute * FINE_WINDOW_MS
+                        + rng.randint(0, FINE_WINDOW_MS - 1),
+                        'side': rng.choice(['buy', 'sell']),
+                    }
+                )
+    return pd.DataFrame(trades).sort_values('timestamp_ms', kind='stable')
+
+
+def cascade_all(fine_candles: List[dict], make_state, coarse_windows_seconds):
+    """
+    Runs the finest candles through the cascade in timestamp order, with the state of
+    their product, as Quix Streams does with the state of the message key.
+    """
+    cascade = cascade_candles(60, coarse_windows_seconds)
+    states: Dict[str, dict] = {}
+    candles = []
+    for candle in sorted(fine_candles, key=lambda candle: candle['timestamp']):
+        state = states.setdefault(candle['product_id'], make_state())
+        candles += cascade(candle, state)
+    return candles
+
+
+def assert_same_candles(actual: List[dict], expected: List[dict]) -> None:
+    assert len(actual) == len(expected)
+    for actual_candle, expected_candle in zip(actual, expected):
+        for key in CANDLE_KEYS:
+            if key in {'volume', 'vwap', 'buy_volume', 'sell_volume'}:
+                assert math.isclose(
+                    actual_candle[key], expected_candle[key], rel_tol=1e-9
+                ), f'{key} differs: {actual_candle} vs {expected_candle}'
+            else:
+                assert actual_candle[key] == expected_candle[key], (
+                    f'{key} differs: {actual_candle} vs {expected_candle}'
+                )
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_matches_the_candles_of_the_trades_at_the_coarse_windows(seed, make_state):
+    trades = random_trades(n_minutes=300, seed=seed)
+    fine_candles = aggregate_candles(trades, 60).to_dict('records')
+
+    candles = cascade_all(fine_candles, make_state, [300, 900])
+    last_fine_timestamp = {}
+    for candle in fine_candles:
+        last_fine_timestamp[candle['product_id']] = max(
+            candle['timestamp'], last_fine_timestamp.get(candle['product_id'], 0)
+        )
+
+    # the finest candles go through as they are
+    assert_same_candles(
+        [candle for candle in candles if candle['window_seconds'] == 60],
+        sorted(fine_candles, key=lambda candle: candle['timestamp']),
+    )
+    for window_seconds in [300, 900]:
+        expected = sorted(
+            aggregate_candles(trades, window_seconds).to_dict('records'),
+            key=lambda candle: (candle['product_id'], candle['timestamp']),
+        )
+        # a window is emitted by the finest candle that closes it, or a later one.
+        # The last window of a product may have neither, and still be open
+        expected = [
+            candle
+            for candle in expected
+            if candle['timestamp'] <= last_fine_timestamp[candle['product_id']]
+        ]
+
+        actual = sorted(
+            (
+                candle
+                for candle in candles
+                if candle['window_seconds'] == window_seconds
+            ),
+            key=lambda candle: (candle['product_id'], candle['timestamp']),
+        )
+        assert_same_candles(actual, expected)
+
+
+def fine_candle(minute: int, close: float, volume: float, product_id='BTC/USD'):
+    return {
+        'timestamp': START_MS + (minute + 1) * FINE_WINDOW_MS,
+        'open': close,
+        'high': close + 1,
+        'low': close - 1,
+        'close': close,
+        'volume': volume,
+        'vwap': close,
+        'trade_count': 1,
+        'buy_volume': volume,
+        'sell_volume': 0.0,
+        'product_id': product_id,
+    }
+
+
+def test_emits_a_window_without_a_closing_candle_with_the_next_one(state):
+    cascade = cascade_candles(60, [300])
+
+    assert [c['window_seconds'] for c in cascade(fine_candle(0, 10.0, 1.0), state)] == [
+        60
+    ]
+    # no candle for minute 4, which closes the window. Minute 6 is in the next one
+    candles = cascade(fine_candle(6, 20.0, 1.0), state)
+
+    assert [(c['window_seconds'], c['timestamp']) for c in candles] == [
+        (60, START_MS + 7 * FINE_WINDOW_MS),
+        (300, START_MS + 5 * FINE_WINDOW_MS),
+    ]
+    assert candles[1]['close'] == 10.0
+    assert state['candle_300s']['open'] == 20.0
+
+
+def test_merges_the_vwaps_weighted_by_volume(state):
+    cascade = cascade_candles(60, [120])
+
+    cascade(fine_candle(0, 10.0, 3.0), state)
+    (_, coarse) = cascade(fine_candle(1, 20.0, 1.0), state)
+
+    assert coarse['vwap'] == pytest.approx((10.0 * 3 + 20.0 * 1) / 4)
+    assert (coarse['volume'], coarse['trade_count']) == (4.0, 2)
+    assert (coarse['open'], coarse['high'], coarse['low'], coarse['close']) == (
+        10.0,
+        21.0,
+        9.0,
+        20.0,
+    )
+    # the window is closed, so nothing is left in the state
+    assert 'candle_120s' not in state
+
+
+def test_keeps_the_products_apart(make_state):
+    cascade = cascade_candles(60, [120])
+    states = {'BTC/USD': make_state(), 'ETH/USD': make_state()}
+
+    cascade(fine_candle(0, 10.0, 1.0), states['BTC/USD'])
+    cascade(fine_candle(0, 1_000.0, 1.0, 'ETH/USD'), states['ETH/USD'])
+    (_, btc) = cascade(fine_candle(1, 11.0, 1.0), states['BTC/USD'])
+    (_, eth) = cascade(fine_candle(1, 1_001.0, 1.0, 'ETH/USD'), states['ETH/USD'])
+
+    assert (btc['product_id'], btc['open'], btc['close']) == ('BTC/USD', 10.0, 11.0)
+    assert (eth['product_id'], eth['open'], eth['close']) == (
+        'ETH/USD',
+        1_000.0,
+        1_001.0,
+    )
@@ -0,0 +1,30 @@
+import pytest
+from pydantic import ValidationError
+
+
+@pytest.fixture(autouse=True)
+def live_config_env(monkeypatch):
+    # the variables of setup_live_config.sh, for the `config` of the module
+    monkeypatch.setenv('KAFKA_INPUT_TOPIC', 'trade')
+    monkeypatch.setenv('KAFKA_OUTPUT_TOPIC', 'ohlc')
+    monkeypatch.setenv('KAFKA_CONSUMER_GROUP', 'trade_to_ohlc_consumer_group')
+    monkeypatch.setenv('OHLC_WINDOW_SECONDS', '60')
+
+
+def test_closes_windows_on_the_wall_clock_with_live_trades():
+    from src.config import Config
+
+    config = Config(ohlc_aggregator='native', ohlc_close_windows_on='wall_clock')
+
+    assert config.live_or_historical == 'live'
+
+
+def test_rejects_the_wall_clock_with_historical_trades():
+    from src.config import Config
+
+    with pytest.raises(ValidationError, match='needs live trades'):
+        Config(
+            live_or_historical='historical',
+            ohlc_aggregator='native',
+            ohlc_close_windows_on='wall_clock',
+        )
@@ -0,0 +1,126 @@
+import json
+import time
+
+import pytest
+from quixstreams.models import Topic, TopicConfig
+
+from src.candle_aggregator import CandleAggregator
+from src.partial_candles import PartialCandlePublisher
+
+START_MS = 1_717_000_020_000 - 1_717_000_020_000 % 60_000
+
+
+class FakeProducer:
+    """Keeps the partial candles, with the time they were produced at."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.messages = []
+
+    def produce(self, topic, key, value):
+        self.messages.append((self.clock[0], topic, key.decode(), json.loads(value)))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """time.monotonic(), in seconds."""
+    now = [1_000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def producer(clock):
+    return FakeProducer(clock)
+
+
+@pytest.fixture
+def publisher(producer):
+    return PartialCandlePublisher(
+        CandleAggregator(window_seconds=60),
+        producer=producer,
+        topic=Topic(
+            'ohlc_partial',
+            config=TopicConfig(num_partitions=1, replication_factor=1),
+            value_serializer='json',
+        ),
+        min_interval_ms=500,
+    )
+
+
+def trade(offset_ms: int, price: float, product_id='BTC/USD') -> dict:
+    return {
+        'product_id': product_id,
+        'price': price,
+        'volume': 1.0,
+        'timestamp_ms': START_MS + offset_ms,
+        'side': 'sell',
+    }
+
+
+def test_publishes_the_first_trade_right_away(publisher, producer, make_state):
+    publisher(trade(0, 10.0), make_state())
+
+    ((_, topic, key, candle),) = producer.messages
+    assert (topic, key) == ('ohlc_partial', 'BTC/USD')
+    assert (candle['close'], candle['trade_count'], candle['sell_volume']) == (
+        10.0,
+        1,
+        1.0,
+    )
+    assert candle['timestamp'] == START_MS + 60_000
+
+
+def test_coalesces_the_trades_within_the_interval(
+    publisher, producer, clock, state, make_state
+):
+    for i, price in enumerate([10.0, 11.0, 12.0, 9.0]):
+        clock[0] += 0.1
+        publisher(trade(i, price), state)
+
+    assert len(producer.messages) == 1
+
+    # a trade of another product, once the interval is over, publishes the latest
+    # state of the pending one, once
+    clock[0] += 0.5
+    publisher(trade(10, 50.0, 'ETH/USD'), make_state())
+    clock[0] += 0.1
+    publisher(trade(11, 51.0, 'ETH/USD'), make_state())
+
+    btc_candles = [msg[3] for msg in producer.messages if msg[2] == 'BTC/USD']
+    assert len(btc_candles) == 2
+    assert (
+        btc_candles[-1]['high'],
+        btc_candles[-1]['low'],
+        btc_candles[-1]['close'],
+        btc_candles[-1]['trade_count'],
+    ) == (12.0, 9.0, 9.0, 4)
+
+
+def test_publishes_at_most_once_per_interval_and_the_latest_state(
+    publisher, producer, clock, make_state
+):
+    states = {'BTC/USD': make_state(), 'ETH/USD': make_state()}
+    n_trades = {'BTC/USD': 0, 'ETH/USD': 0}
+
+    # 3 seconds of trades every 30ms, alternating between the products
+    for i in range(100):
+        clock[0] += 0.03
+        product_id = ['BTC/USD', 'ETH/USD'][i % 2]
+        n_sent = len(producer.messages)
+        publisher(trade(i * 30, 100.0 + i, product_id), states[product_id])
+        n_trades[product_id] += 1
+
+        # any partial candle has all the trades of its product so far
+        for _, _, key, candle in producer.messages[n_sent:]:
+            assert candle['trade_count'] == n_trades[key]
+
+    for product_id in states:
+        sent_at = [msg[0] for msg in producer.messages if msg[2] == product_id]
+
+        # a partial candle every ~500ms, far less than one per trade
+        assert 5 <= len(sent_at) <= 7
+        assert all(
+            later - earlier >= 0.5 - 1e-9
+            for earlier, later in zip(sent_at, sent_at[1:])
+        )